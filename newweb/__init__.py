@@ -80,12 +80,20 @@ class NewWeb(object):
     """
     req = request.Request(env, self.registry)
     page_maker = self.page_class(req, config=self.config)
-    response = self.get_response(page_maker, req.path, req.method)
-    if not isinstance(response, Response):
-      req.response.text = response
-      response = req.response
-    start_response(response.status, response.headerlist)
-    yield response.content
+    try:
+      response = self.get_response(page_maker, req.path, req.method)
+      if not isinstance(response, Response):
+        req.response.text = response
+        response = req.response
+      start_response(response.status, response.headerlist)
+      for chunk in response:
+        yield chunk
+    finally:
+      # Runs when the body is exhausted, but also when the server closes this
+      # generator early. We're calling _PostRequest here as promised in docs.
+      # pylint: disable=W0212
+      page_maker._PostRequest()
+      # pylint: enable=W0212
 
   def get_response(self, page_maker, path, method):
     try:
@@ -0,0 +1,441 @@
+#!/usr/bin/python2.5
+"""Micro-benchmarks for SQLTalk internals.
+
+These work on synthetic data and need no database server. Run the module to
+execute all benchmarks, or pass the names of the ones to run:
+
+  python benchmark.py resultset columns converters sqlite bulkimport \
+      timestamps snapshot search
+
+Benchmarks of MySQL internals import underdark.libs.sqltalk.mysql, so the
+ext_lib directory should be on the PYTHONPATH. They need the _mysql extension
+module, and are skipped without it.
+"""
+__author__ = 'Elmer de Looff <elmer@underdark.nl>'
+__version__ = '0.1'
+
+# Standard modules
+import collections
+import datetime
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import weakref
+
+# Application specific modules
+import sqlresult
+
+BENCHMARKS = collections.OrderedDict()
+
+
+def Benchmark(name):
+  """Decorator that registers the decorated function as a named benchmark."""
+  def _Register(function):
+    BENCHMARKS[name] = function
+    return function
+  return _Register
+
+
+def BestTime(function, *args, **kwds):
+  """Returns the fastest of three runs of the function, in seconds."""
+  timings = []
+  for _run in range(3):
+    start = time.time()
+    function(*args, **kwds)
+    timings.append(time.time() - start)
+  return min(timings)
+
+
+def Report(title, *columns):
+  """Prints a row of benchmark results, the first column being the title."""
+  print '  %-34s%s' % (title, ''.join('%14s' % column for column in columns))
+
+
+# ##############################################################################
+# ResultSet storage and field lookups
+#
+class LegacyResultRow(object):
+  """The list-backed ResultRow as it was before rows were stored as tuples.
+
+  Only construction and name lookup are reproduced, for comparison.
+  """
+  __slots__ = ('_fields', '_values')
+
+  def __init__(self, fields, values):
+    self._fields = list(fields)
+    self._values = list(values)
+
+  def __getitem__(self, key):
+    if isinstance(key, int):
+      return self._values[key]
+    return self._values[self._fields.index(key)]
+
+
+@Benchmark('resultset')
+def ResultSetStorage(rows=100000, columns=10):
+  """Compares memory per row and lookup speed of legacy and current rows."""
+  names = ['field_%d' % column for column in range(columns)]
+  fields = [(name, 253, 0, 0, 0, 0, 0) for name in names]
+  result = tuple(tuple(row * columns + column for column in range(columns))
+                 for row in range(rows))
+  last = names[-1]
+
+  def LegacyBuild():
+    fieldnames = [field[0] for field in fields]
+    return [LegacyResultRow(fieldnames, row) for row in result]
+
+  def CurrentBuild():
+    return sqlresult.ResultSet(result=result, fields=fields)
+
+  def Iterate(rows):
+    for row in rows:
+      row[last]
+
+  def Access(row):
+    for _count in xrange(rows):
+      row[last]
+
+  legacy = LegacyBuild()
+  current = CurrentBuild()
+  legacy_size = (sys.getsizeof(legacy[0]) + sys.getsizeof(legacy[0]._fields) +
+                 sys.getsizeof(legacy[0]._values))
+  current_size = sys.getsizeof(result[0])
+  legacy_times = (BestTime(LegacyBuild), BestTime(Iterate, legacy),
+                  BestTime(Access, legacy[0]))
+  current_times = (BestTime(CurrentBuild), BestTime(Iterate, current),
+                   BestTime(Access, current[0]))
+  print 'ResultSet of %d rows, %d columns:' % (rows, columns)
+  Report('', 'legacy', 'current')
+  Report('bytes per row (excluding values)', legacy_size, current_size)
+  for title, legacy_time, current_time in zip(
+      ('build (ms)', 'iterate, get last field (ms)',
+       '%d lookups on one row (ms)' % rows),
+      legacy_times, current_times):
+    Report(title, '%.1f' % (legacy_time * 1000),
+           '%.1f' % (current_time * 1000))
+  Report('build and iterate (ms)', '%.1f' % (sum(legacy_times[:2]) * 1000),
+         '%.1f' % (sum(current_times[:2]) * 1000))
+
+
+@Benchmark('columns')
+def ColumnAggregation(rows=100000, columns=10):
+  """Compares summing a column over row views and over the exported column."""
+  fields = [('field_%d' % column, 3, 0, 0, 0, 0, 0)
+            for column in range(columns)]
+  result = tuple(tuple(row * columns + column for column in range(columns))
+                 for row in range(rows))
+  name = fields[-1][0]
+
+  def RowSum(resultset):
+    return sum(row[name] for row in resultset)
+
+  def ColumnSum(resultset, typecode=None):
+    return sum(resultset.Column(name, typecode))
+
+  def Fresh(function, *args):
+    return function(sqlresult.ResultSet(result=result, fields=fields), *args)
+
+  cached = sqlresult.ResultSet(result=result, fields=fields)
+  print 'Sum of one column over %d rows, %d columns:' % (rows, columns)
+  Report('', 'fresh set', 'cached column')
+  for title, function, args in (('per-row lookup (ms)', RowSum, ()),
+                                ('Column() tuple (ms)', ColumnSum, ()),
+                                ("Column() array 'l' (ms)", ColumnSum, ('l',))):
+    Report(title, '%.1f' % (BestTime(Fresh, function, *args) * 1000),
+           '%.1f' % (BestTime(function, cached, *args) * 1000))
+
+
+# ##############################################################################
+# MySQL result conversion
+#
+class LegacyConnection(object):
+  """Stand-in for the connection that per-value decoders referred to."""
+  charset = 'utf8'
+
+
+def LegacyDateTimeOrNone(string, _localize=None):
+  """The per-value DATETIME converter as it was before ResultConverter."""
+  if ' ' in string:
+    separator = ' '
+  elif 'T' in string:
+    separator = 'T'
+  else:
+    return None
+  try:
+    strdate, strtime = string.split(separator)
+    return _localize(
+        datetime.datetime(*map(int, strdate.split('-') + strtime.split(':'))))
+  except ValueError:
+    return None
+
+
+@Benchmark('converters')
+def ResultConversion(rows=20000, columns=20):
+  """Compares per-value conversion by _mysql with the compiled converter."""
+  try:
+    import pytz
+    from underdark.libs.sqltalk.mysql import constants
+    from underdark.libs.sqltalk.mysql import converters
+  except ImportError, error:
+    print 'Skipping result conversion benchmark: %s' % error
+    return
+  field_types = (constants.FIELD_TYPE.LONG, constants.FIELD_TYPE.VAR_STRING,
+                 constants.FIELD_TYPE.DATETIME, constants.FIELD_TYPE.BLOB)
+  types = [field_types[column % 4] for column in range(columns)]
+  stamps = ['2012-03-%02d %02d:00:00' % (day, hour)
+            for day in range(1, 29) for hour in range(24)]
+  samples = {constants.FIELD_TYPE.LONG: lambda row: row,
+             constants.FIELD_TYPE.VAR_STRING: lambda row: 'name %d' % row,
+             constants.FIELD_TYPE.DATETIME: lambda row: stamps[row % 100],
+             constants.FIELD_TYPE.BLOB: lambda row: 'text \xc3\xa9 %d' % row}
+  result = [tuple(samples[field_type](row) for field_type in types)
+            for row in range(rows)]
+  connection = LegacyConnection()
+  proxy = weakref.proxy(connection)
+  def StringDecoder(string):
+    return string.decode(proxy.charset)
+  def DateTimeOrNone(string):
+    return LegacyDateTimeOrNone(string, _localize=pytz.utc.localize)
+  legacy = {constants.FIELD_TYPE.VAR_STRING: StringDecoder,
+            constants.FIELD_TYPE.BLOB: StringDecoder,
+            constants.FIELD_TYPE.DATETIME: DateTimeOrNone}
+
+  def Legacy():
+    # _mysql calls the converter for every value; map() does the same from C.
+    columns = zip(*result)
+    for index, field_type in enumerate(types):
+      if field_type in legacy:
+        columns[index] = map(legacy[field_type], columns[index])
+    return columns
+
+  def Compiled():
+    return converters.ResultConverter(types, [0] * columns, 'utf8')(result)
+
+  print 'Converting %d rows, %d columns (%d text, %d datetime):' % (
+      rows, columns, types.count(constants.FIELD_TYPE.VAR_STRING) +
+      types.count(constants.FIELD_TYPE.BLOB),
+      types.count(constants.FIELD_TYPE.DATETIME))
+  Report('', 'per value', 'compiled')
+  Report('conversion (ms)', '%.1f' % (BestTime(Legacy) * 1000),
+         '%.1f' % (BestTime(Compiled) * 1000))
+
+
+# ##############################################################################
+# SQLite concurrent reads
+#
+@Benchmark('sqlite')
+def SqliteReads(rows=10000, queries=100, threads=(1, 2, 4, 8)):
+  """Compares concurrent reads on a ThreadedConnection and ConnectionManager."""
+  from underdark.libs.sqltalk import sqlite
+  directory = tempfile.mkdtemp()
+  try:
+    database = os.path.join(directory, 'benchmark.db')
+    with sqlite.Connect(database) as cursor:
+      cursor.Execute('CREATE TABLE item (id INTEGER, name TEXT)')
+      cursor.Execute('INSERT INTO item VALUES (?, ?)',
+                     [(row, 'name %d' % row) for row in range(rows)], many=True)
+    threaded = sqlite.ThreadConnect(database)
+    manager = sqlite.ConnectManager(database)
+
+    def Read(connection):
+      for _query in xrange(queries):
+        with connection as cursor:
+          cursor.Execute('SELECT SUM(LENGTH(name)) FROM item WHERE id % 7 = 0')
+
+    def Concurrent(connection, count):
+      workers = [threading.Thread(target=Read, args=(connection,))
+                 for _count in range(count)]
+      for worker in workers:
+        worker.start()
+      for worker in workers:
+        worker.join()
+
+    print '%d queries per thread over %d rows:' % (queries, rows)
+    Report('', 'threaded', 'manager')
+    for count in threads:
+      Report('%d threads (ms)' % count,
+             '%.1f' % (BestTime(Concurrent, threaded, count) * 1000),
+             '%.1f' % (BestTime(Concurrent, manager, count) * 1000))
+    manager.Close()
+  finally:
+    shutil.rmtree(directory)
+
+
+@Benchmark('bulkimport')
+def SqliteBulkImport(rows=200000, fields=5):
+  """Compares a multi-row Insert() with Import() in a BulkImport transaction."""
+  from underdark.libs.sqltalk import sqlite
+  names = ['field_%d' % field for field in range(fields)]
+  data = [tuple('value %d' % (row * fields + field) for field in range(fields))
+          for row in range(rows)]
+  directory = tempfile.mkdtemp()
+
+  def Load(bulk):
+    database = os.path.join(directory, 'benchmark_%d.db' % len(os.listdir(
+        directory)))
+    connection = sqlite.Connect(database)
+    with connection as cursor:
+      cursor.Execute('CREATE TABLE item (%s)' % ', '.join(names))
+    if bulk:
+      with connection.BulkImport(journal_mode='MEMORY') as cursor:
+        cursor.Import('item', names, data)
+    else:
+      with connection as cursor:
+        cursor.Insert('item', [dict(zip(names, row)) for row in data])
+    connection.close()
+
+  try:
+    print 'Loading %d rows of %d text fields into a new database:' % (
+        rows, fields)
+    Report('', 'Insert()', 'BulkImport')
+    Report('load (ms)', '%.1f' % (BestTime(Load, False) * 1000),
+           '%.1f' % (BestTime(Load, True) * 1000))
+  finally:
+    shutil.rmtree(directory)
+
+
+def LegacyConvertTimestamp(date_obj):
+  """The SQLite TIMESTAMP converter as it was before format slicing/caching."""
+  import pytz
+  sep = 'T' if 'T' in date_obj else ' '
+  try:
+    datepart, timepart = date_obj.split(sep)
+    return pytz.utc.localize(
+        datetime.datetime.fromordinal(int(datepart)) +
+        datetime.timedelta(microseconds=int(timepart) * 1000))
+  except ValueError:
+    date_obj, _sep, microseconds = date_obj.partition('.')
+    time_tuple = time.strptime(date_obj, '%Y-%m-%d' + sep + '%H:%M:%S')[:6]
+    if microseconds:
+      microseconds = int((microseconds + '00000')[:6])
+      time_tuple += microseconds,
+    return pytz.utc.localize(datetime.datetime(*time_tuple))
+
+
+@Benchmark('timestamps')
+def SqliteTimestamps(rows=1000000, distinct=1000):
+  """Compares the legacy and current TIMESTAMP converters on full scans."""
+  import _sqlite3
+  from underdark.libs.sqltalk import sqlite
+  _sqlite3.register_converter('LEGACY_TIMESTAMP', LegacyConvertTimestamp)
+  start = datetime.datetime(2012, 3, 1, tzinfo=sqlite.converters.UTC)
+  tables = (('unique, compact', lambda row: start + datetime.timedelta(
+                 seconds=row)),
+            ('repeating, compact', lambda row: start + datetime.timedelta(
+                 seconds=row % distinct)),
+            ('unique, ISO-8601', lambda row: (start + datetime.timedelta(
+                 seconds=row)).strftime('%Y-%m-%dT%H:%M:%S')))
+  connection = sqlite.Connect(':memory:')
+  with connection as cursor:
+    for number, (_title, stamp) in enumerate(tables):
+      cursor.Execute('CREATE TABLE log_%d (current TIMESTAMP, '
+                     'legacy LEGACY_TIMESTAMP)' % number)
+      cursor.Import('log_%d' % number, ('current', 'legacy'),
+                    ((value, value) for value in map(stamp, xrange(rows))))
+
+  def Scan(field, number):
+    connection.execute('SELECT %s FROM log_%d' % (field, number)).fetchall()
+
+  print 'Scanning %d timestamps (%d distinct when repeating):' % (
+      rows, distinct)
+  Report('', 'legacy', 'current')
+  for number, (title, _stamp) in enumerate(tables):
+    Report(title + ' (ms)', '%.1f' % (BestTime(Scan, 'legacy', number) * 1000),
+           '%.1f' % (BestTime(Scan, 'current', number) * 1000))
+  connection.close()
+
+
+@Benchmark('snapshot')
+def SqliteSnapshotLookups(rows=10000, lookups=20000):
+  """Compares keyed lookups on the database file and an in-memory snapshot."""
+  from underdark.libs.sqltalk import sqlite
+  directory = tempfile.mkdtemp()
+  try:
+    database = os.path.join(directory, 'benchmark.db')
+    with sqlite.Connect(database) as cursor:
+      cursor.Execute('CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT)')
+      cursor.Import('item', ('id', 'name'),
+                    ((row, 'name %d' % row) for row in xrange(rows)))
+    managers = (sqlite.ConnectManager(database),
+                sqlite.ConnectSnapshot(database, interval=3600))
+
+    def Lookups(manager):
+      for lookup in xrange(lookups):
+        with manager as cursor:
+          cursor.Select('item', conditions='id=?', args=(lookup % rows,))
+
+    def Scans(manager):
+      for scan in xrange(lookups // 100):
+        with manager as cursor:
+          cursor.Select('item', fields='id', conditions='name LIKE ?',
+                        args=('%%%d%%' % scan,))
+
+    print '%d transactions with a keyed lookup, table of %d rows:' % (
+        lookups, rows)
+    Report('', 'file (WAL)', 'snapshot')
+    Report('lookups (ms)', *('%.1f' % (BestTime(Lookups, manager) * 1000)
+                             for manager in managers))
+    Report('%d table scans (ms)' % (lookups // 100), *(
+        '%.1f' % (BestTime(Scans, manager) * 1000) for manager in managers))
+    for manager in managers:
+      manager.Close()
+  finally:
+    shutil.rmtree(directory)
+
+
+@Benchmark('search')
+def SqliteSearch(rows=100000, words=20, vocabulary=5000, searches=50):
+  """Compares LIKE scans with full-text searches on an FTS5 index."""
+  from underdark.libs.sqltalk import sqlite
+  generator = random.Random(42)
+  vocabulary = ['word%d' % word for word in xrange(vocabulary)]
+  terms = generator.sample(vocabulary, searches)
+  connection = sqlite.Connect(':memory:')
+  with connection.BulkImport() as cursor:
+    cursor.Execute('CREATE TABLE article (ID INTEGER PRIMARY KEY, body TEXT)')
+    cursor.Execute('CREATE VIRTUAL TABLE article_search USING fts5(body)')
+    cursor.Import('article', ('ID', 'body'), (
+        (row, ' '.join(generator.sample(vocabulary, words)))
+        for row in xrange(rows)))
+    cursor.Execute('INSERT INTO article_search (rowid, body) '
+                   'SELECT ID, body FROM article')
+
+  def Like(limit):
+    for term in terms:
+      connection.execute(
+          'SELECT * FROM article WHERE body LIKE ? LIMIT ?',
+          ('%%%s%%' % term, limit)).fetchall()
+
+  def Match(limit):
+    for term in terms:
+      connection.execute(
+          'SELECT article.* FROM article_search JOIN article '
+          'ON article.ID = article_search.rowid WHERE article_search MATCH ? '
+          'ORDER BY article_search.rank LIMIT ?', (term, limit)).fetchall()
+
+  print '%d single-word searches over %d rows of %d words:' % (
+      searches, rows, words)
+  Report('', 'LIKE', 'FTS5 MATCH')
+  for limit in (10, -1):
+    Report('%s (ms)' % ('first 10' if limit > 0 else 'all matches'),
+           '%.1f' % (BestTime(Like, limit) * 1000),
+           '%.1f' % (BestTime(Match, limit) * 1000))
+  connection.close()
+
+
+def main(names):
+  """Runs the named benchmarks, or all of them if none are named."""
+  for name in names or BENCHMARKS:
+    if name not in BENCHMARKS:
+      sys.exit('Unknown benchmark %r, choose from: %s' % (
+          name, ', '.join(BENCHMARKS)))
+    BENCHMARKS[name]()
+    print
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
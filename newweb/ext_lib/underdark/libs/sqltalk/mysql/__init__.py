@@ -15,6 +15,8 @@ Functions:
   Connect: Connects to a MySQL server and returns a connection object.
            Refer to the documentation enclosed in the connections module for
            argument information.
+  ConnectPool: Returns a pool of connections to a MySQL server, for use by
+               multiple threads. Refer to the pool module for pool options.
 """
 __author__ = 'Elmer de Looff <elmer@underdark.nl>'
 __version__ = '0.9'
@@ -22,6 +24,7 @@ __version__ = '0.9'
 # Application specific modules
 import constants
 import connection
+import pool
 
 
 class SqlTypeSet(frozenset):
@@ -39,6 +42,22 @@ def Connect(*args, **kwargs):
   return connection.Connection(*args, **kwargs)
 
 
+def ConnectPool(*args, **kwargs):
+  """Factory function for pool.ConnectionPool.
+
+  Keyword arguments with a 'pool_' prefix configure the pool (e.g. `pool_size`
+  is passed on as `size`), all other arguments are used to create connections.
+
+  Pool validation is off by default: connections check their own liveness when
+  a transaction starts, according to their `ping_interval` and `reconnect`.
+  """
+  pool_options = {'validate': False}
+  for key in kwargs.keys():
+    if key.startswith('pool_'):
+      pool_options[key[5:]] = kwargs.pop(key)
+  return pool.ConnectionPool(lambda: Connect(*args, **kwargs), **pool_options)
+
+
 STRING = SqlTypeSet((constants.FIELD_TYPE.ENUM, constants.FIELD_TYPE.STRING,
                      constants.FIELD_TYPE.VAR_STRING))
 BINARY = SqlTypeSet((constants.FIELD_TYPE.BLOB,
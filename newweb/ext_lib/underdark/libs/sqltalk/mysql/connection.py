@@ -4,23 +4,139 @@ a MySQL database. From this connection, cursor objects can be created, which
 use the escaping and character encoding facilities offered by the connection.
 """
 __author__ = 'Elmer de Looff <elmer@underdark.nl>'
-__version__ = '0.16'
+__version__ = '0.18'
 
 # Standard modules
 import _mysql
+import collections
 import logging
+import sys
 import threading
+import time
+import traceback
 import weakref
 
 # Application specific modules
 import constants
 import converters
 import cursor
+import statement
 from .. import sqlresult
+from .. import watchdog
+
+
+class QueryLog(object):
+  """Bounded log of the queries executed in the current transaction.
+
+  Queries are kept as the byte strings that were sent to the server, and only
+  decoded when the log is read, which typically happens only for error reports
+  and debug output. Once `maxlen` queries are logged, the oldest are dropped.
+  """
+  def __init__(self, maxlen, charset=None):
+    self._queries = collections.deque(maxlen=maxlen)
+    self.charset = charset
+
+  def __iter__(self):
+    """Yields the logged queries as unicode, oldest first.
+
+    A snapshot of the log is taken first, so this is safe to use while another
+    thread is adding queries to it.
+    """
+    charset = self.charset or 'utf8'
+    for query in tuple(self._queries):
+      yield query.decode(charset, 'replace')
+
+  def __len__(self):
+    return len(self._queries)
+
+  def __repr__(self):
+    return '<%s of %d queries (max %s)>' % (
+        self.__class__.__name__, len(self), self.maxlen)
+
+  def append(self, query):
+    """Adds a query to the log, dropping the oldest one if the log is full."""
+    if isinstance(query, unicode):
+      query = query.encode(self.charset or 'utf8')
+    self._queries.append(query)
+
+  def clear(self):
+    """Removes all queries from the log."""
+    self._queries.clear()
+
+  @property
+  def maxlen(self):
+    """Returns the maximum number of queries kept in the log."""
+    return self._queries.maxlen
+
+
+class ResultStream(object):
+  """Iterator over the rows of an unbuffered (streaming) query result.
+
+  Rows are fetched from the server in batches, so only one batch is held in
+  client memory at a time. Until the stream is exhausted or closed, the
+  connection cannot be used for anything else. Sending another query on the
+  connection closes the stream first, discarding its unread rows.
+
+  Members:
+    @ fields: tuple
+      Fields in the result, as per the Python DB API (v2).
+    @ fieldnames: list
+      Names of the fields in the result.
+    @ query: unicode
+      The query that gave this result.
+  """
+  def __init__(self, connection, result, query, batch, row_class):
+    self.connection = connection
+    self.fields = result.describe() if result else ()
+    self.fieldnames = [field[0] for field in self.fields]
+    self._index = sqlresult.FieldIndex(self.fieldnames)
+    self._convert = connection.ResultConverter(result) if result else None
+    self.query = query
+    self.batch = batch
+    self.row_class = row_class
+    self._result = result
+    self._rows = iter(())
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, _exc_type, _exc_value, _exc_traceback):
+    self.close()
+
+  def __iter__(self):
+    return self
+
+  def next(self):
+    """Returns the next row as a ResultRow (or the stream's `row_class`)."""
+    for row in self._rows:
+      return self.row_class(self._index, row)
+    if self._result is not None:
+      rows = self._result.fetch_row(self.batch, 0)
+      if rows:
+        self._rows = iter(self._convert(rows))
+        return self.next()
+      self.close()
+    raise StopIteration
+
+  def close(self):
+    """Closes the stream, reading and discarding any rows not yet fetched."""
+    result, self._result = self._result, None
+    self._rows = iter(())
+    if self.connection._stream is self:
+      # pylint: disable=W0212
+      self.connection._stream = None
+      # pylint: enable=W0212
+      if result is not None:
+        while result.fetch_row(self.batch, 0):
+          pass
+      while self.connection.next_result() == 0:
+        self.connection.store_result()
 
 
 class Connection(_mysql.connection):
   """MySQL Database Connection Object"""
+  # Number of compiled result converters that are kept for reuse.
+  RESULT_CONVERTERS = 256
 
   def __init__(self, user, passwd, *args, **kwargs):
     """Create a connection to the database. It is strongly recommended
@@ -63,6 +179,35 @@ class Connection(_mysql.connection):
                           be raised.
       local_infile:       bool, True enables LOAD LOCAL INFILE, False disables.
                           Default False
+      ping_interval:      number of seconds the connection may be idle before
+                          starting a transaction checks whether the server is
+                          still there. None never checks, 0 always checks.
+                          Default 30
+      reconnect:          bool, reconnect when the server has gone away, either
+                          during the above check, or when sending the first
+                          statement of a transaction (or any statement in
+                          autocommit mode), which is then retried once.
+                          Session settings (autocommit, charset and sql_mode)
+                          are restored after reconnecting. Default True
+      transaction_warn:   number of seconds after which a transaction that is
+                          still open is logged as a warning, along with its
+                          queries. None disables the warning. Default 60
+      transaction_stack:  bool, also log the stack of the thread holding the
+                          transaction in the above warning. Default False
+      query_log:          number of queries of the current transaction to keep
+                          for error reports. With 0 and debug off, queries are
+                          not logged at all. Default 100
+      statement_cache:    number of parameterized statements (see the statement
+                          module) kept parsed, and possibly prepared on the
+                          server. Default 100
+      server_prepare:     bool, execute parameterized statements as statements
+                          prepared on the server, rather than binding their
+                          arguments on the client. Default False
+      query_cache:        querycache.QueryCache, results cache for the cursor
+                          returned by Cursor.Cached(). Writes through any
+                          cursor invalidate the tables they touch in it. The
+                          cache may be shared by several connections.
+                          Default None
 
     There are a number of undocumented, non-standard arguments. See the
     documentation for the MySQL C API for some hints on what they do.
@@ -70,10 +215,29 @@ class Connection(_mysql.connection):
     # Counters, transaction lock & timer
     self.counter_transactions = 0
     self.counter_queries = 0
-    self.queries = []
+    self.counter_reconnects = 0
+    self.queries = QueryLog(kwargs.pop('query_log', 100))
+    self.statements = statement.StatementCache(
+        kwargs.pop('statement_cache', 100))
+    self.server_prepare = kwargs.pop('server_prepare', False)
+    self.query_cache = kwargs.pop('query_cache', None)
+    self.transaction_writes = set()
+    self.transaction_queries = 0
+    self._stream = None
+    self._result_converters = {}
     self.transaction_timer = None
     self.lock = threading.Lock()
 
+    # Liveness policy
+    self.ping_interval = kwargs.pop('ping_interval', 30)
+    self.reconnect = kwargs.pop('reconnect', True)
+    self.last_used = time.time()
+    self._autocommit = None
+
+    # Long transaction warnings
+    self.transaction_warn = kwargs.pop('transaction_warn', 60)
+    self.transaction_stack = kwargs.pop('transaction_stack', False)
+
     # _mysql connect args mapping
     kwargs['user'] = user
     kwargs['passwd'] = passwd
@@ -89,12 +253,10 @@ class Connection(_mysql.connection):
     if kwargs.pop('disable_log', False):
       self.logger.disable_logger = True
 
-    self.encoders = {}
+    self.encoders = converters.Encoders(converters.ENCODERS)
     converts = {}
     for key, value in converters.CONVERSIONS.iteritems():
-      if not isinstance(key, int):
-        self.encoders[key] = value
-      else:
+      if isinstance(key, int):
         if isinstance(value, list):
           converts[key] = value[:]
         else:
@@ -117,8 +279,6 @@ class Connection(_mysql.connection):
     super(Connection, self).__init__(*args, **kwargs)
 
     self.server_version = tuple(map(int, self.get_server_info().split('.')[:2]))
-    if sql_mode:
-      self.SetSqlMode(sql_mode)
 
     # The following voodoo is necssary to avoid double references that would
     # prevent a connection object from being finalized and collected properly.
@@ -135,28 +295,18 @@ class Connection(_mysql.connection):
         return db.EscapeValues(u_string.encode(db.charset))
       return UnicodeLiteral
 
-    def _GetStringDecoder():
-      def StringDecoder(string):
-        """Returns the unicode codepoints for an encoded bytestream."""
-        return string.decode(db.charset)
-      return StringDecoder
-
-    self.string_decoder = _GetStringDecoder()
     self.encoders[str] = _GetStringLiteral()
     self.encoders[unicode] = self.unicode_literal = _GetUnicodeLiteral()
 
-    if use_unicode:
-      decoder = None, self.string_decoder
-      self.converter[constants.FIELD_TYPE.STRING].append(decoder)
-      self.converter[constants.FIELD_TYPE.VAR_STRING].append(decoder)
-      self.converter[constants.FIELD_TYPE.VARCHAR].append(decoder)
-      self.converter[constants.FIELD_TYPE.BLOB].append(decoder)
+    self.use_unicode = use_unicode
     self._charset = None
     self.charset = charset or self.character_set_name()
+    self.sql_mode = None
+    if sql_mode:
+      self.SetSqlMode(sql_mode)
 
     self.transactional = bool(self.server_capabilities &
                               constants.CLIENT.TRANSACTIONS)
-    self._autocommit = None
     if autocommit is not None:
       self.autocommit = autocommit
     else:
@@ -166,9 +316,16 @@ class Connection(_mysql.connection):
     """Refreshes the connection and returns a cursor, starting a transaction."""
     if self.lock.acquire(False):  # Don't block. fail when it's in use.
       self.counter_transactions += 1
-      del self.queries[:]
-      self.ping(True)
-      self.ping(self.autocommit)
+      self.transaction_queries = 0
+      self.transaction_writes.clear()
+      self.queries.clear()
+      if (self.ping_interval is not None and
+          time.time() - self.last_used > self.ping_interval):
+        try:
+          self.Ping()
+        except Exception:
+          self.lock.release()
+          raise
       self.StartTransactionTimer()
       return cursor.Cursor(self)
     raise self.OperationalError(
@@ -177,6 +334,8 @@ class Connection(_mysql.connection):
   def __exit__(self, exc_type, exc_value, _exc_traceback):
     """End of transaction: commits on success, or rolls back on failure."""
     self.ResetTransactionTimer()
+    if self._stream is not None:
+      self._stream.close()
     if exc_type:
       self.rollback()
       self.logger.exception(
@@ -188,6 +347,10 @@ class Connection(_mysql.connection):
       self.commit()
       self.logger.debug(
           'Transaction committed (server: %r).', self.get_host_info())
+    if self.transaction_writes:
+      # Results cached by others while the transaction ran are outdated now.
+      self.query_cache.Invalidate(*self.transaction_writes)
+    self.last_used = time.time()
     self.lock.release()
 
   def CurrentDatabase(self):
@@ -208,7 +371,10 @@ class Connection(_mysql.connection):
     """Escapes any object passed in following the encoders dictionary.
 
     Sequences and mappings will only have their contents escaped. All strings
-    will be encoded to the connection's character set.
+    will be encoded to the connection's character set. Records (from newweb's
+    model) are escaped as their primary key. The encoders are a
+    converters.Encoders mapping, so subclasses of known types get the encoder
+    of their base class.
     """
     return self.escape(obj, self.encoders)
 
@@ -223,16 +389,172 @@ class Connection(_mysql.connection):
             'charset': self.charset,
             'server': self.ServerInfo()}
 
+  @property
+  def log_queries(self):
+    """Returns whether executed queries should be logged at all."""
+    return self.debug or bool(self.queries.maxlen)
+
+  def Ping(self):
+    """Checks that the server is still there, reconnecting if it is not.
+
+    Reconnecting is only done if the connection was created with `reconnect`
+    enabled, otherwise the OperationalError from the failed ping is raised.
+    """
+    try:
+      self.ping()
+    except self.OperationalError:
+      if not self.reconnect:
+        raise
+      self._Reconnect()
+    self.last_used = time.time()
+
   def Query(self, query_string):
-    self.counter_queries += 1
+    """Executes the given query and returns its result as a ResultSet.
+
+    For multi-statement queries, the result of the last statement is returned.
+    """
     if isinstance(query_string, unicode):
       query_string = query_string.encode(self.charset)
-    self.query(query_string)
+    self._SendQuery(query_string)
+    return self._StoreResult(query_string)
+
+  def QueryStream(self, query_string, batch=1000,
+                  row_class=sqlresult.ResultRow):
+    """Executes the given query and returns a stream of its result rows.
+
+    Unlike Query(), which stores the full result in client memory, this reads
+    the result from the server as it is iterated, `batch` rows at a time.
+
+    Arguments:
+      @ query_string: basestring
+        The query to execute.
+      % batch: int ~~ 1000
+        Number of rows to fetch from the server at once.
+      % row_class: type ~~ sqlresult.ResultRow
+        Called with the field names and values to create each row.
+
+    Returns:
+      ResultStream: iterator over the result rows.
+    """
+    if isinstance(query_string, unicode):
+      query_string = query_string.encode(self.charset)
+    self._SendQuery(query_string)
+    self._stream = ResultStream(
+        self, self.use_result(), query_string.decode(self.charset, 'ignore'),
+        batch, row_class)
+    return self._stream
+
+  def QueryBatch(self, queries):
+    """Executes several queries in a single round trip to the server.
+
+    The queries are sent as one multi-statement query, after which the result
+    of every statement is read. If a statement fails, the server does not run
+    the ones after it, and the error is raised once the results before it have
+    been read.
+
+    Arguments:
+      @ queries: list of str
+        The (encoded) queries, a single statement each.
+
+    Returns:
+      list of sqlresult.ResultSet: one for each statement, in order.
+    """
+    batch = '; '.join(queries)
+    self._SendQuery(batch)
+    results = [self._ResultSet(self.store_result(), queries[0])]
+    while self.next_result() == 0:
+      label = queries[len(results)] if len(results) < len(queries) else batch
+      results.append(self._ResultSet(self.store_result(), label))
+    return results
+
+  def QueryPrepared(self, stmt, args):
+    """Executes a statement prepared on the server, preparing it if needed.
+
+    The arguments are passed to the server as user variables. Deallocating
+    statements evicted from the cache, preparing, setting the variables and
+    executing are sent together as a multi-statement query, so this costs only
+    a single round trip to the server.
+
+    Arguments:
+      @ stmt: statement.Statement
+        The statement to execute, typically from the connection's cache.
+      @ args: sequence / mapping
+        Values for the statement's placeholders.
+
+    Returns:
+      sqlresult.ResultSet instance holding all query result data.
+    """
+    values = self.EscapeValues(stmt.Values(args))
+    try:
+      return self._QueryPrepared(stmt, values)
+    except self.Error, error:
+      if error[0] != constants.ER.UNKNOWN_STMT_HANDLER:
+        raise
+      # The server lost the statement, typically due to a reconnect.
+      stmt.prepared = False
+      return self._QueryPrepared(stmt, values)
+
+  def _QueryPrepared(self, stmt, values):
+    """Sends the query that (prepares and) executes the given statement."""
+    queries = ['DEALLOCATE PREPARE %s' % evicted.handle
+               for evicted in self.statements.evicted]
+    del self.statements.evicted[:]
+    if not stmt.prepared:
+      queries.append('PREPARE %s FROM %s' % (
+          stmt.handle, self.string_literal(stmt.server_sql)))
+    if values:
+      variables = ['@%s_%d' % (stmt.handle, index)
+                   for index in range(len(values))]
+      queries.append('SET %s' % ', '.join(
+          '%s=%s' % assignment for assignment in zip(variables, values)))
+      queries.append('EXECUTE %s USING %s' % (
+          stmt.handle, ', '.join(variables)))
+    else:
+      queries.append('EXECUTE %s' % stmt.handle)
+    self._SendQuery('; '.join(queries))
+    stmt.prepared = True
+    if stmt.sql not in self.statements:
+      # Not cached, so it won't be used again. Deallocate it with the next one.
+      self.statements.evicted.append(stmt)
+    return self._StoreResult(stmt.sql)
+
+  def _SendQuery(self, query_string):
+    """Sends the (encoded) query, reconnecting and retrying where possible."""
+    if self._stream is not None:
+      self._stream.close()
+    self.counter_queries += 1
+    # Retrying is only safe if losing the session loses no transaction state.
+    retry = self.reconnect and (
+        self._autocommit or not self.transaction_queries)
+    self.transaction_queries += 1
+    try:
+      self.query(query_string)
+    except self.OperationalError, error:
+      if not retry or error[0] != constants.CR.SERVER_GONE_ERROR:
+        raise
+      self.logger.warning('MySQL server has gone away, reconnecting to retry.')
+      self._Reconnect()
+      self.query(query_string)
+    self.last_used = time.time()
+
+  def _StoreResult(self, query_string):
+    """Returns a ResultSet for the last result of the query that was just sent.
+
+    Results of all but the last statement of a multi-statement query are
+    discarded, so the connection is ready for the next query.
+    """
     stored_result = self.store_result()
+    while self.next_result() == 0:
+      stored_result = self.store_result()
+    return self._ResultSet(stored_result, query_string)
+
+  def _ResultSet(self, stored_result, query_string):
+    """Returns a ResultSet for the stored result of the current statement."""
     if stored_result:
       fields = stored_result.describe()
       # fetch_row call has a limit and type (0: tuples, 1: dicts)
-      result = stored_result.fetch_row(0, 0)
+      result = self.ResultConverter(stored_result)(
+          stored_result.fetch_row(0, 0))
     else:
       fields = []
       result = []
@@ -244,6 +566,23 @@ class Connection(_mysql.connection):
         query=query_string.decode(self.charset, 'ignore'),
         result=result)
 
+  def ResultConverter(self, result):
+    """Returns the converter for rows of the given (stored or used) result.
+
+    Converters are compiled once for each distinct result description and
+    character set, and kept for reuse.
+    """
+    key = (tuple(field[1] for field in result.describe()),
+           result.field_flags(), self.use_unicode and self.charset)
+    try:
+      return self._result_converters[key]
+    except KeyError:
+      if len(self._result_converters) >= self.RESULT_CONVERTERS:
+        self._result_converters.clear()
+      converter = self._result_converters[key] = converters.ResultConverter(
+          key[0], key[1], charset=key[2])
+      return converter
+
   def ServerInfo(self):
     """Returns a mysql specific set of server information"""
     return self.get_server_info()
@@ -253,6 +592,7 @@ class Connection(_mysql.connection):
     if self.server_version < (4, 1):
       raise self.NotSupportedError('server is too old to set sql_mode')
     self.Query('SET SESSION sql_mode=%s' % self.EscapeValues(sql_mode))
+    self.sql_mode = sql_mode
 
   def ShowWarnings(self):
     """Return detailed information about warnings as a sequence of tuples of
@@ -262,24 +602,29 @@ class Connection(_mysql.connection):
       return ()
     return self.Query('SHOW WARNINGS')
 
-  def StartTransactionTimer(self, delay=60):
+  def StartTransactionTimer(self, delay=None):
     """Writes a warning to the log if the transaction is open too long.
 
-    N.B. The timer is only set when the connection is in debug mode. Calling
-    this method on a non-debug connection will do nothing.
-    """
-    def Warn(caller, delay=delay):
-      self.logger.warning('Transaction open for more than %s seconds.', delay)
+    The timer is a watch on the process-wide watchdog thread, so this is cheap
+    enough to do for every transaction.
 
-    if self.debug:
-      self.transaction_timer = threading.Timer(delay, Warn)
-      self.transaction_timer.daemon = True
-      self.transaction_timer.start()
+    Arguments:
+      % delay: float ~~ None
+        Seconds after which to warn. Defaults to the connection's
+        `transaction_warn`; when that is None no timer is set.
+    """
+    if delay is None:
+      delay = self.transaction_warn
+    if delay is not None:
+      self.transaction_timer = watchdog.Watch(
+          delay, self._WarnLongTransaction, delay,
+          threading.current_thread().ident)
 
   def ResetTransactionTimer(self):
     """Resets any existing transaction timer."""
     if self.transaction_timer:
-      self.transaction_timer.cancel()
+      self.transaction_timer.Cancel()
+      self.transaction_timer = None
 
   def _GetAutocommitState(self):
     """This returns the current setting for autocommiting transactions."""
@@ -292,19 +637,55 @@ class Connection(_mysql.connection):
     """
     return self._charset
 
+  def _Reconnect(self):
+    """Reconnects to the server and restores the session settings.
+
+    The client library does the actual reconnect, after which its automatic
+    reconnecting is disabled again; that would silently drop session settings.
+    """
+    self.ping(True)
+    self.ping(False)
+    self.counter_reconnects += 1
+    self.statements.Reset()
+    super(Connection, self).set_character_set(self._charset)
+    super(Connection, self).autocommit(self._autocommit)
+    if self.sql_mode:
+      self.query('SET SESSION sql_mode=%s' % self.EscapeValues(self.sql_mode))
+    self.logger.warning('Reconnected to %s.', self.get_host_info())
+
+  def _WarnLongTransaction(self, delay, thread_id):
+    """Logs the queries of a long running transaction, and possibly a stack.
+
+    N.B. This runs on the watchdog thread, while the transaction is still in
+    progress in the thread identified by `thread_id`.
+    """
+    message = ['Transaction open for more than %s seconds.' % delay,
+               'Queries in transaction so far:\n\n%s' % (
+                   '\n\n'.join(self.queries))]
+    if self.transaction_stack:
+      # pylint: disable=W0212
+      frame = sys._current_frames().get(thread_id)
+      # pylint: enable=W0212
+      if frame is not None:
+        message.append('Stack of the thread holding the transaction:\n%s' %
+                       ''.join(traceback.format_stack(frame)))
+    self.logger.warning('\n'.join(message))
+
   def _SetAutocommitState(self, state):
     """This sets the autocommit mode on the connection.
 
-    This is False by default if the database supports transactions."""
-    self.ping(state)
-    super(Connection, self).autocommit(state)
-    self._autocommit = state
+    This is False by default if the database supports transactions. The server
+    is only told about the new mode if it differs from the current one."""
+    state = bool(state)
+    if state != self._autocommit:
+      super(Connection, self).autocommit(state)
+      self._autocommit = state
 
   def _SetCharacterSet(self, charset):
     """This sets the character set, refer to _GetCharacterSet for doc."""
     if charset != self._charset:
       super(Connection, self).set_character_set(charset)
-      self._charset = charset
+      self._charset = self.queries.charset = charset
 
   autocommit = property(_GetAutocommitState, _SetAutocommitState)
   charset = property(_GetCharacterSet, _SetCharacterSet)
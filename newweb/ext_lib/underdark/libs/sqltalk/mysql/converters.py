@@ -14,7 +14,8 @@ Conversion function:
 
   Returns: Python object
 
-Key: Python type object (from types) or class
+Key: Python type object (from types) or class; subclasses of these are
+     resolved by the Encoders mapping (see there)
 
 Conversion function:
 
@@ -30,12 +31,21 @@ Conversion function:
 Don't modify conversions if you can avoid it. Instead, make copies
 (with the copy() method), modify the copies, and then pass them to
 MySQL.connect().
+
+Text and temporal columns are not converted by _mysql, which would call a
+Python function for every value. Instead, a ResultConverter is compiled once
+for each result description. It converts these columns after fetching, a whole
+column at a time: text is decoded in a single pass, and temporal values (often
+repeated) are parsed once for each distinct value. The parsers for those are
+in POST_CONVERSIONS.
 """
 
 # Standard modules
 import array
+import collections
 import datetime
 import decimal
+import itertools
 import time
 import _mysql
 
@@ -63,25 +73,12 @@ def Float2Str(obj, conv_dict=None):
 def Instance2Str(obj, conv_dict):
   """Convert an Instance to a string representation. If the __str__() method
   produces acceptable output, then you don't need to add the class to
-  conversions; it will be handled by the default converter. If the exact class
-  is not found in conv_dict, it will use the first class it can find for which
-  obj is an instance.
+  conversions; it will be handled by the default converter.
+
+  Subclasses of types in the conversions are handled by the Encoders mapping,
+  this is only used for objects without an encoder for any of their bases.
   """
-  if obj.__class__ in (object, type):
-    return conv_dict[str](obj, conv_dict)
-  try:
-    return conv_dict[obj.__class__](obj, conv_dict)
-  except KeyError:
-    for converter in conv_dict:
-      try:
-        if (isinstance(obj, converter) and
-            conv_dict[converter] is not Instance2Str):
-          conv_dict[obj.__class__] = conv_dict[converter]
-          return conv_dict[converter](obj, conv_dict)
-      except TypeError:
-        continue
-    else:
-      return conv_dict[str](obj, conv_dict)
+  return conv_dict[str](obj, conv_dict)
 
 
 def None2NULL(obj=None, conv_dict=None):
@@ -89,6 +86,15 @@ def None2NULL(obj=None, conv_dict=None):
   return 'NULL'
 
 
+def Record2Literal(obj, conv_dict):
+  """Converts a record to the literal for its primary key (a tuple if compound).
+
+  Records are recognized by their `_PRIMARY_KEY` attribute and `key` property,
+  as provided by newweb's model.BaseRecord.
+  """
+  return _mysql.escape(obj.key, conv_dict)
+
+
 def Set2Str(obj, conv_dict):
   """Converts any itertable object into a comma separated string."""
   return _mysql.escape_sequence(list(obj), conv_dict)
@@ -119,6 +125,7 @@ CONVERSIONS = {
   list: _mysql.escape_sequence,
   tuple: _mysql.escape_sequence,
   set: Set2Str,
+  frozenset: Set2Str,
   bool: Bool2Str,
   int: Thing2Str,
   long: Thing2Str,
@@ -142,11 +149,119 @@ CONVERSIONS = {
   constants.FIELD_TYPE.INT24: int,
   constants.FIELD_TYPE.YEAR: int,
   constants.FIELD_TYPE.SET: Str2Set,
-  constants.FIELD_TYPE.TIMESTAMP: times.MysqlTimestampConverter,
-  constants.FIELD_TYPE.DATETIME: times.DateTimeOrNone,
-  constants.FIELD_TYPE.TIME: times.TimeDeltaOrNone,
-  constants.FIELD_TYPE.DATE: times.DateOrNone,
   constants.FIELD_TYPE.BLOB: [(constants.FLAG.BINARY, str)],
   constants.FIELD_TYPE.STRING: [(constants.FLAG.BINARY, str)],
   constants.FIELD_TYPE.VAR_STRING: [(constants.FLAG.BINARY, str)],
   constants.FIELD_TYPE.VARCHAR: [(constants.FLAG.BINARY, str)]}
+
+
+class Encoders(dict):
+  """Mapping of types to encoders that resolves subclasses through their MRO.
+
+  _mysql looks up the encoder for a value by its exact type. For a type that is
+  not in the mapping, __missing__ finds the encoder of the nearest base class
+  that has one, and stores it under the type itself. Every type is resolved
+  once; after that its encoder is a plain dictionary lookup, done in C.
+
+  Resolving has no side effects other than storing the result, which is the
+  same whichever thread stores it, so concurrent lookups need no lock.
+  """
+  def __missing__(self, cls):
+    return self.Resolve(cls)
+
+  def Resolve(self, cls):
+    """Returns the encoder for the given type, storing it for future lookups."""
+    if (isinstance(getattr(cls, 'key', None), property) and
+        hasattr(cls, '_PRIMARY_KEY')):
+      encoder = Record2Literal
+    else:
+      for base in getattr(cls, '__mro__', (cls,))[1:]:
+        encoder = dict.get(self, base)
+        if encoder is not None:
+          break
+      else:
+        encoder = Instance2Str
+    self[cls] = encoder
+    return encoder
+
+
+ENCODERS = Encoders((key, value) for key, value in CONVERSIONS.iteritems()
+                    if not isinstance(key, int))
+# Resolved up front, so connections start out knowing these common subclasses.
+for _cls in (datetime.date, decimal.Decimal, collections.OrderedDict,
+             collections.defaultdict, bytearray):
+  ENCODERS.Resolve(_cls)
+del _cls
+
+# Field types that are converted after fetching, by a ResultConverter.
+POST_CONVERSIONS = {
+  constants.FIELD_TYPE.TIMESTAMP: times.MysqlTimestampConverter,
+  constants.FIELD_TYPE.DATETIME: times.DateTimeOrNone,
+  constants.FIELD_TYPE.TIME: times.TimeDeltaOrNone,
+  constants.FIELD_TYPE.DATE: times.DateOrNone}
+
+# Field types that hold text, unless they have the BINARY flag.
+TEXT_TYPES = frozenset((
+  constants.FIELD_TYPE.BLOB, constants.FIELD_TYPE.STRING,
+  constants.FIELD_TYPE.VAR_STRING, constants.FIELD_TYPE.VARCHAR))
+
+
+class ResultConverter(object):
+  """Converts fetched rows column by column, for a single result description.
+
+  Columns that need no conversion beyond what _mysql did are left alone, and
+  if there are none of those, rows are returned as they are.
+  """
+  def __init__(self, types, flags, charset=None):
+    """Compiles the conversion for the given result description.
+
+    Arguments:
+      @ types: sequence of int
+        The field type of each column (the second item of its description).
+      @ flags: sequence of int
+        The field flags of each column.
+      % charset: str ~~ None
+        Character set to decode text columns with. None leaves them encoded.
+    """
+    self.columns = []
+    for index, (field_type, field_flags) in enumerate(zip(types, flags)):
+      if field_type in POST_CONVERSIONS:
+        self.columns.append(
+            (index, MemoizedColumn(POST_CONVERSIONS[field_type])))
+      elif (charset and field_type in TEXT_TYPES and
+            not field_flags & constants.FLAG.BINARY):
+        self.columns.append((index, DecodedColumn(charset)))
+
+  def __call__(self, rows):
+    """Returns the rows with all columns converted, as a list of tuples."""
+    if not self.columns or not rows:
+      return rows
+    columns = zip(*rows)
+    for index, convert in self.columns:
+      columns[index] = convert(columns[index])
+    return zip(*columns)
+
+
+def DecodedColumn(charset):
+  """Returns a function that decodes a column of text values."""
+  def Decode(column):
+    if None in column:
+      return [None if value is None else unicode(value, charset)
+              for value in column]
+    return map(unicode, column, itertools.repeat(charset, len(column)))
+  return Decode
+
+
+def MemoizedColumn(parse):
+  """Returns a function that converts a column, parsing each value only once.
+
+  Parsing happens for each distinct value in the column, after which the
+  column is converted by looking up the parsed values. NULL stays None.
+  """
+  def Convert(column):
+    parsed = dict.fromkeys(column)
+    for value in parsed:
+      if value is not None:
+        parsed[value] = parse(value)
+    return map(parsed.__getitem__, column)
+  return Convert
@@ -0,0 +1,152 @@
+#!/usr/bin/python2.5
+"""Testsuite for the MySQL result converters."""
+__author__ = 'Elmer de Looff <elmer@underdark.nl>'
+__version__ = '0.1'
+
+# Standard modules
+import datetime
+import decimal
+import unittest
+
+# Third-party modules
+import pytz
+
+# Unittest target
+from underdark.libs.sqltalk.mysql import constants
+from underdark.libs.sqltalk.mysql import converters
+
+FIELD_TYPE = constants.FIELD_TYPE
+
+
+class ResultConverterTest(unittest.TestCase):
+  """Rows are converted column by column, for the columns that need it."""
+  def testNothingToConvert(self):
+    """Rows without text or temporal columns are returned as they are"""
+    convert = converters.ResultConverter(
+        (FIELD_TYPE.LONG, FIELD_TYPE.DOUBLE), (0, 0), charset='utf8')
+    rows = ((1, 1.5), (2, 2.5))
+    self.assertTrue(convert(rows) is rows)
+
+  def testNoRows(self):
+    """Converting an empty result gives back the empty result"""
+    convert = converters.ResultConverter((FIELD_TYPE.DATE,), (0,))
+    self.assertEqual(convert(()), ())
+
+  def testTemporalColumns(self):
+    """Temporal columns are parsed, and their NULLs stay None"""
+    convert = converters.ResultConverter(
+        (FIELD_TYPE.LONG, FIELD_TYPE.DATETIME, FIELD_TYPE.DATE), (0, 0, 0))
+    stamp = datetime.datetime(2012, 3, 1, 13, 4, 5, tzinfo=pytz.utc)
+    self.assertEqual(
+        convert([(1, '2012-03-01 13:04:05', '2012-03-01'), (2, None, None)]),
+        [(1, stamp, datetime.date(2012, 3, 1)), (2, None, None)])
+
+  def testTextColumns(self):
+    """Text columns are decoded, binary ones are left alone"""
+    convert = converters.ResultConverter(
+        (FIELD_TYPE.VAR_STRING, FIELD_TYPE.BLOB, FIELD_TYPE.BLOB),
+        (0, 0, constants.FLAG.BINARY), charset='utf8')
+    rows = convert([('caf\xc3\xa9', 'text', '\xc3\xa9')])
+    self.assertEqual(rows, [(u'caf\xe9', u'text', '\xc3\xa9')])
+    self.assertTrue(isinstance(rows[0][1], unicode))
+    self.assertFalse(isinstance(rows[0][2], unicode))
+
+  def testTextWithoutCharset(self):
+    """Without a charset, text columns are left encoded"""
+    convert = converters.ResultConverter((FIELD_TYPE.VAR_STRING,), (0,))
+    rows = (('caf\xc3\xa9',),)
+    self.assertTrue(convert(rows) is rows)
+
+
+class DecodedColumnTest(unittest.TestCase):
+  """Text columns are decoded in a single pass."""
+  def testDecode(self):
+    """All values of the column are decoded"""
+    decode = converters.DecodedColumn('utf8')
+    self.assertEqual(decode(('caf\xc3\xa9', 'bar')), [u'caf\xe9', u'bar'])
+
+  def testNull(self):
+    """NULL values in the column stay None"""
+    decode = converters.DecodedColumn('latin1')
+    self.assertEqual(decode(('caf\xe9', None)), [u'caf\xe9', None])
+
+
+class MemoizedColumnTest(unittest.TestCase):
+  """Repeated values in a column are parsed only once."""
+  def testParsedOnce(self):
+    """Each distinct value is parsed once, NULL is never parsed"""
+    parsed = []
+    def _Parse(value):
+      parsed.append(value)
+      return int(value)
+    convert = converters.MemoizedColumn(_Parse)
+    self.assertEqual(convert(('1', '2', '1', None, '2')), [1, 2, 1, None, 2])
+    self.assertEqual(sorted(parsed), ['1', '2'])
+
+
+class EncodersTest(unittest.TestCase):
+  """Encoders for subclasses are found through the MRO, and then stored."""
+  def setUp(self):
+    self.encoders = converters.Encoders(
+        (key, value) for key, value in converters.CONVERSIONS.iteritems()
+        if not isinstance(key, int))
+
+  def testExactType(self):
+    """Types that have an encoder are not resolved"""
+    self.assertTrue(self.encoders[int] is converters.Thing2Str)
+
+  def testSubclass(self):
+    """A subclass gets the encoder of its nearest base that has one"""
+    class Flag(int):
+      pass
+    class Named(object):
+      pass
+    class NamedFlag(Named, Flag):
+      pass
+    self.assertTrue(self.encoders[NamedFlag] is converters.Thing2Str)
+    self.assertTrue(self.encoders[Flag] is converters.Thing2Str)
+
+  def testNearestBase(self):
+    """Encoders of closer bases win over those of further ones"""
+    self.encoders[decimal.Decimal] = converters.Float2Str
+    class Price(decimal.Decimal):
+      pass
+    self.assertTrue(self.encoders[Price] is converters.Float2Str)
+
+  def testStoredOnce(self):
+    """A resolved encoder is stored under the type itself"""
+    class Name(str):
+      pass
+    self.assertFalse(Name in self.encoders)
+    self.encoders[Name]
+    self.assertTrue(Name in self.encoders)
+    self.encoders[str] = converters.Thing2Str
+    self.assertTrue(self.encoders[Name] is converters.Thing2Literal)
+
+  def testFallback(self):
+    """Objects without an encoder for any of their bases use Instance2Str"""
+    class Thing(object):
+      pass
+    del self.encoders[object]
+    self.assertTrue(self.encoders[Thing] is converters.Instance2Str)
+
+  def testRecord(self):
+    """Records are encoded as the literal for their primary key"""
+    class Record(object):
+      _PRIMARY_KEY = 'ID'
+      key = property(lambda self: self.ident)
+      def __init__(self, ident):
+        self.ident = ident
+    self.assertTrue(self.encoders[Record] is converters.Record2Literal)
+    self.assertEqual(converters.Record2Literal(Record(12), self.encoders),
+                     '12')
+
+  def testKeyWithoutPrimaryKey(self):
+    """Objects with a key property but no _PRIMARY_KEY are no records"""
+    class Thing(object):
+      key = property(lambda self: 12)
+    self.assertTrue(self.encoders[Thing] is converters.Instance2Str)
+
+
+if __name__ == '__main__':
+  unittest.main(testRunner=unittest.TextTestRunner(verbosity=2))
@@ -2,20 +2,26 @@
 """SQLTalk MySQL Cursor class.
 """
 __author__ = 'Elmer de Looff <elmer@underdark.nl>'
-__version__ = '0.13'
+__version__ = '0.15'
 
 # Standard modules
 import warnings
 import weakref
 import _mysql
 
+# Application specific modules
+from .. import querycache
+
 
 class Cursor(object):
   """Cursor to execute database interaction with, within a transaction."""
+  # Placeholder for a bound value in parameterized statements.
+  PLACEHOLDER = '%s'
+
   def __init__(self, connection):
     self._connection = weakref.ref(connection)
 
-  def _Execute(self, query):
+  def _Execute(self, query, args=None):
     """Actually executes the query and returns the result of it.
 
     Arguments:
@@ -23,34 +29,100 @@ class Cursor(object):
         Fully formatted sql statement to execute. In case of unicode, the
         string is encoded to the local character set before it is passed on
         to the server.
+      % args: sequence / mapping ~~ None
+        Values for the placeholders in `query`, which is then a parameterized
+        statement (see the statement module). If given, the statement is taken
+        from the connection's statement cache and bound on the client, or
+        executed as a server-side prepared statement.
 
     Returns:
       sqlresult.ResultSet instance holding all query result data.
     """
-    #TODO(Elmer): Fix this so that arguments can be given independent of the
-    # query they belong to. This enables proper SelectTables and enables a host
-    # of other escaping things to start working properly.
-    #   Refer to MySQLdb.cursor code (~line 151) to see how this works.
-    self._LogQuery(query)
-    result = self.connection.Query(query.strip())
-    if self.connection.warning_count():
+    connection = self.connection
+    if isinstance(query, unicode):
+      query = query.encode(connection.charset)
+    query = query.strip()
+    stmt = None
+    if args is not None:
+      stmt = connection.statements.Get(query)
+      if connection.log_queries or not connection.server_prepare:
+        query = stmt.Bind(args, connection.EscapeValues)
+    if connection.log_queries:
+      self._LogQuery(query)
+    if stmt is not None and connection.server_prepare:
+      result = connection.QueryPrepared(stmt, args)
+    else:
+      result = connection.Query(query)
+    if connection.warning_count():
       self._ProcessWarnings(result)
+    if connection.query_cache is not None:
+      self._InvalidateCache(query)
     return result
 
+  def _InvalidateCache(self, query):
+    """Invalidates cached results for the tables the query writes to."""
+    connection = self.connection
+    tables = querycache.WrittenTables(query)
+    if tables:
+      connection.query_cache.Invalidate(*tables)
+      connection.transaction_writes.update(tables)
+
+  def _BindQuery(self, query, args):
+    """Returns the encoded query, with `args` bound on the client if given."""
+    connection = self.connection
+    if isinstance(query, unicode):
+      query = query.encode(connection.charset)
+    query = query.strip()
+    if args is not None:
+      query = connection.statements.Get(query).Bind(
+          args, connection.EscapeValues)
+    return query
+
   def _LogQuery(self, query):
+    """Adds the (encoded) query to the connection's log, and the debug log."""
     connection = self.connection
-    if not isinstance(query, unicode):
-      query = unicode(query, connection.charset, errors='replace')
-    connection.logger.debug(query)
     connection.queries.append(query)
+    if connection.debug:
+      connection.logger.debug(query.decode(connection.charset, 'replace'))
+
+  @staticmethod
+  def _Literal(sql):
+    """Returns SQL text escaped for inclusion in a parameterized statement."""
+    return sql.replace('%', '%%')
 
   @staticmethod
-  def _StringConditions(conditions, _unused_field_escape):
+  def _StringConditions(conditions, _unused_field_escape, bound=False):
+    """Returns the conditions, escaped unless they have bound arguments."""
     if not conditions:
       return '1'
     elif not isinstance(conditions, basestring):
-      return ' AND '.join(conditions)
-    return conditions
+      conditions = ' AND '.join(conditions)
+    return conditions if bound else conditions.replace('%', '%%')
+
+  def _SelectQuery(self, table, fields, conditions, order, group, limit,
+                   offset, escape, calc_found_rows, args):
+    """Returns the parameterized SELECT statement and its arguments."""
+    field_escape = self.connection.EscapeField if escape else lambda x: x
+    limit_sql, limit_args = self._StringLimit(limit, offset)
+    return 'SELECT %s %s FROM %s WHERE %s %s %s %s' % (
+        'SQL_CALC_FOUND_ROWS' if calc_found_rows else '',
+        self._Literal(self._StringFields(fields, field_escape)),
+        self._Literal(self._StringTable(table, field_escape)),
+        self._StringConditions(conditions, field_escape, bound=bool(args)),
+        self._Literal(self._StringGroup(group, field_escape)),
+        self._Literal(self._StringOrder(order, field_escape)),
+        limit_sql), list(args) + list(limit_args)
+
+  def _StringAssignments(self, fields, values, escape):
+    """Returns `field`=value assignments, with placeholders if `escape` is set.
+
+    Without escaping, the given values are taken to be literal SQL.
+    """
+    if escape:
+      return ', '.join('`%s`=%s' % (self._Literal(field), self.PLACEHOLDER)
+                       for field in fields)
+    return self._Literal(', '.join(
+        '`%s`=%s' % assignment for assignment in zip(fields, values)))
 
   @staticmethod
   def _StringFields(fields, field_escape):
@@ -71,11 +143,12 @@ class Cursor(object):
 
   @staticmethod
   def _StringLimit(limit, offset):
+    """Returns the LIMIT clause with placeholders, and the values for them."""
     if limit is None:
-      return ''
+      return '', ()
     elif offset:
-      return 'LIMIT %d OFFSET %d' % (limit, offset)
-    return 'LIMIT %d' % limit
+      return 'LIMIT %s OFFSET %s', (int(limit), int(offset))
+    return 'LIMIT %s', (int(limit),)
 
   @staticmethod
   def _StringOrder(order, field_escape):
@@ -96,8 +169,46 @@ class Cursor(object):
     else:
       return ', '.join(field_escape(table))
 
+  def Batch(self):
+    """Returns a batch cursor, which sends its queries in one round trip.
+
+    Use it as a context manager. Queries made through it are queued, and sent
+    to the server as a single multi-statement query when the block ends:
+
+      with cursor.Batch() as batch:
+        batch.Select('user', conditions='id=5')
+        batch.Execute('SELECT COUNT(*) FROM message WHERE user=%s', (5,))
+      user, messages = batch.results
+
+    Returns:
+      Batch: cursor for the same connection (and transaction).
+    """
+    return Batch(self.connection)
+
+  def Cached(self, ttl=None):
+    """Returns a cursor that answers SELECT queries from the query cache.
+
+    Results are cached if the connection has a `query_cache`, for the cache's
+    TTL or the one given here. Statements that aren't cacheable (see
+    querycache.Cacheable) are always executed. So are all statements after the
+    transaction has written to the database, as their results may differ from
+    what is committed. Results are only stored from the first statement of a
+    transaction (or under autocommit), later ones read from a snapshot that
+    may be older than the cache:
+
+      cursor.Cached(ttl=300).Select('country', order='name')
+
+    Arguments:
+      % ttl: float ~~ None
+        Number of seconds results stay cached, the cache's default if None.
+
+    Returns:
+      CachedCursor: cursor for the same connection (and transaction).
+    """
+    return CachedCursor(self.connection, ttl=ttl)
+
   def Delete(self, table, conditions, order=None,
-             limit=None, offset=0, escape=True):
+             limit=None, offset=0, escape=True, args=()):
     """Remove row(s) from table that match conditions, up to limit.
 
     Arguments:
@@ -116,16 +227,20 @@ class Cursor(object):
       escape:     boolean. Defines whether table and field names should be
                   escaped. Set this to False if you want to make use of MySQL
                   functions on this query. Default True.
+      args:       list/tuple (optional). Values for %s placeholders in the
+                  conditions. If given, literal percent signs in the
+                  conditions must be written as %%.
 
     Returns:
       sqlresult.ResultSet object.
     """
     field_escape = self.connection.EscapeField if escape else lambda x: x
+    limit, limit_args = self._StringLimit(limit, offset)
     return self._Execute('delete from %s where %s %s %s' % (
-        self._StringTable(table, field_escape),
-        self._StringConditions(conditions, field_escape),
-        self._StringOrder(order, field_escape),
-        self._StringLimit(limit, offset)))
+        self._Literal(self._StringTable(table, field_escape)),
+        self._StringConditions(conditions, field_escape, bound=bool(args)),
+        self._Literal(self._StringOrder(order, field_escape)),
+        limit), list(args) + list(limit_args))
 
   def Describe(self, table, field=''):
     """Describe table in database or field in table.
@@ -141,9 +256,20 @@ class Cursor(object):
         self._StringTable(table, self.connection.EscapeField),
         self._StringFields(field, self.connection.EscapeField)))
 
-  def Execute(self, query):
-    """Executes a raw query."""
-    return self._Execute(query)
+  def Execute(self, query, args=None):
+    """Executes a raw query, or a parameterized one if `args` are given.
+
+    Arguments:
+      @ query: basestring
+        The SQL statement. With `args`, this uses %s for positional or
+        %(name)s for named placeholders, and %% for a literal percent sign.
+      % args: sequence / mapping ~~ None
+        Values for the placeholders. These are escaped for you.
+
+    Returns:
+      sqlresult.ResultSet object.
+    """
+    return self._Execute(query, args)
 
   def Insert(self, table, values, escape=True):
     """Insert new row into table.
@@ -170,21 +296,34 @@ class Cursor(object):
     """
     if not values:
       raise ValueError('Must insert 1 or more value')
-    values = self.connection.EscapeValues(values) if escape else values
-    table = self.connection.EscapeField(table) if escape else table
-    try:
+    if escape:
+      table = self.connection.EscapeField(table)
+    table = self._Literal(table)
+    if isinstance(values, dict):
       # Single insert
-      values = ', '.join('`%s`=%s' % value for value in values.iteritems())
-      query = 'INSERT INTO %s SET %s' % (table, values)
-    except AttributeError:
-      # Multi-row insert
-      fields = ', '.join(map(self.connection.EscapeField, values[0]))
-      values = ', '.join('(%s)' % ', '.join(row.itervalues()) for row in values)
-      query = 'INSERT INTO %s (%s) VALUES %s' % (table, fields, values)
-    return self._Execute(query)
+      fields = values.keys()
+      query = 'INSERT INTO %s SET %s' % (table, self._StringAssignments(
+          fields, values.values(), escape))
+      return self._Execute(query, values.values() if escape else ())
+    # Multi-row insert
+    fields = values[0].keys()
+    rows = [[row[field] for field in fields] for row in values]
+    if escape:
+      placeholders = '(%s)' % ', '.join([self.PLACEHOLDER] * len(fields))
+      rows_sql = ', '.join([placeholders] * len(rows))
+      args = [value for row in rows for value in row]
+    else:
+      rows_sql = self._Literal(
+          ', '.join('(%s)' % ', '.join(row) for row in rows))
+      args = ()
+    fields = ', '.join(map(self.connection.EscapeField, fields))
+    query = 'INSERT INTO %s (%s) VALUES %s' % (
+        table, self._Literal(fields), rows_sql)
+    return self._Execute(query, args)
 
   def Select(self, table, fields=None, conditions=None, order=None,
-             group=None, limit=None, offset=0, escape=True, totalcount=False):
+             group=None, limit=None, offset=0, escape=True, totalcount=False,
+             args=()):
     """Select fields from table that match the conditions, ordered and limited.
 
     Arguments:
@@ -210,24 +349,35 @@ class Cursor(object):
       totalcount: boolean. If this is set to True, queries with a LIMIT applied
                   will have the full number of matching rows on
                   the affected_rows attribute of the resultset.
+      args:       list/tuple (optional). Values for %s placeholders in the
+                  conditions. If given, literal percent signs in the
+                  conditions must be written as %%.
 
     Returns:
       sqlresult.ResultSet object.
     """
-    field_escape = self.connection.EscapeField if escape else lambda x: x
-    result = self._Execute('SELECT %s %s FROM %s WHERE %s %s %s %s' % (
-        'SQL_CALC_FOUND_ROWS' if totalcount and limit is not None else '',
-        self._StringFields(fields, field_escape),
-        self._StringTable(table, field_escape),
-        self._StringConditions(conditions, field_escape),
-        self._StringGroup(group, field_escape),
-        self._StringOrder(order, field_escape),
-        self._StringLimit(limit, offset)))
-
+    result = self._Execute(*self._SelectQuery(
+        table, fields, conditions, order, group, limit, offset, escape,
+        totalcount and limit is not None, args))
     if totalcount and limit is not None and limit == len(result):
       result.affected = self._Execute('SELECT FOUND_ROWS()')[0][0]
     return result
 
+  def SelectIter(self, table, fields=None, conditions=None, order=None,
+                 group=None, limit=None, offset=0, escape=True, args=(),
+                 batch=1000):
+    """Yields the selected rows, streaming them from the server in batches.
+
+    This takes the same arguments as Select(), except `totalcount`, and uses
+    Stream() to execute the query. Refer to both for details.
+
+    Returns:
+      ResultStream: iterator over the result rows.
+    """
+    query, args = self._SelectQuery(table, fields, conditions, order, group,
+                                    limit, offset, escape, False, args)
+    return self.Stream(query, args, batch=batch)
+
   def SelectTables(self, contains=None, exact=False):
     """Returns table names from the current database.
 
@@ -252,6 +402,32 @@ class Cursor(object):
       result = self._Execute('SHOW TABLES')
     return set(result[result.fieldnames[0]])
 
+  def Stream(self, query, args=None, batch=1000):
+    """Executes a query and returns an iterator over its result rows.
+
+    The result is not stored on the client, but read from the server while it
+    is iterated, `batch` rows at a time. This makes memory use independent of
+    the size of the result. Until the iterator is exhausted (or closed), the
+    connection cannot be used for other queries; doing so anyway discards the
+    rest of the result.
+
+    Arguments:
+      @ query: basestring
+        The SQL statement, raw or parameterized as for Execute().
+      % args: sequence / mapping ~~ None
+        Values for the placeholders, bound on the client.
+      % batch: int ~~ 1000
+        Number of rows to fetch from the server at once.
+
+    Returns:
+      ResultStream: iterator over the result rows.
+    """
+    connection = self.connection
+    query = self._BindQuery(query, args)
+    if connection.log_queries:
+      self._LogQuery(query)
+    return connection.QueryStream(query, batch=batch)
+
   def Truncate(self, table):
     """Truncate table in database, reducing it to 0 rows.
 
@@ -265,7 +441,7 @@ class Cursor(object):
         self._StringTable(table, self.connection.EscapeField)))
 
   def Update(self, table, values, conditions, order=None,
-             limit=None, offset=None, escape=True):
+             limit=None, offset=None, escape=True, args=()):
     """Updates table records to the new values where conditions are met.
 
     Arguments:
@@ -286,22 +462,24 @@ class Cursor(object):
       escape:     boolean. Defines whether table names, fields and values should
                   be escaped. Set this to False if you want to make use of
                   MySQL functions on this query. Default True.
+      args:       list/tuple (optional). Values for %s placeholders in the
+                  conditions. If given, literal percent signs in the
+                  conditions must be written as %%.
 
     Returns:
       sqlresult.ResultSet object.
     """
-    if escape:
-      field_escape = self.connection.EscapeField
-      values = self.connection.EscapeValues(values)
-    else:
-      field_escape = lambda x: x
-
+    field_escape = self.connection.EscapeField if escape else lambda x: x
+    fields = values.keys()
+    field_values = values.values()
+    limit_sql, limit_args = self._StringLimit(limit, offset)
     return self._Execute('UPDATE %s SET %s WHERE %s %s %s' % (
-        self._StringTable(table, field_escape),
-        ', '.join('`%s`=%s' % value for value in values.iteritems()),
-        self._StringConditions(conditions, field_escape),
-        self._StringOrder(order, field_escape),
-        self._StringLimit(limit, offset)))
+        self._Literal(self._StringTable(table, field_escape)),
+        self._StringAssignments(fields, field_values, escape),
+        self._StringConditions(conditions, field_escape, bound=bool(args)),
+        self._Literal(self._StringOrder(order, field_escape)),
+        limit_sql),
+        (field_values if escape else []) + list(args) + list(limit_args))
 
   def _ProcessWarnings(self, resultset):
     """Updates messages attribute with warnings given by the MySQL server."""
@@ -339,3 +517,103 @@ class Cursor(object):
   OperationalError = _mysql.OperationalError
   ProgrammingError = _mysql.ProgrammingError
   Warning = _mysql.Warning
+
+
+class Batch(Cursor):
+  """Cursor that queues its queries, to send them in a single round trip.
+
+  All query methods of the regular Cursor are available, but they return None
+  rather than a ResultSet. Methods that need the result of their own query to
+  compute their return value (SelectTables, Select with `totalcount`) or read
+  results as they arrive (Stream, SelectIter) can not be batched. The queued
+  queries are sent by Send(), which is called when the `with` block is left
+  without an exception.
+
+  Members:
+    % queries: list of str
+      The encoded queries waiting to be sent.
+    % results: list of sqlresult.ResultSet
+      The results of the last batch that was sent, one per query.
+  """
+  def __init__(self, connection):
+    super(Batch, self).__init__(connection)
+    self.queries = []
+    self.results = []
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, _exc_value, _exc_traceback):
+    """Sends the queued queries, unless the block raised an exception."""
+    if exc_type is None:
+      self.Send()
+    else:
+      del self.queries[:]
+
+  def __len__(self):
+    """Returns the number of queries waiting to be sent."""
+    return len(self.queries)
+
+  def _Execute(self, query, args=None):
+    """Queues the query, binding its arguments on the client."""
+    self.queries.append(self._BindQuery(query, args))
+
+  def Send(self):
+    """Sends the queued queries to the server as one multi-statement query.
+
+    Returns:
+      list of sqlresult.ResultSet: one for each query, in the order queued.
+    """
+    queries, self.queries = self.queries, []
+    if not queries:
+      self.results = []
+      return self.results
+    connection = self.connection
+    if connection.log_queries:
+      for query in queries:
+        self._LogQuery(query)
+    self.results = connection.QueryBatch(queries)
+    if connection.warning_count():
+      self._ProcessWarnings(self.results[-1])
+    if connection.query_cache is not None:
+      for query in queries:
+        self._InvalidateCache(query)
+    return self.results
+
+  def Select(self, *args, **kwds):
+    """Queues a Select; see Cursor.Select(). `totalcount` can not be batched."""
+    if kwds.get('totalcount') or len(args) > 8 and args[8]:
+      raise self.NotSupportedError('Select with totalcount can not be batched.')
+    return super(Batch, self).Select(*args, **kwds)
+
+  def SelectTables(self, contains=None, exact=False):
+    raise self.NotSupportedError('SelectTables can not be batched.')
+
+  def Stream(self, query, args=None, batch=1000):
+    raise self.NotSupportedError('Results of a batch can not be streamed.')
+
+
+class CachedCursor(Cursor):
+  """Cursor that answers cacheable SELECT queries from the query cache.
+
+  Refer to Cursor.Cached() for details.
+  """
+  def __init__(self, connection, ttl=None):
+    super(CachedCursor, self).__init__(connection)
+    self.ttl = ttl
+
+  def _Execute(self, query, args=None):
+    """Returns the cached result, executing the query if it's not cached."""
+    connection = self.connection
+    if (connection.query_cache is None or connection.transaction_writes or
+        not querycache.Cacheable(query)):
+      return super(CachedCursor, self)._Execute(query, args)
+    if isinstance(query, unicode):
+      query = query.encode(connection.charset)
+    execute = super(CachedCursor, self)._Execute
+    # Under REPEATABLE READ, a transaction reads from the snapshot taken by its
+    # first statement. Later results may predate invalidations the cache has
+    # seen since, so they are used from the cache, but never stored in it.
+    store = connection.autocommit or not connection.transaction_queries
+    return connection.query_cache.Fetch(
+        query, args, lambda: execute(query, args), ttl=self.ttl, store=store)
@@ -0,0 +1,138 @@
+#!/usr/bin/python2.5
+"""Testsuite for the batching cursor of sqltalk.mysql."""
+__author__ = 'Elmer de Looff <elmer@underdark.nl>'
+__version__ = '0.1'
+
+# Standard modules
+import unittest
+
+# Unittest target
+from underdark.libs.sqltalk import sqlresult
+from underdark.libs.sqltalk.mysql import connection
+from underdark.libs.sqltalk.mysql import cursor
+from underdark.libs.sqltalk.mysql import statement
+
+
+class FakeCache(object):
+  """Stands in for a QueryCache, recording the tables it invalidates."""
+  def __init__(self):
+    self.invalidated = []
+
+  def Invalidate(self, *tables):
+    self.invalidated.extend(tables)
+
+
+class FakeConnection(object):
+  """Stands in for a MySQL connection, with the real QueryBatch.
+
+  Every statement of a multi-statement query gets a result of its own, with a
+  single row holding the text of the statement.
+  """
+  charset = 'utf8'
+  debug = False
+  log_queries = False
+  EscapeField = connection.Connection.EscapeField.im_func
+  QueryBatch = connection.Connection.QueryBatch.im_func
+
+  def __init__(self, query_cache=None):
+    self.query_cache = query_cache
+    self.queries = []
+    self.sent = []
+    self.statements = statement.StatementCache()
+    self.transaction_writes = set()
+    self._pending = []
+
+  @staticmethod
+  def EscapeValues(values):
+    return [str(value) if isinstance(value, (int, long)) else
+            "'%s'" % value.replace("'", "\\'") for value in values]
+
+  @staticmethod
+  def warning_count():
+    return 0
+
+  def next_result(self):
+    self._pending.pop(0)
+    return 0 if self._pending else -1
+
+  def store_result(self):
+    return self._pending[0]
+
+  def _ResultSet(self, stored_result, query_string):
+    return sqlresult.ResultSet(query=query_string, result=[(stored_result,)],
+                               fields=(('statement', 253),))
+
+  def _SendQuery(self, query_string):
+    self.sent.append(query_string)
+    self._pending = query_string.split('; ')
+
+
+class BatchTest(unittest.TestCase):
+  """Batched queries are queued, and sent together in a single query."""
+  def setUp(self):
+    self.connection = FakeConnection()
+    self.batch = cursor.Cursor(self.connection).Batch()
+
+  def testQueued(self):
+    """Queries are queued in order, with their arguments bound"""
+    self.batch.Execute('SELECT name FROM user WHERE id=%s', (5,))
+    self.batch.Select('message', conditions='user=%s', args=("o'neil",))
+    self.assertEqual(self.batch.queries, [
+        'SELECT name FROM user WHERE id=5',
+        "SELECT  * FROM `message` WHERE user='o\\'neil'"])
+    self.assertEqual(len(self.batch), 2)
+    self.assertEqual(self.connection.sent, [])
+
+  def testSend(self):
+    """Sending gives one ResultSet per query, in order, and empties the queue"""
+    with self.batch:
+      self.batch.Execute('SELECT 1')
+      self.batch.Execute('SELECT 2')
+      self.batch.Execute('SELECT 3')
+    self.assertEqual(self.connection.sent, ['SELECT 1; SELECT 2; SELECT 3'])
+    self.assertEqual([result.query for result in self.batch.results],
+                     ['SELECT 1', 'SELECT 2', 'SELECT 3'])
+    self.assertEqual([result[0]['statement'] for result in self.batch.results],
+                     ['SELECT 1', 'SELECT 2', 'SELECT 3'])
+    self.assertEqual(len(self.batch), 0)
+    self.assertEqual(self.batch.Send(), [])
+    self.assertEqual(len(self.connection.sent), 1)
+
+  def testExceptionDiscards(self):
+    """An exception in the block discards the queue, without sending it"""
+    try:
+      with self.batch:
+        self.batch.Execute('DELETE FROM user')
+        raise ValueError('Abort batch')
+    except ValueError:
+      pass
+    self.assertEqual(len(self.batch), 0)
+    self.assertEqual(self.connection.sent, [])
+
+  def testNotBatchable(self):
+    """Queries whose results are needed right away can not be batched"""
+    error = self.batch.NotSupportedError
+    self.assertRaises(error, self.batch.Select, 'user', totalcount=True)
+    self.assertRaises(error, self.batch.Select,
+                      'user', None, None, None, None, 10, 0, True, True)
+    self.assertRaises(error, self.batch.SelectTables)
+    self.assertRaises(error, self.batch.Stream, 'SELECT 1')
+    self.assertRaises(error, self.batch.SelectIter, 'user')
+    self.assertEqual(len(self.batch), 0)
+
+  def testInvalidatesWrites(self):
+    """The tables of every batched write are invalidated in the query cache"""
+    self.connection.query_cache = FakeCache()
+    with self.batch:
+      self.batch.Insert('user', {'name': 'Bob'})
+      self.batch.Select('message')
+      self.batch.Update('message', {'read': 1}, 'user=5')
+      self.batch.Delete('session', 'user=5')
+    self.assertEqual(self.connection.query_cache.invalidated,
+                     ['user', 'message', 'session'])
+    self.assertEqual(self.connection.transaction_writes,
+                     set(('user', 'message', 'session')))
+
+
+if __name__ == '__main__':
+  unittest.main(testRunner=unittest.TextTestRunner(verbosity=2))
@@ -0,0 +1,225 @@
+#!/usr/bin/python2.5
+"""This module implements the ConnectionPool class, which hands out MySQL
+connections to multiple threads, each getting exclusive use of a connection
+for as long as it holds it.
+"""
+__author__ = 'Elmer de Looff <elmer@underdark.nl>'
+__version__ = '0.1'
+
+# Standard modules
+import _mysql
+import threading
+import time
+
+
+class ConnectionPool(object):
+  """Thread-safe pool of database connections.
+
+  Up to `size` connections are kept around for reuse. When all of these are in
+  use, up to `overflow` additional connections are created. These are closed
+  again when they are returned while the pool already holds `size` idle
+  connections. When both are exhausted, Acquire() blocks until a connection is
+  released or `timeout` seconds have passed.
+  """
+  def __init__(self, connect, size=5, overflow=10, timeout=30,
+               max_idle=300, validate=True):
+    """Initializes a ConnectionPool.
+
+    Arguments:
+      @ connect: callable
+        Creates and returns a new connection object. Called without arguments.
+      % size: int ~~ 5
+        Number of connections that are kept open for reuse.
+      % overflow: int ~~ 10
+        Number of connections that may be opened beyond `size` under load.
+      % timeout: float ~~ 30
+        Seconds to wait for a connection before OperationalError is raised.
+        None waits indefinitely.
+      % max_idle: float ~~ 300
+        Idle connections unused for longer than this are closed (reaped).
+        None keeps idle connections open forever.
+      % validate: bool ~~ True
+        Whether connections are checked for liveness when they are acquired.
+        Connections that fail this check are replaced by a new connection.
+    """
+    self.connect = connect
+    self.size = size
+    self.overflow = overflow
+    self.timeout = timeout
+    self.max_idle = max_idle
+    self.validate = validate
+    self._idle = []  # Stack of (release_time, connection), newest last.
+    self._checked_out = 0
+    self._lock = threading.Condition(threading.Lock())
+    self._stats = dict.fromkeys((
+        'acquired', 'created', 'closed', 'discarded', 'reaped', 'timeouts',
+        'waits', 'wait_time', 'wait_time_max', 'peak_checked_out'), 0)
+
+  def __len__(self):
+    """Returns the number of open connections, both idle and checked out."""
+    return len(self._idle) + self._checked_out
+
+  def Acquire(self, timeout=None):
+    """Returns a connection from the pool, for exclusive use by the caller.
+
+    Idle connections are reused most-recently-released first. If there are no
+    idle connections and the pool is not at its maximum, a new connection is
+    opened. Otherwise this blocks until another thread releases a connection.
+
+    Arguments:
+      % timeout: float ~~ None
+        Overrides the pool's default timeout for this call.
+
+    Raises:
+      OperationalError: No connection became available in time.
+
+    Returns:
+      connection: A connection as returned by the pool's `connect` callable.
+    """
+    if timeout is None:
+      timeout = self.timeout
+    start = time.time()
+    waited = False
+    with self._lock:
+      reaped = self._Reap(start)
+    for stale in reaped:
+      self._Close(stale, 'reaped')
+    with self._lock:
+      while not self._idle and len(self) >= self.capacity:
+        remaining = None if timeout is None else start + timeout - time.time()
+        if remaining is not None and remaining <= 0:
+          self._stats['timeouts'] += 1
+          raise self.OperationalError(
+              'Timed out after %.1f seconds waiting for a pooled connection '
+              '(%d in use).' % (timeout, self._checked_out))
+        waited = True
+        self._lock.wait(remaining)
+      connection = self._idle.pop()[1] if self._idle else None
+      self._checked_out += 1
+      self._RecordAcquire(time.time() - start if waited else 0)
+    try:
+      if connection is None:
+        return self._Open()
+      return self._Validated(connection)
+    except Exception:
+      with self._lock:
+        self._checked_out -= 1
+        self._lock.notify()
+      raise
+
+  def Release(self, connection):
+    """Returns a previously acquired connection to the pool.
+
+    Overflow connections, those returned while the pool already has `size`
+    idle connections, are closed instead of kept.
+    """
+    with self._lock:
+      self._checked_out -= 1
+      if len(self._idle) < self.size:
+        self._idle.append((time.time(), connection))
+        connection = None
+      self._lock.notify()
+    if connection is not None:
+      self._Close(connection, 'closed')
+
+  def Close(self):
+    """Closes all idle connections in the pool.
+
+    Connections that are checked out are left alone; these are closed when they
+    are released if the pool has no room for them at that point.
+    """
+    with self._lock:
+      idle, self._idle = self._idle, []
+    for _released, connection in idle:
+      self._Close(connection, 'closed')
+
+  def Statistics(self):
+    """Returns a dictionary of pool usage statistics.
+
+    Keys:
+      acquired: total number of connections handed out.
+      checked_out: connections currently in use.
+      idle: connections currently available for reuse.
+      created, closed: connections opened and closed by the pool.
+      discarded: connections closed because they failed validation.
+      reaped: connections closed after being idle for too long.
+      timeouts: number of Acquire() calls that gave up waiting.
+      waits: number of Acquire() calls that had to wait for a connection.
+      wait_time, wait_time_avg, wait_time_max: seconds spent waiting.
+      peak_checked_out: highest number of connections in use at once.
+      utilisation: fraction of the pool's capacity that is currently in use.
+    """
+    with self._lock:
+      stats = self._stats.copy()
+      stats['checked_out'] = self._checked_out
+      stats['idle'] = len(self._idle)
+    stats['capacity'] = self.capacity
+    stats['utilisation'] = stats['checked_out'] / float(self.capacity)
+    if stats['waits']:
+      stats['wait_time_avg'] = stats['wait_time'] / stats['waits']
+    else:
+      stats['wait_time_avg'] = 0.0
+    return stats
+
+  @property
+  def capacity(self):
+    """Returns the maximum number of connections this pool will open."""
+    return self.size + self.overflow
+
+  def _Close(self, connection, counter):
+    """Closes the given connection, counting it under `counter`."""
+    try:
+      connection.close()
+    except self.Error:
+      pass  # Connection is already closed or broken, which is what we want.
+    with self._lock:
+      self._stats[counter] += 1
+
+  def _Open(self):
+    """Opens and returns a new connection."""
+    connection = self.connect()
+    with self._lock:
+      self._stats['created'] += 1
+    return connection
+
+  def _Reap(self, now):
+    """Removes connections that have been idle longer than `max_idle`.
+
+    N.B. This must be called while holding the pool lock. Idle connections are
+    kept in order of release, so the stale ones are all at the start. These are
+    returned so that they can be closed after the lock is released.
+    """
+    if self.max_idle is None:
+      return []
+    stale = 0
+    for released, _connection in self._idle:
+      if now - released <= self.max_idle:
+        break
+      stale += 1
+    reaped, self._idle[:stale] = self._idle[:stale], []
+    return [connection for _released, connection in reaped]
+
+  def _RecordAcquire(self, wait_time):
+    """Updates the acquire statistics. Must be called holding the pool lock."""
+    stats = self._stats
+    stats['acquired'] += 1
+    if wait_time:
+      stats['waits'] += 1
+      stats['wait_time'] += wait_time
+      stats['wait_time_max'] = max(stats['wait_time_max'], wait_time)
+    stats['peak_checked_out'] = max(
+        stats['peak_checked_out'], self._checked_out)
+
+  def _Validated(self, connection):
+    """Returns the connection if it's alive, or a newly opened replacement."""
+    if not self.validate:
+      return connection
+    try:
+      connection.ping()
+      return connection
+    except self.Error:
+      self._Close(connection, 'discarded')
+      return self._Open()
+
+  Error = _mysql.Error
+  OperationalError = _mysql.OperationalError
@@ -0,0 +1,141 @@
+#!/usr/bin/python2.5
+"""Testsuite for the MySQL connection pool."""
+__author__ = 'Elmer de Looff <elmer@underdark.nl>'
+__version__ = '0.1'
+
+# Standard modules
+import threading
+import time
+import unittest
+
+# Unittest target
+import pool
+
+
+class FakeConnection(object):
+  """Stands in for a MySQL connection, recording pings and closing."""
+  def __init__(self, number):
+    self.number = number
+    self.alive = True
+    self.closed = False
+    self.pings = 0
+
+  def close(self):
+    self.closed = True
+
+  def ping(self):
+    self.pings += 1
+    if not self.alive:
+      raise pool.ConnectionPool.OperationalError(
+          2006, 'MySQL server has gone away')
+
+
+class ConnectionPoolTest(unittest.TestCase):
+  """Connections are reused, limited, reaped and validated."""
+  def Pool(self, **kwds):
+    """Returns a ConnectionPool that creates FakeConnection objects."""
+    self.connections = []
+    def _Connect():
+      connection = FakeConnection(len(self.connections))
+      self.connections.append(connection)
+      return connection
+    return pool.ConnectionPool(_Connect, **kwds)
+
+  def testReuse(self):
+    """Released connections are handed out again"""
+    connections = self.Pool()
+    first = connections.Acquire()
+    connections.Release(first)
+    self.assertTrue(connections.Acquire() is first)
+    self.assertEqual(len(self.connections), 1)
+
+  def testOverflowClosedOnRelease(self):
+    """Overflow connections are closed when the pool has no room for them"""
+    connections = self.Pool(size=1, overflow=1)
+    first = connections.Acquire()
+    second = connections.Acquire()
+    connections.Release(first)
+    connections.Release(second)
+    self.assertFalse(first.closed)
+    self.assertTrue(second.closed)
+    self.assertEqual(len(connections), 1)
+    self.assertEqual(connections.Statistics()['closed'], 1)
+
+  def testTimeout(self):
+    """Acquire raises OperationalError when no connection becomes available"""
+    connections = self.Pool(size=1, overflow=0, timeout=0.01)
+    connections.Acquire()
+    self.assertRaises(pool.ConnectionPool.OperationalError,
+                      connections.Acquire)
+    self.assertEqual(connections.Statistics()['timeouts'], 1)
+
+  def testWaitForRelease(self):
+    """A blocked Acquire gets the connection that another thread releases"""
+    connections = self.Pool(size=1, overflow=0, timeout=5)
+    first = connections.Acquire()
+    releaser = threading.Timer(0.01, connections.Release, (first,))
+    releaser.start()
+    self.assertTrue(connections.Acquire() is first)
+    releaser.join()
+    stats = connections.Statistics()
+    self.assertEqual(stats['waits'], 1)
+    self.assertTrue(stats['wait_time_max'] > 0)
+
+  def testIdleReaping(self):
+    """Connections idle for longer than max_idle are closed and replaced"""
+    connections = self.Pool(max_idle=0.01)
+    first = connections.Acquire()
+    connections.Release(first)
+    time.sleep(0.02)
+    second = connections.Acquire()
+    self.assertFalse(second is first)
+    self.assertTrue(first.closed)
+    self.assertEqual(connections.Statistics()['reaped'], 1)
+
+  def testValidationReplacement(self):
+    """Connections that fail validation are discarded and replaced"""
+    connections = self.Pool()
+    first = connections.Acquire()
+    connections.Release(first)
+    first.alive = False
+    second = connections.Acquire()
+    self.assertFalse(second is first)
+    self.assertTrue(first.closed)
+    stats = connections.Statistics()
+    self.assertEqual(stats['discarded'], 1)
+    self.assertEqual(stats['created'], 2)
+
+  def testNoValidation(self):
+    """Connections are not pinged if validation is disabled"""
+    connections = self.Pool(validate=False)
+    connections.Release(connections.Acquire())
+    self.assertEqual(connections.Acquire().pings, 0)
+
+  def testFailedConnect(self):
+    """A failing connect does not use up the pool's capacity"""
+    def _Connect():
+      raise pool.ConnectionPool.OperationalError(2003, 'Cannot connect')
+    connections = pool.ConnectionPool(_Connect, size=1, overflow=0)
+    self.assertRaises(pool.ConnectionPool.OperationalError,
+                      connections.Acquire)
+    self.assertEqual(connections.Statistics()['checked_out'], 0)
+
+  def testStatistics(self):
+    """Statistics reports the use of the pool"""
+    connections = self.Pool(size=2, overflow=2)
+    first = connections.Acquire()
+    connections.Acquire()
+    connections.Release(first)
+    stats = connections.Statistics()
+    self.assertEqual(stats['acquired'], 2)
+    self.assertEqual(stats['created'], 2)
+    self.assertEqual(stats['checked_out'], 1)
+    self.assertEqual(stats['idle'], 1)
+    self.assertEqual(stats['peak_checked_out'], 2)
+    self.assertEqual(stats['capacity'], 4)
+    self.assertEqual(stats['utilisation'], 0.25)
+    self.assertEqual(stats['wait_time_avg'], 0.0)
+
+
+if __name__ == '__main__':
+  unittest.main(testRunner=unittest.TextTestRunner(verbosity=2))
@@ -0,0 +1,154 @@
+#!/usr/bin/python2.5
+"""This module implements parameterized statements and their cache.
+
+Statements use the DB-API 'format' and 'pyformat' parameter styles: positional
+placeholders are written as %s, named ones as %(name)s, and a literal percent
+sign as %%. A statement is parsed once, after which binding arguments to it
+is a single string formatting operation.
+
+Classes:
+  Statement: Parsed parameterized statement.
+  StatementCache: Per-connection LRU cache of parsed statements.
+"""
+__author__ = 'Elmer de Looff <elmer@underdark.nl>'
+__version__ = '0.1'
+
+# Standard modules
+import _mysql
+import collections
+import itertools
+import re
+
+PLACEHOLDER = re.compile(r'%(?:\((\w+)\))?([s%])')
+
+
+class Statement(object):
+  """A parsed parameterized statement.
+
+  Besides binding arguments on the client, the statement can be prepared on the
+  server under its `handle`. The `prepared` attribute is managed by the
+  connection, which knows whether the server still has it.
+  """
+  _handles = itertools.count()
+
+  def __init__(self, sql):
+    """Parses the given SQL text for placeholders.
+
+    Raises:
+      ProgrammingError: Positional and named placeholders are mixed.
+    """
+    self.sql = sql
+    self.names = []
+    literals = []
+    position = 0
+    for match in PLACEHOLDER.finditer(sql):
+      if match.group(2) == '%':
+        continue  # Escaped percent sign, stays part of the literal text.
+      literals.append(sql[position:match.start()].replace('%%', '%'))
+      self.names.append(match.group(1))
+      position = match.end()
+    literals.append(sql[position:].replace('%%', '%'))
+    if len(set(name is None for name in self.names)) > 1:
+      raise self.ProgrammingError(
+          'Statement mixes positional and named placeholders: %r' % sql)
+    self.named = bool(self.names) and self.names[0] is not None
+    # A format string that only takes the escaped arguments.
+    self.template = '%s'.join(
+        literal.replace('%', '%%') for literal in literals)
+    # The statement as the server's PREPARE expects it.
+    self.server_sql = '?'.join(literals)
+    self.handle = 'sqltalk_stmt_%d' % next(self._handles)
+    self.prepared = False
+
+  def __len__(self):
+    """Returns the number of placeholders in the statement."""
+    return len(self.names)
+
+  def __repr__(self):
+    return '<%s %r>' % (self.__class__.__name__, self.sql)
+
+  def Bind(self, args, escape):
+    """Returns the SQL text with escaped arguments in place of placeholders.
+
+    Arguments:
+      @ args: sequence / mapping
+        Values for the placeholders, a mapping for named placeholders.
+      @ escape: function
+        Returns SQL literals for a sequence of values.
+    """
+    values = self.Values(args)
+    if not values:
+      return self.template % ()
+    return self.template % tuple(escape(values))
+
+  def Values(self, args):
+    """Returns a list of the values for the placeholders, in order.
+
+    Raises:
+      ProgrammingError: The arguments don't match the placeholders.
+    """
+    if self.named:
+      try:
+        return [args[name] for name in self.names]
+      except KeyError, name:
+        raise self.ProgrammingError('No value for placeholder %s.' % name)
+      except TypeError:
+        raise self.ProgrammingError(
+            'Named placeholders require a mapping of arguments.')
+    if isinstance(args, dict):
+      if self.names:
+        raise self.ProgrammingError(
+            'Positional placeholders require a sequence of arguments.')
+      return []
+    args = list(args)
+    if len(args) != len(self.names):
+      raise self.ProgrammingError(
+          'Statement has %d placeholders, but %d arguments were given.' % (
+              len(self.names), len(args)))
+    return args
+
+  ProgrammingError = _mysql.ProgrammingError
+
+
+class StatementCache(object):
+  """Least-recently-used cache of parsed statements, keyed by their SQL text.
+
+  Statements that drop out of the cache while prepared on the server are kept
+  in `evicted`, for the connection to deallocate.
+  """
+  def __init__(self, maxsize=100):
+    self.maxsize = maxsize
+    self.evicted = []
+    self.hits = self.misses = 0
+    self._statements = collections.OrderedDict()
+
+  def __contains__(self, sql):
+    return sql in self._statements
+
+  def __len__(self):
+    return len(self._statements)
+
+  def Get(self, sql):
+    """Returns the Statement for the given SQL text, parsing it if needed."""
+    try:
+      statement = self._statements.pop(sql)
+      self.hits += 1
+    except KeyError:
+      statement = Statement(sql)
+      self.misses += 1
+      if self.maxsize and len(self._statements) >= self.maxsize:
+        _sql, evicted = self._statements.popitem(last=False)
+        if evicted.prepared:
+          self.evicted.append(evicted)
+    if self.maxsize:
+      self._statements[sql] = statement
+    return statement
+
+  def Reset(self):
+    """Marks all statements as no longer prepared on the server.
+
+    This is for after a reconnect, which drops all server-side statements.
+    """
+    for statement in self._statements.itervalues():
+      statement.prepared = False
+    del self.evicted[:]
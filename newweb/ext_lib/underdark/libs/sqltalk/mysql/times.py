@@ -14,6 +14,7 @@ import time
 
 
 INTERPRET_AS_UTC = pytz.utc.localize
+UTC = pytz.utc
 
 def DateFromTicks(ticks):
   """Convert UNIX ticks into a date instance."""
@@ -27,6 +28,8 @@ def DateOrNone(string):
     datetime.date object, or None if input is bad.
   """
   try:
+    if len(string) == 10 and string[4] == string[7] == '-':
+      return datetime.date(int(string[:4]), int(string[5:7]), int(string[8:]))
     return datetime.date(*map(int, string.split('-')))
   except ValueError:
     return None
@@ -35,9 +38,24 @@ def DateOrNone(string):
 def DateTimeOrNone(string):
   """Converts an input string to a datetime.datetime object.
 
+  Strings in MySQL's own format ('YYYY-MM-DD hh:mm:ss', optionally with
+  fractional seconds) are sliced rather than split, which is much faster.
+  Anything after the seconds other than their fraction (such as a UTC offset)
+  makes the string bad input, as it would be for the slower way.
+
   Returns:
     datetime.datetime object, or None if input is bad.
   """
+  if (19 <= len(string) <= 26 and string[10] in ' T' and
+      string[4] == string[7] == '-' and string[13] == string[16] == ':' and
+      string[19:20] in ('', '.')):
+    try:
+      return datetime.datetime(
+          int(string[:4]), int(string[5:7]), int(string[8:10]),
+          int(string[11:13]), int(string[14:16]), int(string[17:19]),
+          int(string[20:26].ljust(6, '0')), tzinfo=UTC)
+    except ValueError:
+      pass  # Not zero-padded or otherwise unusual, try the slower way below.
   if ' ' in string:
     separator = ' '
   elif 'T' in string:
@@ -46,8 +64,8 @@ def DateTimeOrNone(string):
     return DateOrNone(string)
   try:
     strdate, strtime = string.split(separator)
-    return INTERPRET_AS_UTC(
-        datetime.datetime(*map(int, strdate.split('-') + strtime.split(':'))))
+    return datetime.datetime(
+        *map(int, strdate.split('-') + strtime.split(':')), tzinfo=UTC)
   except ValueError:
     return DateOrNone(string)
 
@@ -81,9 +99,9 @@ def MysqlTimestampConverter(stamp):
     return DateTimeOrNone(stamp)
   try:
     stamp = stamp.ljust(14, '0')
-    return INTERPRET_AS_UTC(datetime.datetime(
+    return datetime.datetime(
         *map(int, (stamp[:4], stamp[4:6], stamp[6:8],
-                   stamp[8:10], stamp[10:12], stamp[12:14]))))
+                   stamp[8:10], stamp[10:12], stamp[12:14])), tzinfo=UTC)
   except ValueError:
     return None
 
@@ -0,0 +1,89 @@
+#!/usr/bin/python2.5
+"""Testsuite for the MySQL date and time converters."""
+__author__ = 'Elmer de Looff <elmer@underdark.nl>'
+__version__ = '0.1'
+
+# Standard modules
+import datetime
+import unittest
+
+# Third-party modules
+import pytz
+
+# Unittest target
+from underdark.libs.sqltalk.mysql import times
+
+
+class DateTimeOrNoneTest(unittest.TestCase):
+  """DATETIME strings are converted to datetimes in UTC, or None if bad."""
+  def setUp(self):
+    self.stamp = datetime.datetime(2012, 3, 1, 13, 4, 5, tzinfo=pytz.utc)
+
+  def testMysqlFormat(self):
+    """MySQL's own format is converted to a datetime in UTC"""
+    result = times.DateTimeOrNone('2012-03-01 13:04:05')
+    self.assertEqual(result, self.stamp)
+    self.assertTrue(result.tzinfo is pytz.utc)
+
+  def testIsoSeparator(self):
+    """A 'T' between date and time is accepted like a space"""
+    self.assertEqual(times.DateTimeOrNone('2012-03-01T13:04:05'), self.stamp)
+
+  def testFractions(self):
+    """Fractional seconds of any precision are converted to microseconds"""
+    convert = times.DateTimeOrNone
+    self.assertEqual(convert('2012-03-01 13:04:05.5'),
+                     self.stamp.replace(microsecond=500000))
+    self.assertEqual(convert('2012-03-01 13:04:05.000123'),
+                     self.stamp.replace(microsecond=123))
+
+  def testUnpadded(self):
+    """Strings that are not zero-padded are converted the slower way"""
+    self.assertEqual(times.DateTimeOrNone('2012-3-1 13:4:5'), self.stamp)
+
+  def testDateOnly(self):
+    """A string without a time part is converted to a date"""
+    self.assertEqual(times.DateTimeOrNone('2012-03-01'),
+                     datetime.date(2012, 3, 1))
+
+  def testOffsetsAreBad(self):
+    """Strings with a UTC offset or zone are bad, instead of read as UTC"""
+    for string in ('2012-03-01 13:04:05+0200', '2012-03-01 13:04:05+02:00',
+                   '2012-03-01 13:04:05.123456+02:00', '2012-03-01 13:04:05Z'):
+      self.assertEqual(times.DateTimeOrNone(string), None, string)
+
+  def testBadInput(self):
+    """Strings that are not a date and time give None"""
+    for string in ('', 'yesterday', '2012/03/01 13.04.05',
+                   '0000-00-00 00:00:00'):
+      self.assertEqual(times.DateTimeOrNone(string), None, string)
+
+
+class DateOrNoneTest(unittest.TestCase):
+  """DATE strings are converted to dates, or None if bad."""
+  def testConversion(self):
+    """Padded and unpadded dates are converted"""
+    date = datetime.date(2012, 3, 1)
+    self.assertEqual(times.DateOrNone('2012-03-01'), date)
+    self.assertEqual(times.DateOrNone('2012-3-1'), date)
+
+  def testBadInput(self):
+    """Strings that are not a date give None"""
+    for string in ('0000-00-00', '2012-13-01', '2012-03-0x'):
+      self.assertEqual(times.DateOrNone(string), None, string)
+
+
+class MysqlTimestampConverterTest(unittest.TestCase):
+  """TIMESTAMP strings in either of MySQL's formats are converted."""
+  def testFormats(self):
+    """Both the DATETIME format and the compact format are converted"""
+    stamp = datetime.datetime(2012, 3, 1, 13, 4, 5, tzinfo=pytz.utc)
+    self.assertEqual(times.MysqlTimestampConverter('2012-03-01 13:04:05'),
+                     stamp)
+    self.assertEqual(times.MysqlTimestampConverter('20120301130405'), stamp)
+    self.assertEqual(times.MysqlTimestampConverter('201203011304'),
+                     stamp.replace(second=0))
+
+
+if __name__ == '__main__':
+  unittest.main(testRunner=unittest.TextTestRunner(verbosity=2))
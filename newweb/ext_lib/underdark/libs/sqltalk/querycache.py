@@ -0,0 +1,287 @@
+#!/usr/bin/python2.5
+"""Result cache for read queries, invalidated per table.
+
+Cached results are keyed on the normalized SQL text and the bound arguments.
+Besides expiring after their TTL, entries become invalid as soon as a table
+they read from is written to: every table has a version in the storage, and
+an entry is only valid while the versions of its tables are those recorded
+when the query was executed. Invalidating a table is a matter of giving it a
+new version, so no bookkeeping of which entries depend on which tables is
+needed, and this works across processes that share a storage.
+
+Classes:
+  DictStorage: Simple in-process storage for cache entries.
+  QueryCache: Result cache for read queries.
+
+Functions:
+  Cacheable: Returns whether the result of a statement may be cached.
+  Normalize: Returns the statement with insignificant whitespace collapsed.
+  ReadTables: Returns the names of the tables a statement reads from.
+  WrittenTables: Returns the names of the tables a statement writes to.
+"""
+__author__ = 'Elmer de Looff <elmer@underdark.nl>'
+__version__ = '0.1'
+
+# Standard modules
+import collections
+import copy
+import hashlib
+import itertools
+import re
+import threading
+import time
+
+# Quoted strings and identifiers, which normalization leaves alone.
+QUOTED = r"""'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*"|`[^`]*`"""
+QUOTED_PARTS = re.compile(QUOTED)
+WHITESPACE = re.compile(r'(%s)|\s+' % QUOTED)
+TABLE_NAME = r'(?:`[^`]+`|\w+)(?:\s*\.\s*(?:`[^`]+`|\w+))?'
+FROM_CLAUSE = re.compile(
+    r'\bFROM\s+(.+?)(?=\bWHERE\b|\bGROUP\b|\bORDER\b|\bHAVING\b|\bLIMIT\b|'
+    r'\bUNION\b|\bJOIN\b|\bINNER\b|\bLEFT\b|\bRIGHT\b|\bCROSS\b|\bNATURAL\b|'
+    r'\bSTRAIGHT_JOIN\b|\bFOR\b|\bLOCK\b|\bSELECT\b|\bFROM\b|\)|;|$)',
+    re.I | re.S)
+JOIN_CLAUSE = re.compile(r'\bJOIN\s+(%s)' % TABLE_NAME, re.I)
+LEADING_TABLE = re.compile(r'\s*(%s)' % TABLE_NAME)
+# Statements whose result depends on more than the data they read: the time,
+# the session (user variables and connection functions) or randomness. Names
+# that may also be those of tables or columns only count as function calls.
+UNCACHEABLE = re.compile(
+    r'\b(?:SQL_CALC_FOUND_ROWS|SQL_NO_CACHE|INTO|FOR\s+UPDATE'
+    r'|LOCK\s+IN\s+SHARE\s+MODE|CURRENT_DATE|CURRENT_TIME|CURRENT_TIMESTAMP'
+    r'|CURRENT_USER|LOCALTIME|LOCALTIMESTAMP)\b'
+    r'|\b(?:FOUND_ROWS|LAST_INSERT_ID|ROW_COUNT|RAND|UUID|UUID_SHORT|NOW'
+    r'|CURDATE|CURTIME|SYSDATE|UNIX_TIMESTAMP|UTC_DATE|UTC_TIME|UTC_TIMESTAMP'
+    r'|CONNECTION_ID|USER|SESSION_USER|SYSTEM_USER|DATABASE|SCHEMA|SLEEP'
+    r'|BENCHMARK|GET_LOCK|IS_FREE_LOCK|IS_USED_LOCK|RELEASE_LOCK'
+    r'|MASTER_POS_WAIT)\s*\('
+    r'|@', re.I)
+WRITE_STATEMENT = re.compile(
+    r'\s*(?:(?:INSERT|REPLACE)\s+'
+    r'(?:(?:LOW_PRIORITY|DELAYED|HIGH_PRIORITY|IGNORE)\s+)*(?:INTO\s+)?|'
+    r'UPDATE\s+(?:(?:LOW_PRIORITY|IGNORE)\s+)*|'
+    r'DELETE\s+(?:(?:LOW_PRIORITY|QUICK|IGNORE)\s+)*FROM\s+|'
+    r'TRUNCATE\s+(?:TABLE\s+)?|(?:DROP|ALTER)\s+TABLE\s+(?:IF\s+EXISTS\s+)?)'
+    r'(%s)' % TABLE_NAME, re.I)
+UPDATE_TABLES = re.compile(
+    r'\s*UPDATE\s+(?:(?:LOW_PRIORITY|IGNORE)\s+)*(.+?)\s+SET\b', re.I | re.S)
+FIRST_WORD = re.compile(r'\s*(\w+)')
+WRITE_KEYWORDS = frozenset(('insert', 'replace', 'update', 'delete', 'truncate',
+                            'drop', 'alter'))
+
+
+def Cacheable(sql):
+  """Returns whether the result of the given statement may be cached.
+
+  Only SELECT statements qualify, and not those whose result depends on more
+  than the data they read (e.g. NOW(), FOUND_ROWS(), RAND() or user variables),
+  nor those that lock rows or store their result elsewhere. String literals
+  and quoted names are not looked at.
+  """
+  return (sql.lstrip()[:6].lower() == 'select' and
+          UNCACHEABLE.search(QUOTED_PARTS.sub("''", sql)) is None)
+
+
+def Normalize(sql):
+  """Returns the statement with insignificant whitespace collapsed.
+
+  Whitespace inside string literals and quoted identifiers is preserved.
+  """
+  return WHITESPACE.sub(lambda match: match.group(1) or ' ', sql).strip()
+
+
+def ReadTables(sql):
+  """Returns the names of the tables a statement reads from, as a frozenset.
+
+  Names are lowercased, without quotes or database name. This looks at FROM
+  and JOIN clauses only, which covers the statements that Cursor.Select()
+  generates and most hand-written ones.
+  """
+  tables = set(map(_TableName, JOIN_CLAUSE.findall(sql)))
+  for clause in FROM_CLAUSE.findall(Normalize(sql)):
+    for reference in clause.split(','):
+      match = LEADING_TABLE.match(reference)
+      if match and not reference.lstrip().startswith('('):
+        tables.add(_TableName(match.group(1)))
+  return frozenset(tables)
+
+
+def WrittenTables(sql):
+  """Returns the names of the tables a statement writes to, as a frozenset.
+
+  This errs on the side of caution: for multi-table updates and deletes, and
+  for INSERT ... SELECT, every table that is referenced is included. For
+  statements that don't write, this is empty.
+  """
+  keyword = FIRST_WORD.match(sql)
+  if keyword is None or keyword.group(1).lower() not in WRITE_KEYWORDS:
+    return frozenset()
+  tables = set(ReadTables(sql))
+  match = WRITE_STATEMENT.match(sql)
+  if match is not None:
+    tables.add(_TableName(match.group(1)))
+  match = UPDATE_TABLES.match(sql)
+  if match is not None:
+    for reference in match.group(1).split(','):
+      table = LEADING_TABLE.match(reference)
+      if table is not None:
+        tables.add(_TableName(table.group(1)))
+  return frozenset(tables)
+
+
+def _TableName(reference):
+  """Returns the bare, lowercased table name for a table reference."""
+  return reference.rsplit('.', 1)[-1].strip(' `').lower()
+
+
+class DictStorage(object):
+  """In-process storage for cache entries, used if no other is provided.
+
+  This has the Get(), Set() and Del() methods of the PageMaker's CacheStorage,
+  which is the interface QueryCache expects of its storage.
+  """
+  def __init__(self):
+    self._dict = {}
+
+  def __len__(self):
+    return len(self._dict)
+
+  def Del(self, key):
+    self._dict.pop(key, None)
+
+  def Get(self, key, *default):
+    try:
+      return self._dict[key]
+    except KeyError:
+      if default:
+        return default[0]
+      raise
+
+  def Set(self, key, value):
+    self._dict[key] = value
+
+
+class QueryCache(object):
+  """Result cache for read queries, invalidated per table.
+
+  Members:
+    % hits, misses: int
+      Number of lookups that were, and were not, answered from the cache.
+    % invalidations: int
+      Number of times a table was invalidated.
+  """
+  def __init__(self, ttl=60, maxsize=1000, storage=None,
+               prefix='sqltalk.querycache'):
+    """Initializes a QueryCache.
+
+    Arguments:
+      % ttl: float ~~ 60
+        Default number of seconds a result stays valid.
+      % maxsize: int ~~ 1000
+        Number of results that are kept; the least recently used one is
+        removed when a new one would exceed this.
+      % storage: object ~~ None
+        Storage for the results, with the methods Get(key, default), Set(key,
+        value) and Del(key). The PageMaker's CacheStorage qualifies. By
+        default, results are kept in a dictionary private to the cache.
+      % prefix: str ~~ 'sqltalk.querycache'
+        Prefix for all keys in the storage.
+    """
+    self.ttl = ttl
+    self.maxsize = maxsize
+    self.storage = DictStorage() if storage is None else storage
+    self.prefix = prefix
+    self.hits = self.misses = self.invalidations = 0
+    self._keys = collections.OrderedDict()
+    self._lock = threading.Lock()
+    self._versions = itertools.count()
+
+  def __len__(self):
+    """Returns the number of results this cache has stored."""
+    return len(self._keys)
+
+  def Clear(self):
+    """Removes all results this cache has stored."""
+    with self._lock:
+      keys, self._keys = self._keys, collections.OrderedDict()
+    for key in keys:
+      self.storage.Del(key)
+
+  def Fetch(self, sql, args, execute, ttl=None, store=True):
+    """Returns the cached result for the statement, or executes and caches it.
+
+    Arguments:
+      @ sql: str
+        The statement, with placeholders if `args` are given.
+      @ args: sequence / mapping / None
+        Values for the placeholders in the statement.
+      @ execute: callable
+        Called without arguments to execute the statement on a cache miss.
+        Returns the sqlresult.ResultSet to cache.
+      % ttl: float ~~ None
+        Number of seconds the result stays valid, the cache's default if None.
+      % store: bool ~~ True
+        Whether the result is stored when the statement is executed. If not,
+        only a result that is already cached is used.
+
+    Returns:
+      sqlresult.ResultSet: a copy of the cached result, so the caller is free to
+                           modify it.
+    """
+    key = self._Key(sql, args)
+    tables = sorted(ReadTables(sql))
+    # Versions are taken before executing the statement. If a table is written
+    # to while it runs, the stored result is outdated from the start.
+    versions = self._Versions(tables)
+    entry = self.storage.Get(key, None)
+    if entry is not None:
+      expires, entry_versions, result = entry
+      if expires > time.time() and entry_versions == versions:
+        self._Touch(key)
+        self.hits += 1
+        return copy.copy(result)
+    self.misses += 1
+    result = execute()
+    if not store:
+      return result
+    expires = time.time() + (self.ttl if ttl is None else ttl)
+    self.storage.Set(key, (expires, versions, copy.copy(result)))
+    self._Touch(key)
+    return result
+
+  def Invalidate(self, *tables):
+    """Invalidates all cached results that read from the given tables."""
+    for table in tables:
+      self.storage.Set(self._VersionKey(_TableName(table)), (
+          time.time(), next(self._versions)))
+      self.invalidations += 1
+
+  def _Key(self, sql, args):
+    """Returns the storage key for the statement and its arguments."""
+    if isinstance(args, dict):
+      args = sorted(args.iteritems())
+    elif args is not None:
+      args = tuple(args)
+    digest = hashlib.sha1(Normalize(sql))
+    digest.update('\0%r' % (args or (),))
+    return '%s.result.%s' % (self.prefix, digest.hexdigest())
+
+  def _Touch(self, key):
+    """Marks the key as most recently used, removing the oldest if needed."""
+    evicted = []
+    with self._lock:
+      self._keys.pop(key, None)
+      self._keys[key] = None
+      while len(self._keys) > self.maxsize:
+        evicted.append(self._keys.popitem(last=False)[0])
+    for key in evicted:
+      self.storage.Del(key)
+
+  def _Versions(self, tables):
+    """Returns the current versions of the given tables."""
+    return tuple(self.storage.Get(self._VersionKey(table), None)
+                 for table in tables)
+
+  def _VersionKey(self, table):
+    """Returns the storage key for the version of the given table."""
+    return '%s.table.%s' % (self.prefix, table)
@@ -0,0 +1,156 @@
+#!/usr/bin/python2.5
+"""Testsuite for the query result cache."""
+__author__ = 'Elmer de Looff <elmer@underdark.nl>'
+__version__ = '0.1'
+
+# Standard modules
+import time
+import unittest
+
+# Unittest target
+import querycache
+import sqlresult
+
+
+class StatementAnalysisTest(unittest.TestCase):
+  """Statements are normalized and analyzed for the tables they use."""
+  def testNormalize(self):
+    """Whitespace is collapsed, except within quotes"""
+    self.assertEqual(
+        querycache.Normalize(" SELECT *\n  FROM `my  table` WHERE a='x  y' "),
+        "SELECT * FROM `my  table` WHERE a='x  y'")
+
+  def testCacheable(self):
+    """Only SELECT statements that depend on the data alone are cacheable"""
+    self.assertTrue(querycache.Cacheable('SELECT * FROM `user`'))
+    self.assertFalse(querycache.Cacheable('DELETE FROM `user`'))
+    self.assertFalse(querycache.Cacheable('SELECT FOUND_ROWS()'))
+    self.assertFalse(querycache.Cacheable('SELECT * FROM t FOR UPDATE'))
+    self.assertFalse(querycache.Cacheable('SELECT * FROM t ORDER BY RAND()'))
+
+  def testTimeDependentNotCacheable(self):
+    """Statements that depend on the current time are not cacheable"""
+    for sql in ('SELECT NOW()',
+                'SELECT * FROM t WHERE d > NOW() - INTERVAL 1 DAY',
+                'SELECT * FROM t WHERE d = CURDATE()',
+                'SELECT * FROM t WHERE d < CURRENT_TIMESTAMP',
+                'SELECT SYSDATE()',
+                'SELECT UNIX_TIMESTAMP ()',
+                'SELECT * FROM t WHERE d < utc_timestamp()'):
+      self.assertFalse(querycache.Cacheable(sql), sql)
+
+  def testSessionDependentNotCacheable(self):
+    """Statements using variables or session functions are not cacheable"""
+    for sql in ('SELECT @var', 'SELECT * FROM t WHERE id = @id',
+                'SELECT @@session.sql_mode', 'SELECT CONNECTION_ID()',
+                'SELECT SLEEP(1)', 'SELECT GET_LOCK("lock", 10)',
+                'SELECT DATABASE()', 'SELECT USER()'):
+      self.assertFalse(querycache.Cacheable(sql), sql)
+
+  def testFunctionNamesAsIdentifiers(self):
+    """Names of functions in literals or as identifiers don't matter"""
+    self.assertTrue(querycache.Cacheable('SELECT * FROM user WHERE now = 1'))
+    self.assertTrue(querycache.Cacheable(
+        "SELECT * FROM `database` WHERE email = 'me@example.com'"))
+    self.assertTrue(querycache.Cacheable(
+        "SELECT * FROM t WHERE label = 'NOW() or never'"))
+
+  def testReadTables(self):
+    """Tables are found in FROM and JOIN clauses, and subqueries"""
+    self.assertEqual(querycache.ReadTables(
+        'SELECT * FROM db.`User` AS u, message m LEFT JOIN `flag` USING (id) '
+        'WHERE u.id IN (SELECT user FROM admin)'),
+                     frozenset(('user', 'message', 'flag', 'admin')))
+
+  def testWrittenTables(self):
+    """Tables written to are found for all kinds of write statements"""
+    written = querycache.WrittenTables
+    self.assertEqual(written('INSERT INTO `log` SET `a`=1'), set(['log']))
+    self.assertEqual(written('update IGNORE a, b SET a.x=b.x'), set('ab'))
+    self.assertEqual(written('DELETE a FROM a JOIN b USING (id)'), set('ab'))
+    self.assertEqual(written('TRUNCATE TABLE `log`'), set(['log']))
+    self.assertEqual(written('SELECT * FROM `log`'), set())
+
+
+class QueryCacheTest(unittest.TestCase):
+  """Results are cached until they expire or their tables are written to."""
+  def setUp(self):
+    """Sets up a cache and a counter of executed queries."""
+    self.cache = querycache.QueryCache(ttl=60, maxsize=10)
+    self.executed = 0
+
+  def Execute(self, value=1):
+    """Fake query execution, returns a ResultSet with a single value."""
+    self.executed += 1
+    return sqlresult.ResultSet(result=[(value,)], fields=[('value',)])
+
+  def Fetch(self, sql='SELECT value FROM t WHERE id=%s', args=(1,), **kwds):
+    """Fetches a result through the cache, returning its single value."""
+    return self.cache.Fetch(sql, args, self.Execute, **kwds)[0][0]
+
+  def testCached(self):
+    """A repeated query is answered from the cache"""
+    self.Fetch()
+    self.Fetch('SELECT value\n  FROM t WHERE id=%s')
+    self.assertEqual(self.executed, 1)
+    self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+  def testArgumentsInKey(self):
+    """Different arguments give different cache entries"""
+    self.Fetch(args=(1,))
+    self.Fetch(args=(2,))
+    self.Fetch('SELECT * FROM t WHERE id=%(id)s', {'id': 1})
+    self.assertEqual(self.executed, 3)
+
+  def testCopies(self):
+    """Changes to a returned ResultSet don't affect the cached one"""
+    self.cache.Fetch('SELECT * FROM t', None, self.Execute).PopRow(0)
+    self.assertEqual(len(self.cache.Fetch('SELECT * FROM t', None, None)), 1)
+
+  def testExpiry(self):
+    """Results are executed again once their TTL expires"""
+    self.Fetch(ttl=0.01)
+    time.sleep(0.02)
+    self.Fetch()
+    self.assertEqual(self.executed, 2)
+
+  def testInvalidate(self):
+    """Writing to a table invalidates the results that read from it"""
+    self.Fetch()
+    self.Fetch('SELECT * FROM u')
+    self.cache.Invalidate('`T`')
+    self.Fetch()
+    self.Fetch('SELECT * FROM u')
+    self.assertEqual(self.executed, 3)
+
+  def testWriteDuringExecution(self):
+    """A result is not cached as valid if its table changes while executing"""
+    def ExecuteAndWrite():
+      self.cache.Invalidate('t')
+      return self.Execute()
+    self.cache.Fetch('SELECT * FROM t', None, ExecuteAndWrite)
+    self.Fetch('SELECT * FROM t', None)
+    self.assertEqual(self.executed, 2)
+
+  def testFetchWithoutStoring(self):
+    """Without storing, cached results are used but new ones are not kept"""
+    self.Fetch(store=False)
+    self.Fetch(store=False)
+    self.assertEqual(self.executed, 2)
+    self.assertEqual(len(self.cache), 0)
+    self.Fetch()
+    self.assertEqual(self.Fetch(store=False), 1)
+    self.assertEqual(self.executed, 3)
+
+  def testSizeLimit(self):
+    """The least recently used results are removed to make room"""
+    for number in range(12):
+      self.Fetch(args=(number,))
+    self.assertEqual(len(self.cache), 10)
+    self.assertEqual(len(self.cache.storage), 10)
+    self.Fetch(args=(0,))
+    self.assertEqual(self.executed, 13)
+
+
+if __name__ == '__main__':
+  unittest.main(testRunner=unittest.TextTestRunner(verbosity=2))
@@ -0,0 +1,329 @@
+#!/usr/bin/python2.5
+"""Routing of queries over a primary database and its read replicas.
+
+A Router holds the primary and any number of replicas, each of which is either
+a connection pool (anything with Acquire() and Release() methods) or a single
+connection. A RoutingConnection uses these for a single user of the database,
+typically a request: it behaves like a regular connection, but sends reads to
+a replica and writes to the primary:
+
+  router = routing.Router(primary_pool, [replica_pool, other_replica_pool])
+  connection = routing.RoutingConnection(router, sticky=True)
+  with connection as cursor:
+    cursor.Select('user')                   # Goes to a replica.
+    cursor.Update('user', {'name': 'Bob'}, 'id=5')
+    cursor.Select('user')                   # Goes to the primary.
+  with connection.Primary() as cursor:
+    cursor.Select('user')                   # Goes to the primary.
+  connection.Release()
+
+Reads that follow a write in the same transaction go to the primary, so that
+they see the write. With `sticky`, all reads after the first write do, until
+the RoutingConnection is released.
+
+Classes:
+  Router: Chooses the database connection for reads and writes.
+  RoutingConnection: Connection-like object that routes queries.
+  RoutingCursor: Cursor-like object that routes queries.
+
+Functions:
+  IsRead: Returns whether a statement only reads.
+
+Error Classes:
+  Error: Exception base class.
+  TransactionError: A transaction is already open on the RoutingConnection.
+"""
+__author__ = 'Elmer de Looff <elmer@underdark.nl>'
+__version__ = '0.1'
+
+# Standard modules
+import contextlib
+import logging
+import re
+import threading
+
+READ_STATEMENT = re.compile(r'\s*(?:SELECT|SHOW|DESC|DESCRIBE|EXPLAIN)\b', re.I)
+LOCKING_READ = re.compile(
+    r'\b(?:FOR\s+UPDATE|LOCK\s+IN\s+SHARE\s+MODE|INTO)\b', re.I)
+
+
+class Error(Exception):
+  """Exception base class."""
+
+
+class TransactionError(Error):
+  """A transaction is already open on the RoutingConnection."""
+
+
+def IsRead(sql):
+  """Returns whether the statement only reads, and may go to a replica.
+
+  Locking reads (SELECT ... FOR UPDATE) and SELECT ... INTO are not reads.
+  """
+  return bool(READ_STATEMENT.match(sql)) and not LOCKING_READ.search(sql)
+
+
+class _Source(object):
+  """A pool or single connection, with a count of connections handed out."""
+  def __init__(self, source, name):
+    self.source = source
+    self.name = name
+    self.pooled = hasattr(source, 'Acquire')
+    self.acquired = 0
+    self.load = 0
+
+  def __repr__(self):
+    return '<%s %s, load %d>' % (self.__class__.__name__, self.name, self.load)
+
+  def Acquire(self):
+    return self.source.Acquire() if self.pooled else self.source
+
+  def Release(self, connection):
+    if self.pooled:
+      self.source.Release(connection)
+
+
+class Router(object):
+  """Chooses the database connection for reads and writes.
+
+  Replicas are chosen round-robin, or by least load: the replica with the
+  fewest connections handed out by this router (ties are broken round-robin).
+  When acquiring a connection from a replica fails, the next one is tried, and
+  reads go to the primary if none of the replicas is available.
+  """
+  BALANCE = 'round-robin', 'least-load'
+
+  def __init__(self, primary, replicas=(), balance='round-robin'):
+    """Initializes a Router.
+
+    Arguments:
+      @ primary: pool / connection
+        The primary database, which gets all writes.
+      % replicas: list of pool / connection ~~ ()
+        The read replicas of the primary.
+      % balance: str ~~ 'round-robin'
+        How reads are spread over replicas, 'round-robin' or 'least-load'.
+    """
+    if balance not in self.BALANCE:
+      raise ValueError('Unknown balance %r, use one of %s.' % (
+          balance, ', '.join(self.BALANCE)))
+    self.balance = balance
+    self.logger = logging.getLogger('sqltalk.routing')
+    self.primary = _Source(primary, 'primary')
+    self.replicas = [_Source(replica, 'replica %d' % number)
+                     for number, replica in enumerate(replicas)]
+    self._lock = threading.Lock()
+    self._next = 0
+
+  def AcquirePrimary(self):
+    """Returns a (source, connection) pair for the primary."""
+    return self._Acquire(self.primary)
+
+  def AcquireReplica(self):
+    """Returns a (source, connection) pair for a replica.
+
+    Returns None if there are no replicas, or none of them is available.
+    """
+    for source in self._ReplicaOrder():
+      try:
+        return self._Acquire(source)
+      except Exception:
+        self.logger.exception('Could not acquire a connection for %s.', source)
+    return None
+
+  def Release(self, source, connection):
+    """Returns a connection acquired from the given source."""
+    with self._lock:
+      source.load -= 1
+    source.Release(connection)
+
+  def Statistics(self):
+    """Returns the number of acquired connections, and current load, per source.
+
+    Returns:
+      dict: source name mapped to a dict with 'acquired' and 'load' counts.
+    """
+    with self._lock:
+      return dict((source.name, {'acquired': source.acquired,
+                                 'load': source.load})
+                  for source in [self.primary] + self.replicas)
+
+  def _Acquire(self, source):
+    """Acquires a connection from the source and accounts for it."""
+    connection = source.Acquire()
+    with self._lock:
+      source.acquired += 1
+      source.load += 1
+    return source, connection
+
+  def _ReplicaOrder(self):
+    """Returns the replicas in the order in which they should be tried."""
+    with self._lock:
+      if not self.replicas:
+        return []
+      start = self._next % len(self.replicas)
+      self._next = start + 1
+      order = self.replicas[start:] + self.replicas[:start]
+      if self.balance == 'least-load':
+        order.sort(key=lambda source: source.load)  # Stable, keeps the ties.
+      return order
+
+
+class RoutingConnection(object):
+  """Connection-like object, sends reads to replicas and writes to the primary.
+
+  It acquires at most one connection from the primary and one from a replica,
+  when they are first needed, and keeps them until Release() is called. Other
+  attributes (e.g. EscapeValues) are taken from one of these connections.
+
+  Members:
+    % sticky: bool
+      Whether all reads go to the primary once anything has been written.
+    % wrote: bool
+      Whether anything has been written since the last Release().
+  """
+  def __init__(self, router, sticky=False):
+    self.router = router
+    self.sticky = sticky
+    self.wrote = False
+    self._connections = {}
+    self._cursors = None
+    self._transaction_wrote = False
+
+  def __enter__(self):
+    """Starts a transaction and returns a RoutingCursor.
+
+    Transactions on the underlying connections are started when the cursor
+    first needs them.
+    """
+    if self._cursors is not None:
+      raise TransactionError(
+          'A transaction is already open for this connection.')
+    self._cursors = {}
+    self._transaction_wrote = False
+    return RoutingCursor(self)
+
+  def __exit__(self, exc_type, exc_value, exc_traceback):
+    """Ends the transactions that were started on the underlying connections.
+
+    These are committed or rolled back independently, the replica first.
+    """
+    cursors, self._cursors = self._cursors, None
+    try:
+      if 'replica' in cursors:
+        self._connections['replica'][1].__exit__(
+            exc_type, exc_value, exc_traceback)
+    finally:
+      if 'primary' in cursors:
+        self._connections['primary'][1].__exit__(
+            exc_type, exc_value, exc_traceback)
+
+  def __getattr__(self, attr):
+    """Returns the attribute from one of the underlying connections."""
+    if attr.startswith('_'):
+      raise AttributeError(attr)
+    return getattr(self._Connection(self._ReadRole()), attr)
+
+  @contextlib.contextmanager
+  def Primary(self):
+    """Starts a transaction in which all queries go to the primary.
+
+    Use this for transactions that read in order to write, or that must not
+    see replication lag.
+    """
+    with self as cursor:
+      cursor.primary = True
+      yield cursor
+
+  def Release(self):
+    """Returns the acquired connections, and forgets about earlier writes."""
+    if self._cursors is not None:
+      raise TransactionError('Cannot release during a transaction.')
+    connections, self._connections = self._connections, {}
+    self.wrote = False
+    for source, connection in connections.itervalues():
+      self.router.Release(source, connection)
+
+  def _Connection(self, role):
+    """Returns the connection for the role, acquiring it if needed."""
+    try:
+      return self._connections[role][1]
+    except KeyError:
+      acquired = None
+      if role == 'replica':
+        acquired = self.router.AcquireReplica()
+      if acquired is None:
+        role = 'primary'
+        if role in self._connections:
+          return self._connections[role][1]
+        acquired = self.router.AcquirePrimary()
+      self._connections[role] = acquired
+      return acquired[1]
+
+  def _Cursor(self, write=False, primary=False):
+    """Returns the cursor for a read or write, starting a transaction if needed.
+
+    Arguments:
+      % write: bool ~~ False
+        Whether the cursor is used to write.
+      % primary: bool ~~ False
+        Whether the cursor must be for the primary, even for reading.
+    """
+    if self._cursors is None:
+      raise TransactionError('Queries can only be made in a transaction.')
+    if write:
+      self._transaction_wrote = self.wrote = True
+    role = 'primary' if write or primary else self._ReadRole()
+    try:
+      return self._cursors[role]
+    except KeyError:
+      connection = self._Connection(role)
+      if role == 'replica' and 'replica' not in self._connections:
+        role = 'primary'  # No replica available, reads go to the primary.
+        if role in self._cursors:
+          return self._cursors[role]
+      self._cursors[role] = cursor = connection.__enter__()
+      return cursor
+
+  def _ReadRole(self):
+    """Returns the role of the connection that reads should go to now."""
+    if (not self.router.replicas or self._transaction_wrote or
+        self.sticky and self.wrote):
+      return 'primary'
+    return 'replica'
+
+
+class RoutingCursor(object):
+  """Cursor-like object that routes each query to the primary or a replica.
+
+  Methods that only read go to a replica, those that write (all others) to the
+  primary. For Execute() and Stream(), the statement itself decides. Constants
+  and error classes are taken from an underlying cursor.
+
+  Members:
+    % primary: bool
+      Whether all queries go to the primary.
+  """
+  READ_METHODS = frozenset(('Cached', 'Describe', 'Select', 'SelectIter',
+                            'SelectTables'))
+  STATEMENT_METHODS = frozenset(('Execute', 'Stream'))
+
+  def __init__(self, connection, primary=False):
+    self.connection = connection
+    self.primary = primary
+
+  def __getattr__(self, attr):
+    if attr.startswith('_'):
+      raise AttributeError(attr)
+    connection = self.connection
+    if attr.isupper() or attr.endswith(('Error', 'Warning')):
+      return getattr(connection._Cursor(primary=self.primary), attr)
+    if attr in self.READ_METHODS:
+      return getattr(connection._Cursor(primary=self.primary), attr)
+    if attr in self.STATEMENT_METHODS:
+      def _Routed(query, *args, **kwds):
+        cursor = connection._Cursor(write=not IsRead(query),
+                                    primary=self.primary)
+        return getattr(cursor, attr)(query, *args, **kwds)
+      return _Routed
+    return getattr(connection._Cursor(write=True), attr)
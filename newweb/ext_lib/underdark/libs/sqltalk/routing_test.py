@@ -0,0 +1,181 @@
+#!/usr/bin/python2.5
+"""Testsuite for read-replica routing, using SQLite files as databases."""
+__author__ = 'Elmer de Looff <elmer@underdark.nl>'
+__version__ = '0.1'
+
+# Standard modules
+import os
+import shutil
+import tempfile
+import unittest
+
+# Unittest target
+import routing
+from underdark.libs.sqltalk import sqlite
+
+
+class FakePool(object):
+  """Minimal connection pool, hands out connections to a single database."""
+  def __init__(self, database):
+    self.database = database
+    self.released = []
+
+  def Acquire(self):
+    return sqlite.Connect(self.database)
+
+  def Release(self, connection):
+    self.released.append(connection)
+
+
+class RoutingTest(unittest.TestCase):
+  """Reads go to replicas, writes and read-your-writes to the primary."""
+  def setUp(self):
+    """Sets up a primary and two replicas, which know their own name."""
+    self.directory = tempfile.mkdtemp()
+    self.pools = []
+    for name in ('primary', 'replica 0', 'replica 1'):
+      database = os.path.join(self.directory, '%s.db' % name)
+      with sqlite.Connect(database) as cursor:
+        cursor.Execute('CREATE TABLE server (name TEXT)')
+        cursor.Insert('server', {'name': name})
+      self.pools.append(FakePool(database))
+    self.router = routing.Router(self.pools[0], self.pools[1:])
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def Server(self, cursor):
+    """Returns the name of the server that a read is sent to."""
+    return cursor.Select('server', fields='name')[0][0]
+
+  def testIsRead(self):
+    """Statements that only read are told apart from the rest"""
+    self.assertTrue(routing.IsRead(' select * from server'))
+    self.assertTrue(routing.IsRead('SHOW TABLES'))
+    self.assertFalse(routing.IsRead('SELECT * FROM server FOR UPDATE'))
+    self.assertFalse(routing.IsRead('INSERT INTO server SELECT 1'))
+
+  def testReadsToReplica(self):
+    """Reads go to a replica, the same one for the whole request"""
+    connection = routing.RoutingConnection(self.router)
+    with connection as cursor:
+      self.assertEqual(self.Server(cursor), 'replica 0')
+      self.assertEqual(cursor.Execute('SELECT name FROM server')[0][0],
+                       'replica 0')
+    with connection as cursor:
+      self.assertEqual(self.Server(cursor), 'replica 0')
+
+  def testRoundRobin(self):
+    """Requests are spread over replicas in turn"""
+    servers = []
+    for _request in range(3):
+      connection = routing.RoutingConnection(self.router)
+      with connection as cursor:
+        servers.append(self.Server(cursor))
+      connection.Release()
+    self.assertEqual(servers, ['replica 0', 'replica 1', 'replica 0'])
+
+  def testLeastLoad(self):
+    """With least-load balancing, the replica with fewest users is chosen"""
+    router = routing.Router(self.pools[0], self.pools[1:], 'least-load')
+    busy = routing.RoutingConnection(router)
+    with busy as cursor:
+      self.assertEqual(self.Server(cursor), 'replica 0')
+    for _request in range(2):
+      connection = routing.RoutingConnection(router)
+      with connection as cursor:
+        self.assertEqual(self.Server(cursor), 'replica 1')
+      connection.Release()
+    statistics = router.Statistics()
+    self.assertEqual(statistics['replica 0'], {'acquired': 1, 'load': 1})
+    self.assertEqual(statistics['replica 1'], {'acquired': 2, 'load': 0})
+
+  def testWrites(self):
+    """Writes go to the primary, and so do later reads in that transaction"""
+    connection = routing.RoutingConnection(self.router)
+    with connection as cursor:
+      self.assertEqual(self.Server(cursor), 'replica 0')
+      cursor.Insert('server', {'name': 'written'})
+      self.assertEqual(self.Server(cursor), 'primary')
+      self.assertEqual(len(cursor.Select('server')), 2)
+    with connection as cursor:
+      self.assertEqual(self.Server(cursor), 'replica 0')
+    self.assertTrue(connection.wrote)
+
+  def testStatementWrites(self):
+    """Execute() sends statements that write to the primary"""
+    connection = routing.RoutingConnection(self.router)
+    with connection as cursor:
+      cursor.Execute("UPDATE server SET name='changed'")
+    with connection.Primary() as cursor:
+      self.assertEqual(self.Server(cursor), 'changed')
+
+  def testSticky(self):
+    """With sticky, all reads after a write go to the primary until release"""
+    connection = routing.RoutingConnection(self.router, sticky=True)
+    with connection as cursor:
+      cursor.Insert('server', {'name': 'written'})
+    with connection as cursor:
+      self.assertEqual(self.Server(cursor), 'primary')
+    connection.Release()
+    with connection as cursor:
+      self.assertEqual(self.Server(cursor), 'replica 0')
+
+  def testPrimary(self):
+    """Primary() forces reads to go to the primary"""
+    connection = routing.RoutingConnection(self.router)
+    with connection.Primary() as cursor:
+      self.assertEqual(self.Server(cursor), 'primary')
+    self.assertFalse(connection.wrote)
+
+  def testRollback(self):
+    """A failing transaction is rolled back on the primary"""
+    connection = routing.RoutingConnection(self.router)
+    try:
+      with connection as cursor:
+        cursor.Insert('server', {'name': 'written'})
+        raise ValueError('Abort transaction')
+    except ValueError:
+      pass
+    with connection.Primary() as cursor:
+      self.assertEqual(len(cursor.Select('server')), 1)
+
+  def testNoReplicas(self):
+    """Without replicas, reads and writes share the primary's connection"""
+    primary = sqlite.Connect(os.path.join(self.directory, 'primary.db'))
+    connection = routing.RoutingConnection(routing.Router(primary))
+    with connection as cursor:
+      self.assertEqual(self.Server(cursor), 'primary')
+      cursor.Insert('server', {'name': 'written'})
+      self.assertEqual(len(cursor.Select('server')), 2)
+
+  def testFailingReplica(self):
+    """Reads go to the next replica if acquiring a connection fails"""
+    def Failing():
+      raise sqlite.OperationalError('Replica is down')
+    self.pools[1].Acquire = Failing
+    connection = routing.RoutingConnection(self.router)
+    with connection as cursor:
+      self.assertEqual(self.Server(cursor), 'replica 1')
+
+  def testNestedTransaction(self):
+    """Transactions on a RoutingConnection cannot be nested"""
+    connection = routing.RoutingConnection(self.router)
+    with connection:
+      self.assertRaises(routing.TransactionError, connection.__enter__)
+      self.assertRaises(routing.TransactionError, connection.Release)
+
+  def testRelease(self):
+    """Release() returns the connections to their pools"""
+    connection = routing.RoutingConnection(self.router)
+    with connection as cursor:
+      self.Server(cursor)
+      cursor.Insert('server', {'name': 'written'})
+    connection.Release()
+    self.assertEqual(len(self.pools[0].released), 1)
+    self.assertEqual(len(self.pools[1].released), 1)
+    self.assertEqual(self.router.Statistics()['primary']['load'], 0)
+
+
+if __name__ == '__main__':
+  unittest.main(testRunner=unittest.TextTestRunner(verbosity=2))
@@ -6,20 +6,40 @@ import _sqlite3
 
 # Application specific modules
 import connection
+import manager
+import snapshot
 
 VERSION_INFO = tuple(map(int, _sqlite3.version.split('.')))
 SQLITE_VERSION_INFO = tuple(map(int, _sqlite3.sqlite_version.split('.')))
+# Number of compiled statements that each connection keeps for reuse.
+CACHED_STATEMENTS = 256
 
 
 def Connect(*args, **kwds):
   """Factory function for connection.Connection."""
   kwds['detect_types'] = _sqlite3.PARSE_DECLTYPES
+  kwds.setdefault('cached_statements', CACHED_STATEMENTS)
   return connection.Connection(*args, **kwds)
 
 
+def ConnectManager(*args, **kwds):
+  """Factory function for manager.ConnectionManager."""
+  kwds['detect_types'] = _sqlite3.PARSE_DECLTYPES
+  kwds.setdefault('cached_statements', CACHED_STATEMENTS)
+  return manager.ConnectionManager(*args, **kwds)
+
+
+def ConnectSnapshot(*args, **kwds):
+  """Factory function for snapshot.SnapshotManager."""
+  kwds['detect_types'] = _sqlite3.PARSE_DECLTYPES
+  kwds.setdefault('cached_statements', CACHED_STATEMENTS)
+  return snapshot.SnapshotManager(*args, **kwds)
+
+
 def ThreadConnect(*args, **kwds):
   """Factory function for connection.ThreadedConnection."""
   kwds['detect_types'] = _sqlite3.PARSE_DECLTYPES
+  kwds.setdefault('cached_statements', CACHED_STATEMENTS)
   return connection.ThreadedConnection(*args, **kwds)
 
 
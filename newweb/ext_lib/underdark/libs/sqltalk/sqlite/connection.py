@@ -6,13 +6,14 @@ use the escaping and character encoding facilities offered by the connection.
 from __future__ import with_statement
 
 __author__ = 'Elmer de Looff <elmer@underdark.nl>'
-__version__ = '0.3'
+__version__ = '0.4'
 
 # Standard modules
 import _sqlite3
 import logging
 import os
 import Queue
+import re
 import threading
 
 # Application specific modules
@@ -22,6 +23,7 @@ import cursor
 COMMIT = '----COMMIT'
 ROLLBACK = '----ROLLBACK'
 NAMED_TYPE_SELECT = 'SELECT `name` FROM `sqlite_master` where `type`=?'
+PRAGMA_VALUE = re.compile(r'-?\w+$')
 
 class Connection(_sqlite3.Connection):
   def __init__(self, *args, **kwds):
@@ -49,6 +51,13 @@ class Connection(_sqlite3.Connection):
       self.commit()
       self.logger.debug('Transaction committed.')
 
+  def BulkImport(self, **pragmas):
+    """Returns a transaction context tuned for loading many rows.
+
+    Refer to BulkImport for the pragmas and their defaults.
+    """
+    return BulkImport(self, **pragmas)
+
   def commit(self):
     _sqlite3.Connection.commit(self)
 
@@ -66,6 +75,11 @@ class Connection(_sqlite3.Connection):
     """Returns a SQL escaped field or table name."""
     return '.'.join('`%s`' % f.replace('`', '``') for f in field.split('.'))
 
+  @staticmethod
+  def EscapeValues(obj):
+    """Returns the object as SQL literal, or its contents for containers."""
+    return converters.EscapeValues(obj)
+
   def ShowTables(self):
     result = self.execute(NAMED_TYPE_SELECT, ('table',)).fetchall()
     return [row[0] for row in result]
@@ -87,6 +101,7 @@ class ThreadedConnection(threading.Thread):
     self.sqlite_args = args
     self.sqlite_kwds = kwds
     self.queries = Queue.Queue(1)
+    self.responses = threading.local()
     self.transaction_lock = threading.RLock()
     self.daemon = True
     self.start()
@@ -106,18 +121,25 @@ class ThreadedConnection(threading.Thread):
       self.logger.debug('Transaction committed.')
     self.transaction_lock.release()
 
+  def BulkImport(self, **pragmas):
+    """Returns a transaction context tuned for loading many rows.
+
+    Refer to BulkImport for the pragmas and their defaults.
+    """
+    return BulkImport(self, **pragmas)
+
   def commit(self):
     self.execute(COMMIT)
 
   def execute(self, query, args=()):
     with self.transaction_lock:
-      response = Queue.Queue()
+      response = self._ResponseQueue()
       self.queries.put((query, args, response, False))
       return self._ProcessResponse(response)
 
   def executemany(self, query, args=()):
     with self.transaction_lock:
-      response = Queue.Queue()
+      response = self._ResponseQueue()
       self.queries.put((query, args, response, True))
       return self._ProcessResponse(response)
 
@@ -143,6 +165,18 @@ class ThreadedConnection(threading.Thread):
         response.put(error)
         del error
 
+  def _ResponseQueue(self):
+    """Returns the queue on which the current thread receives responses.
+
+    A thread waits for each response before sending its next query, so its
+    queue is always empty and can be reused.
+    """
+    try:
+      return self.responses.queue
+    except AttributeError:
+      self.responses.queue = response = Queue.Queue()
+      return response
+
   @staticmethod
   def _ProcessResponse(response):
     """Processes the response given by the SQLite connection thread.
@@ -161,21 +195,99 @@ class ThreadedConnection(threading.Thread):
     """Returns a SQL escaped field or table name."""
     return '.'.join('`%s`' % f.replace('`', '``') for f in field.split('.'))
 
+  @staticmethod
+  def EscapeValues(obj):
+    """Returns the object as SQL literal, or its contents for containers."""
+    return converters.EscapeValues(obj)
+
   def ShowTables(self):
     result = self.execute(NAMED_TYPE_SELECT, ('table',)).fetchall()
     return [row[0] for row in result]
 
 
+class BulkImport(object):
+  """Transaction context that trades durability for speed while loading data.
+
+  The given pragmas are set when the transaction starts, and their previous
+  values restored after it has been committed (or rolled back). Use it with
+  the cursor's Import() to load large numbers of rows:
+
+    with connection.BulkImport(cache_size=-500000) as cursor:
+      cursor.Import('measurement', ('sensor', 'value'), rows)
+
+  With `synchronous` OFF, a crash of the OS during the import may corrupt the
+  database; the default `journal_mode` is left as it is.
+  """
+  PRAGMAS = 'synchronous', 'journal_mode', 'cache_size', 'mmap_size'
+
+  def __init__(self, connection, synchronous='OFF', journal_mode=None,
+               cache_size=-200000, mmap_size=None):
+    """Initializes a BulkImport context.
+
+    Arguments:
+      @ connection: Connection / ThreadedConnection
+        The connection to import through.
+      % synchronous: str ~~ 'OFF'
+        Whether SQLite waits for data to reach the disk.
+      % journal_mode: str ~~ None
+        Journal mode during the import, e.g. 'MEMORY' or 'OFF'. This cannot be
+        changed while other connections use a WAL database.
+      % cache_size: int ~~ -200000
+        Page cache size, in pages, or in KiB if negative.
+      % mmap_size: int ~~ None
+        Maximum number of bytes of the database to memory-map.
+
+    Pragmas given as None are left unchanged.
+    """
+    self.connection = connection
+    self.pragmas = [(name, value) for name, value in zip(self.PRAGMAS, (
+        synchronous, journal_mode, cache_size, mmap_size)) if value is not None]
+    for name, value in self.pragmas:
+      if not PRAGMA_VALUE.match(str(value)):
+        raise ValueError('Bad value %r for pragma %s.' % (value, name))
+    self.previous = []
+
+  def __enter__(self):
+    """Sets the pragmas and starts the transaction."""
+    self.connection.commit()  # Some pragmas can't be changed in a transaction.
+    self.previous = [(name, self._Pragma(name))
+                     for name, _value in self.pragmas]
+    for name, value in self.pragmas:
+      self._Pragma(name, value)
+    return self.connection.__enter__()
+
+  def __exit__(self, exc_type, exc_value, exc_traceback):
+    """Ends the transaction and restores the pragmas."""
+    try:
+      self.connection.__exit__(exc_type, exc_value, exc_traceback)
+    finally:
+      for name, value in reversed(self.previous):
+        self._Pragma(name, value)
+
+  def _Pragma(self, name, value=None):
+    """Returns the value of the pragma, setting it first if a value is given."""
+    if value is None:
+      return self.connection.execute('PRAGMA %s' % name).fetchall()[0][0]
+    self.connection.execute('PRAGMA %s=%s' % (name, value))
+
+
 class SqliteResult(object):
   def __init__(self, result, description, rowcount, lastrowid):
     self.result = result
     self.description = description
     self.rowcount = rowcount
     self.lastrowid = lastrowid
+    self._position = 0
 
   def fetchall(self):
     return self.result
 
+  def fetchmany(self, size=1):
+    """Returns the next `size` rows of the result, like sqlite3's cursor."""
+    rows = self.result[self._position:self._position + size]
+    self._position += len(rows)
+    return rows
+
 
 #FIXME(Elmer): This needs defining in one place, not in each and every file.
 DataError = _sqlite3.DataError
@@ -1,10 +1,18 @@
 import _sqlite3
 import datetime
+import decimal
 import pytz
 import time
 
 
 INTERPRET_AS_UTC = pytz.utc.localize
+UTC = pytz.utc
+# First day of the Common Era, at midnight UTC.
+EPOCH = datetime.datetime(1, 1, 1, tzinfo=UTC)
+# Number of distinct stored values whose converted result is remembered.
+CONVERSION_CACHE_SIZE = 10000
+_date_cache = {}
+_timestamp_cache = {}
 
 def DateFromTicks(ticks):
   return datetime.date(*time.gmtime(ticks)[:3])
@@ -30,14 +38,11 @@ def AdaptDatetime(date_obj):
   The time portion is converted to milliseconds past midnight.
   These two are joined by a 'T'.
   """
-  try:
-    date_obj = date_obj.astimezone(pytz.utc)
-  except ValueError:
-    pass  # naive datetime object
-  timepart = date_obj.time()
-  seconds = (timepart.hour * 3600000 + timepart.minute * 60000 +
-             timepart.second * 1000 + timepart.microsecond // 1000)
-  return '%dT%d' % (date_obj.toordinal(), seconds)
+  if date_obj.tzinfo is not None and date_obj.tzinfo is not UTC:
+    date_obj = date_obj.astimezone(UTC)
+  return '%dT%d' % (date_obj.toordinal(), (
+      date_obj.hour * 3600000 + date_obj.minute * 60000 +
+      date_obj.second * 1000 + date_obj.microsecond // 1000))
 
 
 def AdaptReadableDate(date_obj):
@@ -47,10 +52,8 @@ def AdaptReadableDate(date_obj):
 
 def AdaptReadableDatetime(date_obj):
   """Adapts a datetime.datetime object to its ISO-8601 date/time notation."""
-  try:
-    date_obj = date_obj.astimezone(pytz.utc)
-  except ValueError:
-    pass  # naive datetime object
+  if date_obj.tzinfo is not None and date_obj.tzinfo is not UTC:
+    date_obj = date_obj.astimezone(UTC)
   return date_obj.isoformat()
 
 
@@ -67,37 +70,123 @@ def ConvertDate(date_obj):
   """Converts an SQLite DATE field to a datetime.date object.
 
   Two stored formats are supported: The format as defined in SQLTalk, which is
-  the number of days since Common Era, and the ISO-8601 date format."""
-  try:
-    # Assume date is the number of days since Common Era as a string.
-    return datetime.date.fromordinal(int(date_obj))
-  except ValueError:
-    # Date was not a number, assume ISO-8601
-    return datetime.date(*map(int, date_obj.split("-")))
+  the number of days since Common Era, and the ISO-8601 date format. Results
+  are cached, as dates tend to repeat within a column.
+  """
+  result = _date_cache.get(date_obj)
+  if result is None:
+    if len(date_obj) == 10 and date_obj[4:5] == '-':
+      result = datetime.date(
+          int(date_obj[:4]), int(date_obj[5:7]), int(date_obj[8:10]))
+    elif '-' in date_obj:
+      result = datetime.date(*map(int, date_obj.split('-')))
+    else:
+      result = datetime.date.fromordinal(int(date_obj))
+    if len(_date_cache) >= CONVERSION_CACHE_SIZE:
+      _date_cache.clear()
+    _date_cache[date_obj] = result
+  return result
 
 
 def ConvertTimestamp(date_obj):
-  """Converts an encoded timestamp to a datetime.datetime object.
+  """Converts an encoded timestamp to a datetime.datetime object in UTC.
 
   This reads both a ISO-8601 formatted string, as well as the Underdark custom
-  compressed datetime format as defined in AdaptDatetime above.
+  compressed datetime format as defined in AdaptDatetime above. The format is
+  told apart by the dash that follows the year in ISO-8601, and the fields are
+  sliced out rather than parsed. Results are cached, so repeated timestamps
+  are converted only once.
+  """
+  result = _timestamp_cache.get(date_obj)
+  if result is None:
+    if date_obj[4:5] == '-':
+      result = _ConvertIsoTimestamp(date_obj)
+    else:
+      # Days since Common Era, and milliseconds past midnight.
+      datepart, sep, timepart = date_obj.partition('T')
+      if not sep:
+        datepart, sep, timepart = date_obj.partition(' ')
+      result = EPOCH + datetime.timedelta(
+          int(datepart) - 1, 0, 0, int(timepart))
+    if len(_timestamp_cache) >= CONVERSION_CACHE_SIZE:
+      _timestamp_cache.clear()
+    _timestamp_cache[date_obj] = result
+  return result
+
+
+def _ConvertIsoTimestamp(date_obj):
+  """Converts an ISO-8601 timestamp, with optional fraction and UTC offset.
+
+  Timestamps with an offset are converted to UTC. Those that are not
+  zero-padded are parsed the slow way, which allows no offset.
   """
-  sep = 'T' if 'T' in date_obj else ' '
+  end = 19
+  microseconds = 0
+  if date_obj[19:20] == '.':
+    end = 20
+    while date_obj[end:end + 1].isdigit():
+      end += 1
+    microseconds = int(date_obj[20:min(end, 26)].ljust(6, '0'))
   try:
-    # Assume that the datepart is days since Common Era,
-    # and the timepart is seconds past midnight.
-    datepart, timepart = date_obj.split(sep)
-    return INTERPRET_AS_UTC(
-        datetime.datetime.fromordinal(int(datepart)) +
-        datetime.timedelta(microseconds=int(timepart) * 1000))
+    result = datetime.datetime(
+        int(date_obj[:4]), int(date_obj[5:7]), int(date_obj[8:10]),
+        int(date_obj[11:13]), int(date_obj[14:16]), int(date_obj[17:19]),
+        microseconds, tzinfo=UTC)
   except ValueError:
-    # Either part couldn't be interpreter as integer, meaning they are ISO-8601.
-    date_obj, _sep, microseconds = date_obj.partition('.')
+    # Not zero-padded, parse the slow way.
+    sep = 'T' if 'T' in date_obj else ' '
+    date_obj, _sep, fraction = date_obj.partition('.')
     time_tuple = time.strptime(date_obj, '%Y-%m-%d' + sep + '%H:%M:%S')[:6]
-    if microseconds:
-      microseconds = int((microseconds + '00000')[:6])
-      time_tuple += microseconds,
-    return INTERPRET_AS_UTC(datetime.datetime(*time_tuple))
+    if fraction:
+      time_tuple += int(fraction[:6].ljust(6, '0')),
+    return datetime.datetime(*time_tuple, tzinfo=UTC)
+  offset = date_obj[end:]
+  if offset and offset != 'Z':
+    result -= _UtcOffset(offset)
+  return result
+
+
+def _UtcOffset(offset):
+  """Returns the timedelta for a UTC offset of the form +HH, +HHMM or +HH:MM.
+  """
+  sign = {'+': 1, '-': -1}.get(offset[:1])
+  digits = offset[1:]
+  if len(digits) == 5 and digits[2] == ':':
+    digits = digits[:2] + digits[3:]
+  if sign is None or len(digits) not in (2, 4) or not digits.isdigit():
+    raise ValueError('Invalid UTC offset %r.' % offset)
+  return sign * datetime.timedelta(
+      hours=int(digits[:2]), minutes=int(digits[2:] or 0))
+
+
+def EscapeValues(obj):
+  """Returns the object as an SQL literal, for inclusion in a statement.
+
+  Sequences and mappings have their contents escaped. Dates and times are
+  written the way the adapters store them when they are bound. Records (from
+  newweb's model) are escaped as their primary key.
+  """
+  if isinstance(obj, dict):
+    return dict((key, EscapeValues(value)) for key, value in obj.iteritems())
+  elif isinstance(obj, (list, tuple, set, frozenset)):
+    return type(obj)(map(EscapeValues, obj))
+  elif obj is None:
+    return 'NULL'
+  elif isinstance(obj, bool):
+    return str(int(obj))
+  elif isinstance(obj, (int, long, float, decimal.Decimal)):
+    return str(obj)
+  elif isinstance(obj, basestring):
+    return "'%s'" % obj.replace("'", "''")
+  elif isinstance(obj, datetime.datetime):
+    return "'%s'" % AdaptDatetime(obj)
+  elif isinstance(obj, datetime.date):
+    return str(AdaptDate(obj))
+  elif isinstance(obj, time.struct_time):
+    return "'%s'" % AdaptTimeStruct(obj)
+  elif hasattr(obj, '_PRIMARY_KEY') and hasattr(type(obj), 'key'):
+    return EscapeValues(obj.key)
+  return EscapeValues(str(obj))
 
 
 _sqlite3.register_adapter(datetime.date, AdaptDate)
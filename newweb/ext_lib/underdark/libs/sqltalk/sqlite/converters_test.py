@@ -0,0 +1,94 @@
+#!/usr/bin/python2.5
+"""Testsuite for the SQLite date and time adapters and converters."""
+__author__ = 'Elmer de Looff <elmer@underdark.nl>'
+__version__ = '0.1'
+
+# Standard modules
+import datetime
+import unittest
+
+# Third-party modules
+import pytz
+
+# Unittest target
+from underdark.libs.sqltalk.sqlite import converters
+
+
+class TimestampTest(unittest.TestCase):
+  """Timestamps are read in both stored formats, and always in UTC."""
+  def setUp(self):
+    self.stamp = datetime.datetime(2012, 3, 1, 13, 4, 5, 123000,
+                                   tzinfo=pytz.utc)
+
+  def testCompactRoundTrip(self):
+    """Timestamps stored in the compact format convert back unchanged"""
+    self.assertEqual(converters.ConvertTimestamp(
+        converters.AdaptDatetime(self.stamp)), self.stamp)
+
+  def testReadableRoundTrip(self):
+    """Timestamps stored in ISO-8601 notation convert back unchanged"""
+    self.assertEqual(converters.ConvertTimestamp(
+        converters.AdaptReadableDatetime(self.stamp)), self.stamp)
+
+  def testIsoVariants(self):
+    """ISO-8601 with a space separator, no fraction or no padding is read"""
+    convert = converters.ConvertTimestamp
+    self.assertEqual(convert('2012-03-01 13:04:05'),
+                     self.stamp.replace(microsecond=0))
+    self.assertEqual(convert('2012-3-1T13:4:5.123'), self.stamp)
+
+  def testCompactSpaceSeparator(self):
+    """Compact timestamps with a space separator are read"""
+    self.assertEqual(converters.ConvertTimestamp('734563 47045123'),
+                     self.stamp)
+
+  def testUtcOffsets(self):
+    """ISO-8601 timestamps with a UTC offset are converted to UTC"""
+    convert = converters.ConvertTimestamp
+    self.assertEqual(convert('2012-03-01T15:04:05.123+02:00'), self.stamp)
+    self.assertEqual(convert('2012-03-01T12:34:05.123-0030'), self.stamp)
+    self.assertEqual(convert('2012-03-01 14:04:05.123+01'), self.stamp)
+    self.assertEqual(convert('2012-03-01T13:04:05.123Z'), self.stamp)
+    self.assertEqual(convert('2012-03-01T15:04:05+02:00'),
+                     self.stamp.replace(microsecond=0))
+
+  def testBadUtcOffsets(self):
+    """ISO-8601 timestamps with anything else after the time are refused"""
+    for value in ('2012-03-01T13:04:05 CET', '2012-03-01T13:04:05+2',
+                  '2012-03-01T13:04:05+02:', '2012-03-01T13:04:05.123x'):
+      self.assertRaises(ValueError, converters.ConvertTimestamp, value)
+
+  def testTimezones(self):
+    """Aware timestamps are stored as UTC, naive ones as they are"""
+    amsterdam = pytz.timezone('Europe/Amsterdam')
+    local = amsterdam.localize(datetime.datetime(2012, 3, 1, 14, 4, 5, 123000))
+    self.assertEqual(converters.AdaptDatetime(local),
+                     converters.AdaptDatetime(self.stamp))
+    self.assertEqual(converters.AdaptDatetime(self.stamp.replace(tzinfo=None)),
+                     converters.AdaptDatetime(self.stamp))
+    self.assertEqual(converters.ConvertTimestamp('734563T0').tzinfo, pytz.utc)
+
+  def testCached(self):
+    """Repeated values give the same, cached, object"""
+    value = converters.AdaptDatetime(self.stamp)
+    self.assertTrue(converters.ConvertTimestamp(value) is
+                    converters.ConvertTimestamp(value))
+
+
+class DateTest(unittest.TestCase):
+  """Dates are read in both stored formats."""
+  def testFormats(self):
+    date = datetime.date(2012, 3, 1)
+    self.assertEqual(converters.ConvertDate(str(converters.AdaptDate(date))),
+                     date)
+    self.assertEqual(converters.ConvertDate(
+        converters.AdaptReadableDate(date)), date)
+
+  def testUnpadded(self):
+    """ISO-8601 dates that are not zero-padded are read"""
+    self.assertEqual(converters.ConvertDate('2012-3-1'),
+                     datetime.date(2012, 3, 1))
+
+
+if __name__ == '__main__':
+  unittest.main(testRunner=unittest.TextTestRunner(verbosity=2))
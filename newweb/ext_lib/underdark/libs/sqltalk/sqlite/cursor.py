@@ -1,18 +1,178 @@
 #!/usr/bin/python2.5
 """SQLTalk SQLite Cursor class."""
 __author__ = 'Elmer de Looff <elmer@underdark.nl>'
-__version__ = '0.4'
+__version__ = '0.5'
 
+# Standard modules
+import _sqlite3
 
 # Custom modules
 from underdark.libs.sqltalk import sqlresult
 
 
 class Cursor(object):
+  """Cursor to execute database interaction with, within a transaction.
+
+  All values are bound to `?` placeholders rather than formatted into the
+  statement, so that the statement text only depends on the shape of the
+  query, and sqlite3's statement cache can reuse the compiled statement.
+  """
+  # Placeholder for a bound value in parameterized statements.
+  PLACEHOLDER = '?'
+
   def __init__(self, connection):
     self.connection = connection
 
+  @staticmethod
+  def _StringConditions(conditions):
+    if not conditions:
+      return '1'
+    elif not isinstance(conditions, basestring):
+      return ' AND '.join(conditions)
+    return conditions
+
+  def _SelectQuery(self, table, fields, conditions, order, group, limit,
+                   offset, escape, args):
+    """Returns the parameterized SELECT statement and its arguments."""
+    field_escape = self.connection.EscapeField if escape else lambda x: x
+    limit_sql, limit_args = self._StringLimit(limit, offset)
+    return 'SELECT %s FROM %s WHERE %s %s %s %s' % (
+        self._StringFields(fields, field_escape),
+        self._StringTable(table, field_escape),
+        self._StringConditions(conditions),
+        self._StringGroup(group, field_escape),
+        self._StringOrder(order, field_escape),
+        limit_sql), list(args) + list(limit_args)
+
+  def _RowSelection(self, table, conditions, order, limit, offset,
+                    field_escape):
+    """Returns the WHERE condition for a limited and/or ordered modification.
+
+    SQLite (as commonly compiled) has no ORDER BY or LIMIT for UPDATE and
+    DELETE, so the rows are selected by their rowid in a subquery instead.
+    This requires the table to have a rowid, which is the default.
+    """
+    conditions = self._StringConditions(conditions)
+    if order is None and limit is None:
+      return conditions, ()
+    limit_sql, limit_args = self._StringLimit(limit, offset)
+    return 'rowid IN (SELECT rowid FROM %s WHERE %s %s %s)' % (
+        table, conditions, self._StringOrder(order, field_escape),
+        limit_sql), limit_args
+
+  @staticmethod
+  def _StringFields(fields, field_escape):
+    if not fields:
+      return '*'
+    elif isinstance(fields, basestring):
+      return field_escape(fields)
+    return ', '.join(map(field_escape, fields))
+
+  @staticmethod
+  def _StringGroup(group, field_escape):
+    if group is None:
+      return ''
+    elif isinstance(group, basestring):
+      return 'GROUP BY ' + field_escape(group)
+    return 'GROUP BY ' + ', '.join(map(field_escape, group))
+
+  @staticmethod
+  def _StringLimit(limit, offset):
+    """Returns the LIMIT clause with placeholders, and the values for them."""
+    if limit is None:
+      return '', ()
+    elif offset:
+      return 'LIMIT ? OFFSET ?', (int(limit), int(offset))
+    return 'LIMIT ?', (int(limit),)
+
+  @staticmethod
+  def _StringOrder(order, field_escape):
+    if order is None:
+      return ''
+    orders = []
+    for rule in order:
+      if isinstance(rule, basestring):
+        orders.append(field_escape(rule))
+      else:
+        orders.append('%s %s' % (
+            field_escape(rule[0]), ('ASC', 'DESC')[rule[1]]))
+    return 'ORDER BY ' + ', '.join(orders)
+
+  @staticmethod
+  def _StringTable(table, field_escape):
+    if isinstance(table, basestring):
+      return field_escape(table)
+    return ', '.join(map(field_escape, table))
+
+  def Delete(self, table, conditions, order=None, limit=None, offset=0,
+             escape=True, args=()):
+    """Remove row(s) from table that match conditions, up to limit.
+
+    Arguments:
+      table:      string. Name of the table to delete.
+      conditions: string/list/tuple (optional).
+                  Where statements. Literal as string. AND'd if list/tuple.
+                  THESE WILL NOT BE ESCAPED FOR YOU, EVER.
+      order:      (nested) list/tuple (optional).
+                  Defines sorting of table before deleting, elements can be:
+                    string: a field to order by (in default database order).
+                    list/tuple of two elements:
+                      1) string, field name to order by
+                      2) bool, revserse; set this to True to reverse the order
+      limit:      integer. Defines max number of rows to delete. Default: None.
+      offset:     integer (optional). Number of rows to skip, requires limit.
+      escape:     boolean. Defines whether table and field names should be
+                  escaped. Default True.
+      args:       list/tuple (optional). Values for ? placeholders in the
+                  conditions.
+
+    Returns:
+      sqlresult.ResultSet object.
+    """
+    field_escape = self.connection.EscapeField if escape else lambda x: x
+    table = self._StringTable(table, field_escape)
+    conditions, limit_args = self._RowSelection(
+        table, conditions, order, limit, offset, field_escape)
+    return self.Execute('DELETE FROM %s WHERE %s' % (table, conditions),
+                        list(args) + list(limit_args))
+
+  def Describe(self, table, field=''):
+    """Describe table in database or field in table.
+
+    The description is the result of SQLite's table_info pragma, which has
+    the fields `cid`, `name`, `type`, `notnull`, `dflt_value` and `pk`.
+
+    Takes
+      table: string. Name of the table to describe.
+      field: string (optional). Field name to describe.
+
+    Returns:
+      sqlresult.ResultSet object.
+    """
+    result = self.Execute('PRAGMA table_info(%s)' % (
+        self.connection.EscapeField(table)))
+    if field:
+      result = sqlresult.ResultSet(
+          affected=result.affected, charset=result.charset,
+          fields=result.fields, query=result.query,
+          result=[row.values() for row in result if row['name'] == field])
+    return result
+
   def Execute(self, query, args=(), many=False):
+    """Executes a raw query, or a parameterized one if `args` are given.
+
+    Arguments:
+      @ query: basestring
+        The SQL statement, with ? or :name placeholders for the arguments.
+      % args: sequence / mapping ~~ ()
+        Values for the placeholders. These are bound by SQLite.
+      % many: bool ~~ False
+        Whether `args` is an iterable of argument sequences, for which the
+        statement is executed in turn.
+
+    Returns:
+      sqlresult.ResultSet object.
+    """
     try:
       if many:
         result = self.connection.executemany(query, args)
@@ -26,27 +186,71 @@ class Cursor(object):
         charset='utf-8',
         fields=result.description,
         insertid=result.lastrowid,
-        query=(query, tuple(args)),
+        query=query if many else (query, tuple(args)),
         result=result.fetchall())
 
-  def Insert(self, table, values):
+  def Import(self, table, fields, rows):
+    """Inserts many rows, given as sequences of values for the fields.
+
+    The rows are passed to a single executemany() call without being copied
+    or converted, so this is the fastest way of inserting a large number of
+    rows. Combine it with the connection's BulkImport() for more speed.
+
+    Arguments:
+      @ table: str
+        Name of the table to insert into.
+      @ fields: list of str
+        The names of the fields to insert values for.
+      @ rows: iterable of sequences
+        The rows to insert, with one value for each of the fields.
+
+    Returns:
+      sqlresult.ResultSet object, the number of rows inserted as `affected`.
+    """
+    return self.Execute('INSERT INTO %s (%s) VALUES (%s)' % (
+        self.connection.EscapeField(table),
+        ', '.join(map(self.connection.EscapeField, fields)),
+        ', '.join([self.PLACEHOLDER] * len(fields))), rows, many=True)
+
+  def Insert(self, table, values, escape=True):
+    """Insert new row into table.
+
+    Arguments:
+      table:   string. Name of the table to insert into.
+      values:  dictionary or list/tuple.
+               Dictionary for single inserts:
+               * keys:   field names
+               * values: field values
+               List of dictionaries for a multi-row insert:
+               * Each record as a single dictionary.
+               * Each dictionary should have the same keys (fields).
+      escape:  boolean. Defines whether the table name should be escaped.
+               Default True.
+
+    Returns:
+      sqlresult.ResultSet object.
+    """
     if not values:
       raise ValueError('Must insert 1 or more value')
-    elif isinstance(values, dict):
+    if escape:
+      table = self.connection.EscapeField(table)
+    if isinstance(values, dict):
       query = ('INSERT INTO %s (%s) VALUES (%s)' %
                (table,
                 ', '.join(map(self.connection.EscapeField, values)),
-                ', '.join('?' * len(values))))
+                ', '.join([self.PLACEHOLDER] * len(values))))
       return self.Execute(query, args=values.values(), many=False)
+    fields = values[0].keys()
     query = ('INSERT INTO %s (%s) VALUES (%s)' %
              (table,
-              ', '.join(map(self.connection.EscapeField, values[0])),
-              ', '.join('?' * len(values[0]))))
+              ', '.join(map(self.connection.EscapeField, fields)),
+              ', '.join([self.PLACEHOLDER] * len(fields))))
     return self.Execute(
-        query, args=(row.values() for row in values), many=True)
+        query, args=([row[field] for field in fields] for row in values),
+        many=True)
 
   def Select(self, table, fields=None, conditions=None, order=None, group=None,
-             limit=None, offset=0):
+             limit=None, offset=0, escape=True, totalcount=False, args=()):
     """Select fields from table that match the conditions, ordered and limited.
 
     Arguments:
@@ -66,54 +270,156 @@ class Cursor(object):
       group:      str (optional). Field name or function to group result by.
       limit:      integer (optional). Defines output size in rows.
       offset:     integer (optional). Number of rows to skip, requires limit.
+      escape:     boolean. Defines whether table and field names should be
+                  escaped. Set this to False if you want to make use of SQLite
+                  functions on this query. Default True.
+      totalcount: boolean. If this is set to True, queries with a LIMIT applied
+                  will have the full number of matching rows on
+                  the affected attribute of the resultset.
+      args:       list/tuple (optional). Values for ? placeholders in the
+                  conditions.
 
     Returns:
       sqlresult.ResultSet object.
     """
-    if isinstance(table, basestring):
-      table = self.connection.EscapeField(table)
-    else:
-      table = ', '.join(map(self.connection.EscapeField, table))
+    result = self.Execute(*self._SelectQuery(
+        table, fields, conditions, order, group, limit, offset, escape, args))
+    if totalcount and limit is not None and limit == len(result):
+      query, args = self._SelectQuery(table, fields, conditions, None, group,
+                                      None, 0, escape, args)
+      result.affected = self.Execute(
+          'SELECT COUNT(*) FROM (%s)' % query, args)[0][0]
+    return result
 
-    if fields is None:
-      fields = '*'
-    elif isinstance(fields, basestring):
-      fields = self.connection.EscapeField(fields)
-    else:
-      fields = ', '.join(map(self.connection.EscapeField, fields))
-
-    #FIXME(Elmer): Add consistent programmatic condition support for SQLTalk.
-    if isinstance(conditions, (list, tuple)):
-      conditions = ' AND '.join(conditions)
-    elif not conditions:
-      conditions = 1
-
-    if order is not None:
-      orders = []
-      for rule in order:
-        if isinstance(rule, basestring):
-          orders.append(self.connection.EscapeField(rule))
-        else:
-          orders.append('%s %s' %
-                        (self.connection.EscapeField(rule[0]),
-                        ('ASC', 'DESC')[rule[1]]))
-      order = 'ORDER BY ' + ', '.join(orders)
-    else:
-      order = ''
+  def SelectIter(self, table, fields=None, conditions=None, order=None,
+                 group=None, limit=None, offset=0, escape=True, args=(),
+                 batch=1000):
+    """Yields the selected rows, fetching them in batches.
 
-    if group is not None:
-      group = 'GROUP BY ' + self.connection.EscapeField(group)
-    else:
-      group = ''
+    This takes the same arguments as Select(), except `totalcount`, and uses
+    Stream() to execute the query. Refer to both for details.
+    """
+    query, args = self._SelectQuery(table, fields, conditions, order, group,
+                                    limit, offset, escape, args)
+    return self.Stream(query, args, batch=batch)
 
-    if limit is not None:
-      if offset:
-        limit = 'LIMIT %d OFFSET %d' % (limit, offset)
-      else:
-        limit = 'LIMIT %d' % limit
+  def SelectTables(self, contains=None, exact=False):
+    """Returns table names from the current database.
+
+    Arguments
+      % contains: str ~~ ''
+        A substring required to be present in all returned table names.
+      % exact: bool ~~ False
+        Flags whether the string given in contains should be the exact name.
+
+    Returns:
+      set: tables names that match the filter.
+    """
+    query = "SELECT `name` FROM `sqlite_master` WHERE `type`='table'"
+    if not contains:
+      return set(row[0] for row in self.Execute(query))
+    elif exact:
+      return set(row[0] for row in self.Execute(
+          query + ' AND `name`=?', (contains,)))
+    return set(row[0] for row in self.Execute(
+        query + " AND `name` LIKE ? ESCAPE '\\'", ('%%%s%%' % (
+            contains.replace('\\', '\\\\').replace('%', '\\%')
+            .replace('_', '\\_')),)))
+
+  def Stream(self, query, args=(), batch=1000):
+    """Executes a query and yields its result rows, fetched in batches.
+
+    The rows are fetched using the cursor's fetchmany(), so only `batch` rows
+    are held in memory at a time. N.B. for a ThreadedConnection the full result
+    is fetched by the connection thread; only the row objects are created on
+    demand.
+
+    Yields:
+      sqlresult.ResultRow: one for each row in the result.
+    """
+    try:
+      result = self.connection.execute(query, args)
+    except Exception:
+      self.connection.logger.exception('Exception during query execution')
+      raise
+    return self._StreamRows(result, batch)
+
+  @staticmethod
+  def _StreamRows(result, batch):
+    """Yields ResultRows for the result, fetching `batch` rows at a time."""
+    index = sqlresult.FieldIndex(
+        field[0] for field in result.description or ())
+    while True:
+      rows = result.fetchmany(batch)
+      if not rows:
+        break
+      for row in rows:
+        yield sqlresult.ResultRow(index, row)
+
+  def Truncate(self, table):
+    """Truncate table in database, reducing it to 0 rows.
+
+    SQLite has no TRUNCATE, but optimizes an unconditional DELETE to the same.
+
+    Arguments:
+      table: string, name of the table to truncate.
+
+    Returns:
+      sqlresult.ResultSet object.
+    """
+    return self.Execute('DELETE FROM %s' % self.connection.EscapeField(table))
+
+  def Update(self, table, values, conditions, order=None, limit=None,
+             offset=None, escape=True, args=()):
+    """Updates table records to the new values where conditions are met.
+
+    Arguments:
+      table:      string. Name of table to update values in.
+      values:     dictionary. Key for fieldname, value for content (bound).
+      conditions: string/list/tuple.
+                  Where statements. Literal as string. AND'd if list/tuple.
+                  THESE WILL NOT BE ESCAPED FOR YOU, EVER.
+      order:      (nested) list/tuple (optional).
+                  Defines sorting of table before updating, elements can be:
+                    string: a field to order by (in default database order).
+                    list/tuple of two elements:
+                      1) string, field name to order by
+                      2) bool, revserse; set this to True to reverse the order
+      limit:      integer (optional). Defines max rows to update.
+                  Default value for this is None, meaning no limit.
+      offset:     integer (optional). Number of rows to skip, requires limit.
+      escape:     boolean. Defines whether table names, fields and values should
+                  be escaped. Set this to False if you want to make use of
+                  SQLite functions on this query; the values are then taken to
+                  be literal SQL. Default True.
+      args:       list/tuple (optional). Values for ? placeholders in the
+                  conditions.
+
+    Returns:
+      sqlresult.ResultSet object.
+    """
+    field_escape = self.connection.EscapeField if escape else lambda x: x
+    table = self._StringTable(table, field_escape)
+    fields = values.keys()
+    field_values = values.values()
+    if escape:
+      assignments = ', '.join('%s=%s' % (field_escape(field), self.PLACEHOLDER)
+                              for field in fields)
     else:
-      limit = ''
+      assignments = ', '.join('%s=%s' % pair for pair in values.iteritems())
+    conditions, limit_args = self._RowSelection(
+        table, conditions, order, limit, offset, field_escape)
+    return self.Execute('UPDATE %s SET %s WHERE %s' % (
+        table, assignments, conditions),
+        (field_values if escape else []) + list(args) + list(limit_args))
 
-    query = ('SELECT %s FROM %s WHERE %s %s %s %s' %
-             (fields, table, conditions, group, order, limit))
-    return self.Execute(query)
+  DatabaseError = _sqlite3.DatabaseError
+  DataError = _sqlite3.DataError
+  Error = _sqlite3.Error
+  IntegrityError = _sqlite3.IntegrityError
+  InterfaceError = _sqlite3.InterfaceError
+  InternalError = _sqlite3.InternalError
+  NotSupportedError = _sqlite3.NotSupportedError
+  OperationalError = _sqlite3.OperationalError
+  ProgrammingError = _sqlite3.ProgrammingError
+  Warning = _sqlite3.Warning
@@ -0,0 +1,154 @@
+#!/usr/bin/python2.5
+"""Testsuite for the SQLite cursor."""
+__author__ = 'Elmer de Looff <elmer@underdark.nl>'
+__version__ = '0.1'
+
+# Standard modules
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+# Unittest target
+from underdark.libs.sqltalk import sqlite
+
+
+class CursorTest(unittest.TestCase):
+  """The cursor offers the same query methods as the MySQL cursor."""
+  def setUp(self):
+    """Sets up an in-memory database with a table of five numbered rows."""
+    self.connection = sqlite.Connect(':memory:')
+    with self.connection as cursor:
+      cursor.Execute('CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT)')
+      cursor.Insert('item', [{'id': number, 'name': 'item %d' % number}
+                             for number in range(1, 6)])
+
+  def Ids(self, cursor):
+    """Returns the ids of the rows in the table, in order."""
+    return [row['id'] for row in cursor.Select('item', order=['id'])]
+
+  def testSelect(self):
+    """Select binds its arguments and limits"""
+    with self.connection as cursor:
+      result = cursor.Select('item', fields='name', conditions='id > ?',
+                             order=[('id', True)], limit=2, offset=1, args=(1,))
+    self.assertEqual([row['name'] for row in result], ['item 4', 'item 3'])
+
+  def testSelectTotalcount(self):
+    """Select with totalcount has the unlimited number of rows as affected"""
+    with self.connection as cursor:
+      result = cursor.Select('item', conditions='id > ?', limit=2,
+                             totalcount=True, args=(1,))
+    self.assertEqual((len(result), result.affected), (2, 4))
+
+  def testUpdate(self):
+    """Update binds values, and supports order and limit"""
+    with self.connection as cursor:
+      cursor.Update('item', {'name': 'first'}, 'id=?', args=(1,))
+      cursor.Update('item', {'name': 'last'}, None,
+                    order=[('id', True)], limit=1)
+      names = [row['name'] for row in cursor.Select('item', order=['id'])]
+    self.assertEqual(names, ['first', 'item 2', 'item 3', 'item 4', 'last'])
+
+  def testDelete(self):
+    """Delete supports conditions with arguments, order and limit"""
+    with self.connection as cursor:
+      cursor.Delete('item', 'id=?', args=(3,))
+      cursor.Delete('item', None, order=['id'], limit=1)
+      self.assertEqual(self.Ids(cursor), [2, 4, 5])
+      cursor.Truncate('item')
+      self.assertEqual(self.Ids(cursor), [])
+
+  def testDescribe(self):
+    """Describe gives the table's columns, or a single one"""
+    with self.connection as cursor:
+      self.assertEqual([row['name'] for row in cursor.Describe('item')],
+                       ['id', 'name'])
+      self.assertEqual(cursor.Describe('item', 'name')[0]['type'], 'TEXT')
+
+  def testSelectTables(self):
+    """SelectTables finds tables by (part of) their name"""
+    with self.connection as cursor:
+      cursor.Execute('CREATE TABLE item_tag (item INTEGER, tag TEXT)')
+      self.assertEqual(cursor.SelectTables(), set(['item', 'item_tag']))
+      self.assertEqual(cursor.SelectTables('tag'), set(['item_tag']))
+      self.assertEqual(cursor.SelectTables('item', exact=True), set(['item']))
+
+  def testImport(self):
+    """Import inserts rows given as sequences"""
+    with self.connection as cursor:
+      result = cursor.Import('item', ('id', 'name'),
+                             ((number, 'bulk') for number in range(6, 9)))
+      self.assertEqual(result.affected, 3)
+      self.assertEqual(self.Ids(cursor), range(1, 9))
+
+  def testErrorClasses(self):
+    """Database errors are available on the cursor"""
+    with self.connection as cursor:
+      self.assertEqual(cursor.PLACEHOLDER, '?')
+      self.assertRaises(cursor.OperationalError, cursor.Select, 'missing')
+
+
+class BulkImportTest(unittest.TestCase):
+  """Bulk imports set pragmas for the transaction, and restore them after."""
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.connection = sqlite.Connect(os.path.join(self.directory, 'test.db'))
+    with self.connection as cursor:
+      cursor.Execute('CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT)')
+
+  def tearDown(self):
+    self.connection.close()
+    shutil.rmtree(self.directory)
+
+  def Pragma(self, name):
+    return self.connection.execute('PRAGMA %s' % name).fetchall()[0][0]
+
+  def testPragmas(self):
+    """Pragmas are changed during the import only"""
+    synchronous = self.Pragma('synchronous')
+    with self.connection.BulkImport(journal_mode='MEMORY') as cursor:
+      self.assertEqual(self.Pragma('synchronous'), 0)
+      self.assertEqual(self.Pragma('journal_mode'), 'memory')
+      cursor.Import('item', ('name',), (('row %d' % number,)
+                                        for number in range(1000)))
+    self.assertEqual(self.Pragma('synchronous'), synchronous)
+    self.assertEqual(self.Pragma('journal_mode'), 'delete')
+    with self.connection as cursor:
+      self.assertEqual(cursor.Execute('SELECT COUNT(*) FROM item')[0][0], 1000)
+
+  def testRollback(self):
+    """A failed import is rolled back, and the pragmas restored"""
+    try:
+      with self.connection.BulkImport() as cursor:
+        cursor.Import('item', ('name',), [('first',)])
+        raise ValueError('Abort import')
+    except ValueError:
+      pass
+    self.assertEqual(self.Pragma('synchronous'), 2)
+    with self.connection as cursor:
+      self.assertEqual(cursor.Execute('SELECT COUNT(*) FROM item')[0][0], 0)
+
+  def testBadPragma(self):
+    """Pragma values are checked before they are used"""
+    self.assertRaises(ValueError, self.connection.BulkImport,
+                      synchronous='OFF; DROP TABLE item')
+
+
+class EscapeValuesTest(unittest.TestCase):
+  """Values are escaped as SQLite literals."""
+  def testLiterals(self):
+    escape = sqlite.connection.Connection.EscapeValues
+    self.assertEqual(escape(None), 'NULL')
+    self.assertEqual(escape(True), '1')
+    self.assertEqual(escape(12), '12')
+    self.assertEqual(escape("it's"), "'it''s'")
+    self.assertEqual(escape(datetime.date(2012, 3, 1)),
+                     str(datetime.date(2012, 3, 1).toordinal()))
+    self.assertEqual(escape([1, 'a']), ['1', "'a'"])
+    self.assertEqual(escape({'key': u'b'}), {'key': u"'b'"})
+
+
+if __name__ == '__main__':
+  unittest.main(testRunner=unittest.TextTestRunner(verbosity=2))
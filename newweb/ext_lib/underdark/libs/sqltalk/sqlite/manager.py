@@ -0,0 +1,183 @@
+#!/usr/bin/python2.5
+"""This module implements the ConnectionManager class, which gives multiple
+threads access to one SQLite database: reads run concurrently, each thread on
+its own read-only connection, while writes go through a single connection that
+is used by one transaction at a time.
+
+The database is switched to write-ahead logging (WAL) so that readers don't
+block the writer, nor the writer the readers. Readers see the data as last
+committed; a transaction that has written reads from the writer connection,
+and so sees its own changes.
+"""
+from __future__ import with_statement
+
+__author__ = 'Elmer de Looff <elmer@underdark.nl>'
+__version__ = '0.1'
+
+# Standard modules
+import contextlib
+import logging
+import os
+import threading
+
+# Application specific modules
+import connection
+import cursor
+from underdark.libs.sqltalk import routing
+
+
+class ConnectionManager(object):
+  """Thread-safe manager of the read and write connections for a database.
+
+  Each thread that reads gets its own read-only connection, which it keeps
+  for subsequent transactions. These are meant for a fixed set of worker
+  threads, such as those of a threaded server. The readers of threads that
+  have ended are closed when the next new reader is opened.
+  """
+  def __init__(self, database, debug=False, disable_log=False, **kwds):
+    """Initializes a ConnectionManager and switches the database to WAL mode.
+
+    Arguments:
+      @ database: str
+        Filename of the database. An in-memory database cannot be shared by
+        multiple connections and is not supported.
+      % debug: bool ~~ False
+        Whether to log at debug level.
+      % disable_log: bool ~~ False
+        Whether to disable logging altogether.
+      % **kwds: various
+        Passed on to every sqlite3 connection.
+
+    Raises:
+      ValueError: The database is in memory.
+    """
+    if database == ':memory:':
+      raise ValueError('An in-memory database cannot be shared.')
+    db_name = os.path.splitext(os.path.split(database)[1])[0]
+    self.logger = logging.getLogger('sqlite_%s' % db_name)
+    self.database = database
+    kwds.update(debug=debug, disable_log=disable_log, check_same_thread=False)
+    self.sqlite_kwds = kwds
+    self.writer = connection.Connection(database, **kwds)
+    self.writer.execute('PRAGMA journal_mode=WAL')
+    self.writer_lock = threading.RLock()
+    self._local = threading.local()
+    self._readers = {}
+    self._readers_lock = threading.Lock()
+
+  def __enter__(self):
+    """Starts a transaction, which writes once it first needs to."""
+    transaction = Transaction(self)
+    self._Transactions().append(transaction)
+    return cursor.Cursor(transaction)
+
+  def __exit__(self, exc_type, _exc_value, _exc_traceback):
+    """End of transaction: commits, or rolls back on failure."""
+    self._Transactions().pop().End(commit=exc_type is None)
+
+  @contextlib.contextmanager
+  def BulkImport(self, **pragmas):
+    """Starts a transaction on the writer, tuned for loading many rows.
+
+    The writer is held for the whole transaction. Refer to
+    connection.BulkImport for the pragmas; `journal_mode` should be left
+    unchanged, as the database is in WAL mode.
+    """
+    with self.writer_lock:
+      with self.writer.BulkImport(**pragmas) as bulk_cursor:
+        yield bulk_cursor
+
+  def Close(self):
+    """Closes the writer and all reader connections."""
+    with self._readers_lock:
+      readers, self._readers = self._readers, {}
+    for reader in readers.itervalues():
+      reader.close()
+    with self.writer_lock:
+      self.writer.close()
+
+  def Reader(self):
+    """Returns the current thread's read-only connection, opening it if needed.
+    """
+    try:
+      return self._local.reader
+    except AttributeError:
+      reader = connection.Connection(self.database, **self.sqlite_kwds)
+      reader.execute('PRAGMA query_only=ON')
+      with self._readers_lock:
+        ended = [thread for thread in self._readers if not thread.is_alive()]
+        self._readers[threading.current_thread()] = reader
+        ended = map(self._readers.pop, ended)
+      for old_reader in ended:
+        old_reader.close()
+      self._local.reader = reader
+      return reader
+
+  def _Transactions(self):
+    """Returns the stack of open transactions of the current thread."""
+    try:
+      return self._local.transactions
+    except AttributeError:
+      self._local.transactions = transactions = []
+      return transactions
+
+  @staticmethod
+  def EscapeField(field):
+    """Returns a SQL escaped field or table name."""
+    return connection.Connection.EscapeField(field)
+
+  @staticmethod
+  def EscapeValues(obj):
+    """Returns the object as SQL literal, or its contents for containers."""
+    return connection.Connection.EscapeValues(obj)
+
+  def ShowTables(self):
+    return self.Reader().ShowTables()
+
+
+class Transaction(object):
+  """Stands in as the connection of a Cursor, for one transaction.
+
+  Reads go to the thread's reader connection, until the first statement that
+  may write. That takes the writer lock, which is held until the end of the
+  transaction, and from then on all statements go to the writer.
+  """
+  def __init__(self, manager):
+    self.manager = manager
+    self.logger = manager.logger
+    self.writing = False
+
+  def execute(self, query, args=()):
+    return self._Connection(query).execute(query, args)
+
+  def executemany(self, query, args=()):
+    return self._Connection(query, write=True).executemany(query, args)
+
+  def End(self, commit=True):
+    """Commits or rolls back the writes, and releases the writer lock."""
+    if not self.writing:
+      return
+    self.writing = False
+    try:
+      if commit:
+        self.manager.writer.commit()
+        self.logger.debug('Transaction committed.')
+      else:
+        self.manager.writer.rollback()
+        self.logger.warning('Transaction was rolled back.')
+    finally:
+      self.manager.writer_lock.release()
+
+  @staticmethod
+  def EscapeField(field):
+    """Returns a SQL escaped field or table name."""
+    return connection.Connection.EscapeField(field)
+
+  def _Connection(self, query, write=False):
+    """Returns the connection that should execute the query."""
+    if not self.writing:
+      if not write and routing.IsRead(query):
+        return self.manager.Reader()
+      self.manager.writer_lock.acquire()
+      self.writing = True
+    return self.manager.writer
@@ -0,0 +1,137 @@
+#!/usr/bin/python2.5
+"""Testsuite for the SQLite connection manager."""
+__author__ = 'Elmer de Looff <elmer@underdark.nl>'
+__version__ = '0.1'
+
+# Standard modules
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+# Unittest target
+from underdark.libs.sqltalk import sqlite
+
+
+class ConnectionManagerTest(unittest.TestCase):
+  """Reads run concurrently on per-thread readers, writes on a single writer."""
+  def setUp(self):
+    """Sets up a manager for a database with a single row."""
+    self.directory = tempfile.mkdtemp()
+    self.manager = sqlite.ConnectManager(
+        os.path.join(self.directory, 'test.db'))
+    with self.manager as cursor:
+      cursor.Execute('CREATE TABLE item (name TEXT)')
+      cursor.Insert('item', {'name': 'first'})
+
+  def tearDown(self):
+    self.manager.Close()
+    shutil.rmtree(self.directory)
+
+  def Count(self, cursor):
+    """Returns the number of rows in the item table."""
+    return cursor.Execute('SELECT COUNT(*) FROM item')[0][0]
+
+  def testWalMode(self):
+    """The database is switched to write-ahead logging"""
+    with self.manager as cursor:
+      self.assertEqual(
+          cursor.Execute('PRAGMA journal_mode')[0][0].lower(), 'wal')
+
+  def testMemoryDatabase(self):
+    """An in-memory database is refused"""
+    self.assertRaises(ValueError, sqlite.ConnectManager, ':memory:')
+
+  def testReadersPerThread(self):
+    """Each thread reads on its own connection, which it keeps"""
+    readers = []
+    def Read():
+      with self.manager as cursor:
+        self.Count(cursor)
+      readers.append(self.manager.Reader())
+    threads = [threading.Thread(target=Read) for _count in range(2)]
+    for thread in threads:
+      thread.start()
+      thread.join()
+    Read()
+    Read()
+    self.assertEqual(len(set(map(id, readers))), 3)
+    self.assertTrue(readers[-1] is readers[-2])
+
+  def testEndedThreadReaders(self):
+    """Readers of threads that have ended are closed by the next new reader"""
+    readers = []
+    def Read():
+      with self.manager as cursor:
+        self.Count(cursor)
+      readers.append(self.manager.Reader())
+    for _count in range(3):
+      thread = threading.Thread(target=Read)
+      thread.start()
+      thread.join()
+    Read()
+    # pylint: disable=W0212
+    self.assertEqual(self.manager._readers.values(), [readers[-1]])
+    for reader in readers[:-1]:
+      self.assertRaises(sqlite.Error, reader.execute, 'SELECT 1')
+
+  def testReadYourWrites(self):
+    """A transaction reads its own writes, others only see committed rows"""
+    others = []
+    def ReadElsewhere():
+      with self.manager as cursor:
+        others.append(self.Count(cursor))
+    with self.manager as cursor:
+      cursor.Insert('item', {'name': 'second'})
+      self.assertEqual(self.Count(cursor), 2)
+      thread = threading.Thread(target=ReadElsewhere)
+      thread.start()
+      thread.join(5)
+    self.assertEqual(others, [1])
+    ReadElsewhere()
+    self.assertEqual(others, [1, 2])
+
+  def testRollback(self):
+    """A failing transaction is rolled back, and releases the writer"""
+    try:
+      with self.manager as cursor:
+        cursor.Insert('item', {'name': 'second'})
+        raise ValueError('Abort transaction')
+    except ValueError:
+      pass
+    def Write():
+      with self.manager as cursor:
+        cursor.Insert('item', {'name': 'third'})
+    thread = threading.Thread(target=Write)
+    thread.start()
+    thread.join(5)
+    with self.manager as cursor:
+      self.assertEqual([row[0] for row in cursor.Select('item', 'name')],
+                       ['first', 'third'])
+
+  def testReadOnlyReaders(self):
+    """Reader connections refuse to write"""
+    self.assertRaises(sqlite.OperationalError, self.manager.Reader().execute,
+                      "INSERT INTO item VALUES ('second')")
+
+  def testShowTables(self):
+    """Tables are listed through the reader"""
+    self.assertEqual(self.manager.ShowTables(), ['item'])
+
+
+class ThreadedConnectionTest(unittest.TestCase):
+  """The threaded connection serializes queries from multiple threads."""
+  def testResponseQueueReused(self):
+    """Each calling thread receives its responses on a single queue"""
+    threaded = sqlite.ThreadConnect(':memory:')
+    with threaded as cursor:
+      cursor.Execute('CREATE TABLE item (name TEXT)')
+      queue = threaded.responses.queue
+      cursor.Insert('item', {'name': 'first'})
+      self.assertEqual(len(cursor.Select('item')), 1)
+    self.assertTrue(threaded.responses.queue is queue)
+
+
+if __name__ == '__main__':
+  unittest.main(testRunner=unittest.TextTestRunner(verbosity=2))
@@ -0,0 +1,169 @@
+#!/usr/bin/python2.5
+"""This module implements the SnapshotManager class, which answers reads from
+in-memory copies of an SQLite database.
+
+This suits reference data that is read a lot and changes rarely: every thread
+gets its own `:memory:` copy of the database, so reads involve no file I/O or
+locking at all. A background thread checks the database for changes, and
+replaces the copies with fresh ones when it has changed. Writes go to the
+database file, as with the ConnectionManager this extends; a transaction that
+has written reads from the file from then on, and so sees its own changes.
+
+The copies are made by attaching the database file to a new in-memory
+database and copying the schema and every table, in a single read transaction
+so that the copy is consistent.
+"""
+from __future__ import with_statement
+
+__author__ = 'Elmer de Looff <elmer@underdark.nl>'
+__version__ = '0.2'
+
+# Standard modules
+import threading
+
+# Application specific modules
+import connection
+import manager
+
+SCHEMA_SELECT = ("SELECT `type`, `name`, `sql` FROM `source`.`sqlite_master` "
+                 "WHERE `sql` IS NOT NULL AND `name` NOT LIKE 'sqlite_%'")
+# Tables are created and filled before their indexes, triggers and views.
+SCHEMA_ORDER = {'table': 0, 'index': 1, 'trigger': 2, 'view': 3}
+
+
+class SnapshotManager(manager.ConnectionManager):
+  """Connection manager that reads from per-thread in-memory snapshots.
+
+  Members:
+    % interval: float
+      Number of seconds between checks for changes.
+    % on_change: bool
+      Whether snapshots are only refreshed when the database has changed, or
+      after every interval.
+    % refreshes: int
+      Number of times the snapshots were refreshed.
+  """
+  def __init__(self, database, interval=60, on_change=True, **kwds):
+    """Initializes a SnapshotManager and starts its refresh thread.
+
+    Arguments:
+      @ database: str
+        Filename of the database.
+      % interval: float ~~ 60
+        Number of seconds between checks for changes.
+      % on_change: bool ~~ True
+        Whether snapshots are only refreshed when the database has changed.
+        If False, they are refreshed after every interval.
+      % **kwds: various
+        Passed on to the ConnectionManager.
+    """
+    super(SnapshotManager, self).__init__(database, **kwds)
+    self.interval = interval
+    self.on_change = on_change
+    self.refreshes = 0
+    self._snapshots = {}  # Thread mapped to a single-item list with its copy.
+    self._monitor = connection.Connection(database, **self.sqlite_kwds)
+    self._data_version = self._DataVersion()
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._Run, name='sqlite-snapshot')
+    self._thread.daemon = True
+    self._thread.start()
+
+  def Close(self):
+    """Stops the refresh thread and closes all connections."""
+    self._stop.set()
+    self._thread.join()
+    with self._readers_lock:
+      self._snapshots = {}
+    self._monitor.close()
+    super(SnapshotManager, self).Close()
+
+  def Reader(self):
+    """Returns the current thread's snapshot, making it if needed."""
+    try:
+      return self._local.snapshot[0]
+    except AttributeError:
+      snapshot = [self.Snapshot()]
+      with self._readers_lock:
+        self._snapshots[threading.current_thread()] = snapshot
+      self._local.snapshot = snapshot
+      return snapshot[0]
+
+  def Refresh(self):
+    """Replaces the snapshots of all threads with fresh copies.
+
+    A thread keeps using the snapshot it is reading from until it asks for
+    its reader again, for its next statement. The snapshots of threads that
+    have ended are closed instead.
+    """
+    with self._readers_lock:
+      ended = [thread for thread in self._snapshots if not thread.is_alive()]
+      ended = map(self._snapshots.pop, ended)
+      snapshots = self._snapshots.values()
+    for snapshot in ended:
+      snapshot[0].close()
+    for snapshot in snapshots:
+      snapshot[0] = self.Snapshot()
+    self.refreshes += 1
+    self.logger.debug('Refreshed %d snapshots.', len(snapshots))
+
+  def Snapshot(self):
+    """Returns a new read-only in-memory copy of the database."""
+    copy = connection.Connection(
+        ':memory:', isolation_level=None, **self.sqlite_kwds)
+    copy.execute('ATTACH DATABASE ? AS `source`', (self.database,))
+    copy.execute('BEGIN')
+    try:
+      schema = copy.execute(SCHEMA_SELECT).fetchall()
+      schema.sort(key=lambda item: SCHEMA_ORDER.get(item[0], len(SCHEMA_ORDER)))
+      # Virtual tables (e.g. for full-text search) create their own shadow
+      # tables, and are filled through the virtual table itself.
+      virtual = set(name for kind, name, sql in schema
+                    if kind == 'table' and
+                    sql.upper().startswith('CREATE VIRTUAL'))
+      shadow_prefixes = tuple(name + '_' for name in virtual)
+      for kind, name, sql in schema:
+        if kind == 'table' and name.startswith(shadow_prefixes):
+          continue
+        copy.execute(sql)
+        if kind == 'table':
+          self._CopyTable(copy, name, keep_rowid=name in virtual)
+      copy.execute('COMMIT')
+    except Exception:
+      copy.execute('ROLLBACK')
+      raise
+    copy.execute('DETACH DATABASE `source`')
+    copy.execute('PRAGMA query_only=ON')
+    return copy
+
+  def _CopyTable(self, copy, table, keep_rowid=False):
+    """Copies the rows of a table from the source database into the copy.
+
+    The rowids of virtual tables are copied along, as their rows are commonly
+    linked to those of other tables by rowid (e.g. full-text search indexes).
+    """
+    table = self.EscapeField(table)
+    if not keep_rowid:
+      copy.execute('INSERT INTO `main`.%s SELECT * FROM `source`.%s' % (
+          table, table))
+      return
+    fields = ', '.join(['rowid'] + [
+        self.EscapeField(column[1]) for column in copy.execute(
+            'PRAGMA `source`.table_info(%s)' % table)])
+    copy.execute('INSERT INTO `main`.%s (%s) SELECT %s FROM `source`.%s' % (
+        table, fields, fields, table))
+
+  def _DataVersion(self):
+    """Returns a number that changes whenever the database file is changed."""
+    return self._monitor.execute('PRAGMA data_version').fetchall()[0][0]
+
+  def _Run(self):
+    """Checks for changes every interval, refreshing the snapshots on change."""
+    while not self._stop.wait(self.interval):
+      try:
+        version = self._DataVersion()
+        if not self.on_change or version != self._data_version:
+          self._data_version = version
+          self.Refresh()
+      except Exception:
+        self.logger.exception('Could not refresh the snapshots.')
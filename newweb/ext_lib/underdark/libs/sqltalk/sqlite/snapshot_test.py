@@ -0,0 +1,131 @@
+#!/usr/bin/python2.5
+"""Testsuite for the SQLite in-memory snapshot manager."""
+__author__ = 'Elmer de Looff <elmer@underdark.nl>'
+__version__ = '0.1'
+
+# Standard modules
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+# Unittest target
+from underdark.libs.sqltalk import sqlite
+
+
+class SnapshotManagerTest(unittest.TestCase):
+  """Reads are answered from in-memory copies, which are kept up to date."""
+  def setUp(self):
+    """Sets up a database with an indexed table, and a manager for it."""
+    self.directory = tempfile.mkdtemp()
+    self.database = os.path.join(self.directory, 'test.db')
+    with sqlite.Connect(self.database) as cursor:
+      cursor.Execute('CREATE TABLE country (code TEXT, name TEXT)')
+      cursor.Execute('CREATE INDEX country_code ON country (code)')
+      cursor.Insert('country', {'code': 'NL', 'name': 'Netherlands'})
+    self.manager = sqlite.ConnectSnapshot(self.database, interval=0.02)
+
+  def tearDown(self):
+    self.manager.Close()
+    shutil.rmtree(self.directory)
+
+  def Names(self):
+    with self.manager as cursor:
+      return [row[0] for row in cursor.Execute(
+          'SELECT name FROM country ORDER BY code')]
+
+  def ChangeSource(self):
+    """Changes the database file without going through the manager."""
+    with sqlite.Connect(self.database) as cursor:
+      cursor.Insert('country', {'code': 'BE', 'name': 'Belgium'})
+
+  def testReadsFromMemory(self):
+    """Reads use an in-memory copy, with the schema of the original"""
+    self.assertEqual(self.Names(), ['Netherlands'])
+    reader = self.manager.Reader()
+    self.assertEqual(reader.execute('PRAGMA database_list').fetchall()[0][2],
+                     '')
+    self.assertEqual(reader.ShowTables(), ['country'])
+    self.assertEqual(reader.execute(
+        "SELECT name FROM sqlite_master WHERE type='index'").fetchall(),
+                     [('country_code',)])
+
+  def testRefresh(self):
+    """Changes show up after a refresh, for all threads"""
+    self.manager.interval = 3600  # Takes effect after the pending check.
+    time.sleep(0.05)
+    self.Names()
+    other_names = []
+    refreshed = threading.Event()
+    def ReadTwice():
+      other_names.append(self.Names())
+      refreshed.wait(5)
+      other_names.append(self.Names())
+    thread = threading.Thread(target=ReadTwice)
+    thread.start()
+    self.ChangeSource()
+    self.assertEqual(self.Names(), ['Netherlands'])
+    self.manager.Refresh()
+    refreshed.set()
+    thread.join()
+    self.assertEqual(self.Names(), ['Belgium', 'Netherlands'])
+    self.assertEqual(other_names[-1], ['Belgium', 'Netherlands'])
+    self.assertEqual(len(self.manager._snapshots), 2)
+
+  def testRefreshEndedThreads(self):
+    """Snapshots of threads that have ended are closed on refresh"""
+    self.manager.interval = 3600  # Takes effect after the pending check.
+    time.sleep(0.05)
+    readers = []
+    thread = threading.Thread(
+        target=lambda: readers.append(self.manager.Reader()))
+    thread.start()
+    thread.join()
+    self.Names()
+    self.manager.Refresh()
+    self.assertEqual(len(self.manager._snapshots), 1)
+    self.assertRaises(sqlite.Error, readers[0].execute, 'SELECT 1')
+
+  def testRefreshOnChange(self):
+    """The background thread refreshes the snapshots when the file changes"""
+    self.Names()
+    time.sleep(0.1)
+    self.assertEqual(self.manager.refreshes, 0)
+    self.ChangeSource()
+    deadline = time.time() + 5
+    while self.manager.refreshes == 0 and time.time() < deadline:
+      time.sleep(0.01)
+    self.assertEqual(self.Names(), ['Belgium', 'Netherlands'])
+
+  def testWrites(self):
+    """Writes go to the file, and the writing transaction reads them back"""
+    with self.manager as cursor:
+      cursor.Insert('country', {'code': 'DE', 'name': 'Germany'})
+      self.assertEqual(len(cursor.Select('country')), 2)
+    with sqlite.Connect(self.database) as cursor:
+      self.assertEqual(len(cursor.Select('country')), 2)
+
+  def testVirtualTables(self):
+    """Full-text search tables are copied with their rowids"""
+    self.ChangeSource()
+    with sqlite.Connect(self.database) as cursor:
+      cursor.Execute('CREATE VIRTUAL TABLE country_search USING fts5(name)')
+      cursor.Execute('INSERT INTO country_search (rowid, name) '
+                     "SELECT rowid, name FROM country WHERE code = 'BE'")
+    self.manager.Refresh()
+    with self.manager as cursor:
+      self.assertEqual(list(cursor.Execute(
+          'SELECT country.code FROM country_search JOIN country '
+          'ON country.rowid = country_search.rowid '
+          'WHERE country_search MATCH ?', ('belgium',))[0]), ['BE'])
+
+  def testReadOnly(self):
+    """The snapshots cannot be written to"""
+    self.assertRaises(sqlite.OperationalError, self.manager.Reader().execute,
+                      "DELETE FROM country")
+
+
+if __name__ == '__main__':
+  unittest.main(testRunner=unittest.TextTestRunner(verbosity=2))
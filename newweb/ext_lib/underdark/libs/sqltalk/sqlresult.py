@@ -2,6 +2,7 @@
 """SQL result abstraction module.
 
 Classes:
+  FieldIndex: Shared mapping of field names to their position in a row.
   ResultRow: Dict-like object that represents a single database result row.
   ResultSet: Abstraction for a database resultset.
 
@@ -11,9 +12,11 @@ Error Classes:
   NotSupportedError: Operation is not supported
 """
 __author__ = 'Elmer de Looff <elmer@underdark.nl>'
-__version__ = '1.3'
+__version__ = '1.4'
 
 # Standard modules
+import array
+import collections
 import itertools
 import operator
 
@@ -32,6 +35,36 @@ class NotSupportedError(Error, TypeError):
   """Operation is not supported."""
 
 
+class FieldIndex(dict):
+  """Immutable mapping of field names to their position in a result row.
+
+  A single FieldIndex is shared by all rows of a ResultSet. If a field name
+  occurs more than once, it maps to its first position. Positions (including
+  negative ones) map to themselves, so rows need only a single lookup for
+  either kind of key.
+
+  Members:
+    % names: tuple
+      The field names, in order.
+  """
+  __slots__ = ('names',)
+
+  def __init__(self, names):
+    names = tuple(names)
+    super(FieldIndex, self).__init__(
+        (name, index) for index, name in reversed(list(enumerate(names))))
+    for index in range(len(names)):
+      dict.__setitem__(self, index, index)
+      dict.__setitem__(self, index - len(names), index)
+    self.names = names
+
+  def __reduce__(self):
+    return self.__class__, (self.names,)
+
+  def __setitem__(self, key, value):
+    raise TypeError('FieldIndex does not support item assignment')
+
+
 class ResultRow(object):
   """SQL Result row - an ordered dictionary-like record abstraction.
 
@@ -42,25 +75,41 @@ class ResultRow(object):
   Deleting items from the ResultRow can be done both on index and key. Updating
   or adding fields to the ResultRow can only be done on a key-basis.
 
+  A ResultRow is a view on a row tuple and a FieldIndex, both of which may be
+  shared with the ResultSet it came from. Neither is modified in place: a change
+  gives the row a new tuple of values (and a new field index, when a field is
+  added or removed). Rows that came from a ResultSet store their changes in the
+  ResultSet as well, so they show in the set as they did when it held the row
+  objects themselves. A row that gains or loses fields no longer fits the
+  shared field index, and the ResultSet keeps the row object itself instead.
+
   Members:
     % names: tuple (read-only)
       Names for the fields that the ResultRow contains.
   """
   # We expect many ResultRow instances, __slots__ cuts the memory footprint
   # in half for small rows. This seems like a reasonable tradeoff.
-  __slots__ = ('_fields', '_values')
+  __slots__ = ('_index', '_values', '_owner', '_position')
 
-  def __init__(self, fields, values):
+  def __init__(self, fields, values, owner=None, position=None):
     """Sets up the ordered dict.
 
     Arguments:
-      @ fields: iterable
+      @ fields: iterable / FieldIndex
         Fieldnames for the SQL result
       @ values: iterable
         Values that belong to the provided fields
+      % owner: ResultSet ~~ None
+        The ResultSet that the row is part of, which gets its changes.
+      % position: int ~~ None
+        The position of the row in the `owner` ResultSet.
     """
-    self._fields = list(fields)
-    self._values = list(values)
+    if not isinstance(fields, FieldIndex):
+      fields = FieldIndex(fields)
+    self._index = fields
+    self._values = tuple(values)  # This does not copy tuples.
+    self._owner = owner
+    self._position = position
 
   def __eq__(self, other):
     """Checks equality of the ResultRow to another ResultRow or object.
@@ -72,11 +121,8 @@ class ResultRow(object):
 
   def __getitem__(self, key):
     try:
-      if isinstance(key, int):
-        return self._values[key]
-      else:
-        return self._values[self._fields.index(key)]
-    except (LookupError, ValueError), message:
+      return self._values[self._index[key]]
+    except (KeyError, TypeError), message:
       raise FieldError(message)
 
   def __repr__(self):
@@ -110,22 +156,22 @@ class ResultRow(object):
     return reversed(self._values)
 
   def iterkeys(self):
-    return iter(self._fields)
+    return iter(self._index.names)
 
   def itervalues(self):
     return iter(self._values)
 
   def iteritems(self):
-    return itertools.izip(self._fields, self._values)
+    return itertools.izip(self._index.names, self._values)
 
   def keys(self):
-    return self._fields[:]
+    return list(self._index.names)
 
   def values(self):
-    return self._values[:]
+    return list(self._values)
 
   def items(self):
-    return zip(self._fields, self._values)
+    return zip(self._index.names, self._values)
 
   # ############################################################################
   # Methods to keep the dictionary neat and ordered
@@ -133,47 +179,73 @@ class ResultRow(object):
   def __delitem__(self, key):
     """Removes a key or index from the ResultRow."""
     try:
-      index = key if isinstance(key, int) else self._fields.index(key)
-      del self._fields[index]
-      del self._values[index]
-    except (LookupError, ValueError):
+      index = self._index[key]
+    except (KeyError, TypeError):
       raise FieldError('The ResultRow has no field %r' % key)
+    self._Remove(index)
 
   def __setitem__(self, field, value):
-    """Sets or updates a dictionary value.
-
-    N.B. The implementation for this is slow for large ResultRow objects.
-    """
-    try:
-      self._values[self._fields.index(field)] = value
-    except ValueError:
+    """Sets or updates a dictionary value."""
+    values = list(self._values)
+    if field in self._index:
+      values[self._index[field]] = value
+      self._Store(tuple(values))
+    else:
       # The field does not already occur in the ResultRow, add it at the end
-      self._fields.append(field)
-      self._values.append(value)
+      values.append(value)
+      self._Reshape(FieldIndex(self._index.names + (field,)), tuple(values))
 
   def pop(self, key, *default):
     try:
-      index = self._fields.index(key)
-      del self._fields[index]
-      return self._values.pop(index)
-    except ValueError:
+      return self._Remove(self._index[key])
+    except KeyError:
       if default:
         return default[0]
-      raise FieldError('No field %r in this ResultRow', key)
+      raise FieldError('No field %r in this ResultRow' % key)
 
   def popitem(self):
     """Pops the key,value pair at the end of the dictionary."""
     if not self:
       raise KeyError
-    return self._fields.pop(), self._values.pop()
+    name = self._index.names[-1]
+    return name, self._Remove(-1)
+
+  def _Remove(self, index):
+    """Removes the field at the given index and returns its value."""
+    names = list(self._index.names)
+    values = list(self._values)
+    del names[index]
+    value = values.pop(index)
+    self._Reshape(FieldIndex(names), tuple(values))
+    return value
+
+  # Accessing protected members of a friendly class.
+  # pylint: disable=W0212
+  def _Reshape(self, index, values):
+    """Changes the fields of the row, which the ResultSet then keeps as is."""
+    if self._owner is not None:
+      self._owner._KeepRow(self._position, self)
+    self._index = index
+    self._values = values
+
+  def _Store(self, values):
+    """Replaces the values of the row, and of its row in the ResultSet."""
+    if self._owner is not None:
+      self._owner._ReplaceRow(self._position, self, values)
+    self._values = values
+  # pylint: enable=W0212
 
 
 class ResultSet(object):
   """SQL Result set - stores the query, the returned result, and other info.
 
-  ResultSet is created from immutable objects. Once defined, none of its
-  attributes can be altered or overwritten. The exception to this is the private
-  member _fieldnames which has to be a list for fieldname lookup purposes.
+  The rows are stored as the tuples that the database driver returned, along
+  with a single FieldIndex that maps field names to positions in these tuples.
+  ResultRow views are created when rows are accessed. Rows that gained or lost
+  fields are kept as ResultRow objects instead, in an overlay on the tuples
+  that row access and columns check first. Columns and indexes on
+  field values are built once and cached until the rows change, see Column(),
+  IndexBy() and GroupBy().
 
   Members:
     @ affected - int
@@ -187,10 +259,8 @@ class ResultSet(object):
       Auto-increment ID that was generated upon the last insert.
     @ query - str
       The executed query that gave this result set.
-    @ result:   tuple
-      SQL Result set for the last executed query.
-    @ _fieldnames - list
-      Names of the fields in the result, used for reverse-indexing.
+    % result:   list (read-only)
+      ResultRows for all rows of the result.
     % fieldnames - tuple (read-only)
       Names of the fields in the result.
   """
@@ -213,21 +283,41 @@ class ResultSet(object):
         The query that was executed for this operation.
       % result ~~ None
         SQL Result set for the this operation.
+      % row_class: type ~~ ResultRow
+        Row view class, called like ResultRow with the FieldIndex, a row tuple,
+        the ResultSet and the position of the row.
     """
     self.affected = affected
     self.charset = charset
     self.insertid = insertid
     self.query = query
     self.warnings = []
+    self._row_class = row_class
+    self._columns = {}
+    self._indexes = {}
+    self._kept = {}  # Positions of rows with their own fields, to the rows.
 
-    if result:
+    if fields:
+      # Kept for empty results as well, so their columns can be requested.
       self.fields = fields
-      self._fieldnames = fieldnames = map(GET_FIELD_NAME, fields)
-      self.result = [row_class(fieldnames, row) for row in result]
+      self._index = FieldIndex(map(GET_FIELD_NAME, fields))
     else:
       self.fields = ()
-      self._fieldnames = []
-      self.result = []
+      self._index = FieldIndex(())
+    self._rows = list(result) if result else []
+
+  def __copy__(self):
+    """Returns a copy of the ResultSet, which shares only the row tuples."""
+    result = self.__class__.__new__(self.__class__)
+    result.__dict__.update(self.__dict__)
+    result.warnings = list(self.warnings)
+    result._rows = list(self._rows)
+    result._columns = {}
+    result._indexes = {}
+    result._kept = dict(
+        (position, self._row_class(row._index, row._values, result, position))
+        for position, row in self._kept.iteritems())
+    return result
 
   def __eq__(self, other):
     """Checks equality of the ResultSet to another ResultSet or object.
@@ -238,10 +328,14 @@ class ResultSet(object):
     if self is other:
       return True
     elif isinstance(other, self.__class__):
-      return (self.affected == other.affected and
-              self.insertid == other.insertid and
-              self.fields == other.fields and
-              self.result == other.result)
+      if (self.affected != other.affected or
+          self.insertid != other.insertid or
+          self.fields != other.fields or
+          self._index.names != other._index.names):
+        return False
+      if self._kept or other._kept:
+        return self.result == other.result
+      return map(tuple, self._rows) == map(tuple, other._rows)
     else:
       return False
 
@@ -257,36 +351,208 @@ class ResultSet(object):
     Returns:
       ResultRow / tuple: As detailed in the Arguments section.
     """
-    try:
-      return self.result[item]
-    except IndexError:
-      raise FieldError('Bad field index: %r.' % item)
-    except FieldError:
-      raise
-    except TypeError:
-      # The item type is incorrect, try grabbing a column for this fieldname.
+    if isinstance(item, (int, long)):
       try:
-        index = self._fieldnames.index(item)
-        return tuple(row[index] for row in self.result)
-      except ValueError:
-        raise FieldError('Bad field name: %r.' %  item)
+        row = self._rows[item]
+      except IndexError:
+        raise FieldError('Bad field index: %r.' % item)
+      return self._Row(row, item % len(self._rows))
+    elif isinstance(item, slice):
+      return map(self._Row, self._rows[item],
+                 xrange(*item.indices(len(self._rows))))
+    return self.Column(item)
 
   def __iter__(self):
     """Returns an iterator for the contained ResultRows."""
-    return iter(self.result)
+    if self._kept:
+      for position, row in enumerate(self._rows):
+        yield self._Row(row, position)
+      return
+    row_class = self._row_class
+    index = self._index
+    for position, row in enumerate(self._rows):
+      yield row_class(index, row, self, position)
 
   def __len__(self):
     """Returns an integer equal to the number of rows contained."""
-    return len(self.result)
+    return len(self._rows)
 
   def __nonzero__(self):
     """Boolean truthness of the ResultSet. True if it has 1+ ResultRow"""
-    return bool(self.result)
+    return bool(self._rows)
 
   def __repr__(self):
     """Returns a string representation of the ResultSet."""
     return '%s instance: %d rows%s' % (
-        self.__class__.__name__, len(self.result), 's'[len(self.result) == 1:])
+        self.__class__.__name__, len(self._rows), 's'[len(self._rows) == 1:])
+
+  def Column(self, field, typecode=None, numpy=False):
+    """Returns all values of a single field, as a tuple or typed array.
+
+    The tuple of values is built once and cached until the rows of the
+    ResultSet change. Typed arrays are built from this on every call, as the
+    caller is free to modify them.
+
+    Arguments:
+      @ field: str
+        Name of the field to return the values of.
+      % typecode: str ~~ None
+        Typecode for an `array.array` of the values. With `numpy`, this is the
+        NumPy dtype instead, or None to have NumPy pick one.
+      % numpy: bool ~~ False
+        Returns a NumPy array rather than a tuple or `array.array`.
+
+    Raises:
+      FieldError: The field does not occur in the ResultSet.
+      NotSupportedError: NumPy is not available, or the values can not be
+                         stored in an array of the given type (e.g. NULLs).
+
+    Returns:
+      tuple / array.array / numpy.ndarray: The values of the field.
+    """
+    try:
+      column = self._columns[field]
+    except KeyError:
+      try:
+        index = self._index[field]
+      except (KeyError, TypeError):
+        raise FieldError('Bad field name: %r.' % field)
+      column = self._columns[field] = tuple(
+          itertools.imap(operator.itemgetter(index), self._Tuples()))
+    if numpy:
+      return _NumpyArray(column, typecode)
+    if typecode is None:
+      return column
+    try:
+      return array.array(typecode, column)
+    except (TypeError, OverflowError), message:
+      raise NotSupportedError('Field %r does not fit array type %r: %s' % (
+          field, typecode, message))
+
+  def Columns(self, fields=None, typecode=None, numpy=False):
+    """Returns the values for several fields, as tuples or typed arrays.
+
+    Arguments:
+      % fields: iterable of str ~~ None
+        Names of the fields to return, all fields when not given.
+      % typecode: str / dict ~~ None
+        Typecode for all fields, or a mapping of field names to typecodes.
+        Fields absent from the mapping are returned as tuples (or with a dtype
+        picked by NumPy). See Column() for details.
+      % numpy: bool ~~ False
+        Returns NumPy arrays rather than tuples or `array.array`s.
+
+    Returns:
+      OrderedDict: Field names mapped to their values, in the order requested.
+    """
+    if fields is None:
+      fields = self._index.names
+    columns = collections.OrderedDict()
+    for field in fields:
+      if isinstance(typecode, dict):
+        columns[field] = self.Column(field, typecode.get(field), numpy=numpy)
+      else:
+        columns[field] = self.Column(field, typecode, numpy=numpy)
+    return columns
+
+  def GroupBy(self, field):
+    """Returns the rows grouped by the value of the given field(s).
+
+    The grouping is built once and cached until the rows of the ResultSet
+    change; it should be treated as read-only.
+
+    Arguments:
+      @ field: str / tuple of str
+        Field to group on. For a tuple of fields, the groups are keyed on the
+        tuple of their values.
+
+    Raises:
+      FieldError: The field does not occur in the ResultSet.
+
+    Returns:
+      OrderedDict: Field values mapped to lists of ResultRows. Groups are
+                   ordered by their first occurrence in the ResultSet.
+    """
+    try:
+      return self._indexes['group', field]
+    except KeyError:
+      groups = collections.OrderedDict()
+      for key, row in itertools.izip(self._Keys(field), self):
+        try:
+          groups[key].append(row)
+        except KeyError:
+          groups[key] = [row]
+      self._indexes['group', field] = groups
+      return groups
+
+  def IndexBy(self, field):
+    """Returns the rows keyed by the value of the given field(s).
+
+    This is meant for unique fields, if a value occurs more than once, it maps
+    to the first row that has it. The index is built once and cached until the
+    rows of the ResultSet change; it should be treated as read-only.
+
+    Arguments:
+      @ field: str / tuple of str
+        Field to index. For a tuple of fields, the index is keyed on the tuple
+        of their values.
+
+    Raises:
+      FieldError: The field does not occur in the ResultSet.
+
+    Returns:
+      dict: Field values mapped to ResultRows.
+    """
+    try:
+      return self._indexes['index', field]
+    except KeyError:
+      positions = xrange(len(self._rows) - 1, -1, -1)
+      index = self._indexes['index', field] = dict(itertools.izip(
+          reversed(self._Keys(field)), itertools.imap(
+              self._Row, reversed(self._rows), positions)))
+      return index
+
+  def Join(self, other, on, other_on=None, outer=False):
+    """Returns a new ResultSet with the rows of both sets joined on a field.
+
+    This is a hash join: the rows of `other` are grouped on their join field
+    (which is cached on `other`), after which each of our rows is matched in a
+    single lookup. Rows of the new ResultSet contain the fields of this set,
+    followed by those of `other`. As with SQL joins, NULL never matches.
+
+    Arguments:
+      @ other: ResultSet
+        The ResultSet to join with.
+      @ on: str / tuple of str
+        Field(s) of this ResultSet to join on.
+      % other_on: str / tuple of str ~~ None
+        Field(s) of `other` to join on, if they differ from `on`.
+      % outer: bool ~~ False
+        Whether to do a left outer join. Rows without a match in `other` are
+        then included, with NULLs for the fields of `other`.
+
+    Raises:
+      FieldError: A join field does not occur in its ResultSet.
+
+    Returns:
+      ResultSet: The joined rows.
+    """
+    groups = other.GroupBy(on if other_on is None else other_on)
+    composite = isinstance(on, tuple)
+    padding = (None,) * len(other.fieldnames)
+    rows = []
+    for key, row in itertools.izip(self._Keys(on), self._Tuples()):
+      if key is None or composite and None in key:
+        matches = None
+      else:
+        matches = groups.get(key)
+      if matches:
+        rows.extend(row + other._Values(match) for match in matches)
+      elif outer:
+        rows.append(row + padding)
+    return ResultSet(query=self.query, charset=self.charset, result=rows,
+                     fields=tuple(self.fields) + tuple(other.fields),
+                     row_class=self._row_class)
 
   def FilterRowsByFields(self, *fields):
     """Yields ResultRows containing only selected fields.
@@ -302,23 +568,137 @@ class ResultSet(object):
       ResultRow: Each ResultRow contains only the filtered fields.
     """
     try:
-      indices = tuple(self._fieldnames.index(field) for field in fields)
-    except ValueError:
+      indices = tuple(self._index[field] for field in fields)
+    except KeyError:
       raise FieldError('Bad fieldnames in filter request.')
-    for row in self:
-      yield ResultRow(zip(fields, tuple(row[index] for index in indices)))
+    index = FieldIndex(fields)
+    for row in self._Tuples():
+      yield self._row_class(index, tuple(row[column] for column in indices))
 
   def PopField(self, field):
     try:
-      self._fieldnames.remove(field)
-    except ValueError:
+      index = self._index[field]
+    except KeyError:
       raise FieldError('Fieldname %r does not occur in the ResultSet.' % field)
-    return [row.pop(field) for row in self]
+    names = list(self._index.names)
+    del names[index]
+    self._index = FieldIndex(names)
+    column = [row[index] for row in self._rows]
+    self._rows = [row[:index] + row[index + 1:] for row in self._rows]
+    for position, row in self._kept.iteritems():
+      column[position] = row.pop(field, None)
+    self._Changed()
+    return column
 
   def PopRow(self, row_index):
-    return self.result.pop(row_index)
+    row = self._rows.pop(row_index)
+    position = row_index % (len(self._rows) + 1)
+    kept, self._kept = self._kept, {}
+    popped = kept.pop(position, None)
+    for old_position, kept_row in kept.iteritems():
+      if old_position > position:
+        kept_row._position = old_position = old_position - 1
+      self._kept[old_position] = kept_row
+    self._Changed()
+    if popped is not None:
+      popped._owner = popped._position = None
+      return popped
+    return self._row_class(self._index, row)
+
+  def _Changed(self):
+    """Clears the cached columns and indexes after the rows have changed."""
+    self._columns.clear()
+    self._indexes.clear()
+
+  def _KeepRow(self, position, row):
+    """Keeps the ResultRow as the row at the position, as its fields change.
+
+    Raises:
+      NotSupportedError: The row at the position was replaced or removed since
+                         the ResultRow was made.
+    """
+    if self._kept.get(position) is not row:
+      self._VerifyRow(position, row)
+      self._kept[position] = row
+    self._Changed()
+
+  def _ReplaceRow(self, position, row, values):
+    """Replaces the values of the row at the position, for a changed ResultRow.
+
+    This is how ResultRows store their changes in the ResultSet. Rows that are
+    kept as they are only need the cached columns and indexes cleared.
+
+    Raises:
+      NotSupportedError: The row at the position was replaced or removed since
+                         the ResultRow was made.
+    """
+    if self._kept.get(position) is not row:
+      self._VerifyRow(position, row)
+      self._rows[position] = values
+    self._Changed()
+
+  def _VerifyRow(self, position, row):
+    """Raises NotSupportedError unless the ResultRow views the stored row."""
+    if (position >= len(self._rows) or position in self._kept or
+        self._rows[position] is not row._values):
+      raise NotSupportedError(
+          'The row was changed or removed in the ResultSet after this '
+          'ResultRow was made from it.')
+
+  def _Keys(self, field):
+    """Returns the values of a field, or value tuples for a tuple of fields."""
+    if isinstance(field, tuple):
+      return zip(*map(self.Column, field))
+    return self.Column(field)
+
+  def _Row(self, row, position):
+    """Returns the row at the given position, a view on its row tuple if any."""
+    if self._kept:
+      kept = self._kept.get(position)
+      if kept is not None:
+        return kept
+    return self._row_class(self._index, row, self, position)
+
+  def _Tuples(self):
+    """Returns the rows as tuples of values for the fields of the ResultSet."""
+    if not self._kept:
+      return self._rows
+    rows = list(self._rows)
+    for position, row in self._kept.iteritems():
+      rows[position] = self._Values(row)
+    return rows
+
+  def _Values(self, row):
+    """Returns the values of a row for the fields of the ResultSet.
+
+    Fields that a kept row lost are None, and the ones it gained are left out.
+    """
+    if row._index is self._index:
+      return row._values
+    names = self._index.names
+    if row._index.names[:len(names)] == names:
+      return row._values[:len(names)]
+    return tuple(row.get(name) for name in names)
 
   @property
   def fieldnames(self):
     """Returns a tuple of the fieldnames that are in this ResultSet."""
-    return tuple(self._fieldnames)
+    return self._index.names
+
+  @property
+  def result(self):
+    """Returns a list of ResultRows for all rows in the result."""
+    return list(self)
+
+
+def _NumpyArray(values, dtype=None):
+  """Returns a NumPy array of the given values, if NumPy is available."""
+  try:
+    import numpy
+  except ImportError:
+    raise NotSupportedError('NumPy arrays require NumPy to be installed.')
+  try:
+    return numpy.array(values, dtype=dtype)
+  except (TypeError, ValueError), message:
+    raise NotSupportedError('Values do not fit NumPy type %r: %s' % (
+        dtype, message))
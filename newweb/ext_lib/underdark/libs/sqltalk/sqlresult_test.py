@@ -19,6 +19,8 @@ __version__ = '0.6'
 # pylint: disable-msg=C0103
 
 # Standard modules
+import array
+import copy
 import unittest
 
 # Unittest target
@@ -209,5 +211,295 @@ class ResultSetBasicOperation(unittest.TestCase):
                                  insertid=0)
     self.assertTrue(result)
 
+
+class ResultSetRowStorage(unittest.TestCase):
+  """Rows are stored as tuples, and viewed through ResultRows on access."""
+  def setUp(self):
+    """Set up a persistent test environment."""
+    self.fields = (('name',), ('age',), ('name',))
+    self.rows = (('Elmer', 24, 'duplicate'), ('Bob', 42, 'duplicate'))
+    self.result = sqlresult.ResultSet(result=self.rows, fields=self.fields)
+
+  def testRowsShareFieldIndex(self):
+    """All rows of a ResultSet share one FieldIndex"""
+    first, second = self.result
+    self.assertTrue(first._index is second._index)
+
+  def testRowsAreViewsOnStoredTuples(self):
+    """Row views hold the stored tuple itself, not a copy"""
+    self.assertTrue(self.result[0]._values is self.rows[0])
+
+  def testDuplicateNameGivesFirstField(self):
+    """A field name that occurs twice gives the first field's value"""
+    self.assertEqual(self.result[0]['name'], 'Elmer')
+    self.assertEqual(self.result['name'], ('Elmer', 'Bob'))
+
+  def testChangingRowChangesResultSet(self):
+    """Changed values of a row view are stored in the ResultSet"""
+    self.assertEqual(self.result['age'], (24, 42))
+    row = self.result[-1]
+    row['age'] = 43
+    self.assertEqual(row['age'], 43)
+    self.assertEqual(self.result[1]['age'], 43)
+    self.assertEqual(self.result['age'], (24, 43))
+    self.assertEqual(self.rows[1], ('Bob', 42, 'duplicate'))
+
+  def testChangingRowsInLoop(self):
+    """Rows changed while iterating over the ResultSet stay changed"""
+    for row in self.result:
+      row['age'] += 1
+    self.assertEqual(self.result['age'], (25, 43))
+    self.assertEqual(self.result.IndexBy('age')[43]['name'], 'Bob')
+
+  def testAddingFieldsInLoop(self):
+    """Fields added to rows while iterating show in the ResultSet's rows"""
+    for row in self.result:
+      row['url'] = '/user/%s' % row['name']
+    self.assertEqual(self.result[0]['url'], '/user/Elmer')
+    self.assertEqual([row['url'] for row in self.result],
+                     ['/user/Elmer', '/user/Bob'])
+    self.assertEqual(self.result.result[1].keys(),
+                     ['name', 'age', 'name', 'url'])
+    self.assertEqual(self.result.fieldnames, ('name', 'age', 'name'))
+    self.assertEqual(self.result['age'], (24, 42))
+
+  def testRemovingFieldOfRow(self):
+    """Fields removed from a row of a ResultSet are gone from its row"""
+    del self.result[0]['age']
+    self.assertEqual(self.result.result[0].items(), [
+        ('name', 'Elmer'), ('name', 'duplicate')])
+    self.assertEqual(self.result[1].pop('age'), 42)
+    self.assertFalse('age' in self.result[1])
+    self.assertEqual(self.result['age'], (None, None))
+    self.assertEqual(self.result['name'], ('Elmer', 'Bob'))
+
+  def testChangingReshapedRow(self):
+    """Rows that gained a field keep showing their changes in the ResultSet"""
+    self.assertEqual(self.result['age'], (24, 42))
+    row = self.result[0]
+    row['role'] = 'developer'
+    row['age'] = 25
+    self.assertTrue(self.result[0] is row)
+    self.assertEqual(self.result['age'], (25, 42))
+    self.assertEqual(self.result.IndexBy('age')[25]['role'], 'developer')
+
+  def testCopyWithReshapedRow(self):
+    """Copies of a ResultSet have their own copy of reshaped rows"""
+    self.result[0]['role'] = 'developer'
+    duplicate = copy.copy(self.result)
+    self.assertEqual(duplicate, self.result)
+    duplicate[0]['role'] = 'manager'
+    self.assertEqual(self.result[0]['role'], 'developer')
+
+  def testPopRowBeforeReshapedRow(self):
+    """Popping a row keeps the reshaped rows after it in the ResultSet"""
+    self.result[1]['role'] = 'manager'
+    self.assertEqual(self.result.PopRow(0)['name'], 'Elmer')
+    row = self.result.PopRow(0)
+    self.assertEqual(row['role'], 'manager')
+    row['age'] = 43
+    self.assertEqual(len(self.result), 0)
+
+  def testCopiedRowIsIndependent(self):
+    """A ResultRow made from a row's keys and values can change freely"""
+    original = self.result[0]
+    row = sqlresult.ResultRow(original.keys(), original.values())
+    row['age'] = 25
+    row['role'] = 'developer'
+    del row['name']
+    self.assertEqual(row.items(), [
+        ('age', 25), ('name', 'duplicate'), ('role', 'developer')])
+    self.assertEqual(self.result[0]['age'], 24)
+
+  def testChangingStaleRowRaises(self):
+    """Changing a row view after its row was changed elsewhere raises"""
+    first, stale = self.result[0], self.result[0]
+    first['age'] = 25
+    self.assertRaises(sqlresult.NotSupportedError, stale.__setitem__, 'age', 1)
+    self.assertEqual(self.result[0]['age'], 25)
+
+  def testResultProperty(self):
+    """The result property lists ResultRows for all rows"""
+    self.assertEqual(self.result.result, [
+        sqlresult.ResultRow(['name', 'age', 'name'], row) for row in self.rows])
+
+  def testSlice(self):
+    """Slicing a ResultSet gives a list of ResultRows"""
+    self.assertEqual([row['name'] for row in self.result[1:]], ['Bob'])
+
+  def testPopField(self):
+    """PopField returns the column and removes it from all rows"""
+    self.assertEqual(self.result.PopField('age'), [24, 42])
+    self.assertEqual(self.result.fieldnames, ('name', 'name'))
+    self.assertEqual(self.result[1].values(), ['Bob', 'duplicate'])
+
+  def testPopRow(self):
+    """PopRow removes a row and returns it as a ResultRow"""
+    row = self.result.PopRow(0)
+    self.assertEqual(row['name'], 'Elmer')
+    self.assertEqual(len(self.result), 1)
+    row['role'] = 'developer'
+    self.assertEqual(self.result[0].keys(), ['name', 'age', 'name'])
+
+  def testFilterRowsByFields(self):
+    """FilterRowsByFields yields rows with only the requested fields"""
+    rows = list(self.result.FilterRowsByFields('age'))
+    self.assertEqual([row.items() for row in rows],
+                     [[('age', 24)], [('age', 42)]])
+
+
+class ResultSetColumns(unittest.TestCase):
+  """Columns are cached, and can be exported as typed arrays."""
+  def setUp(self):
+    """Set up a persistent test environment."""
+    self.result = sqlresult.ResultSet(
+        result=(('Elmer', 24, 1.5), ('Bob', 42, None)),
+        fields=(('name',), ('age',), ('score',)))
+
+  def testColumnIsCached(self):
+    """Requesting a column twice gives the same tuple"""
+    self.assertEqual(self.result.Column('age'), (24, 42))
+    self.assertTrue(self.result.Column('age') is self.result['age'])
+
+  def testCacheClearedOnChanges(self):
+    """Popping rows or fields invalidates the cached columns"""
+    self.assertEqual(self.result['age'], (24, 42))
+    self.result.PopRow(0)
+    self.assertEqual(self.result['age'], (42,))
+    self.result.PopField('name')
+    self.assertEqual(self.result['age'], (42,))
+    self.assertRaises(sqlresult.FieldError, self.result.Column, 'name')
+
+  def testTypedColumn(self):
+    """A typecode gives an array.array of the values"""
+    ages = self.result.Column('age', 'l')
+    self.assertTrue(isinstance(ages, array.array))
+    self.assertEqual(ages.tolist(), [24, 42])
+
+  def testTypedColumnWithNulls(self):
+    """NULL values can't be stored in a typed array"""
+    self.assertRaises(sqlresult.NotSupportedError,
+                      self.result.Column, 'score', 'd')
+
+  def testColumns(self):
+    """Columns returns the requested columns in order"""
+    columns = self.result.Columns(('age', 'name'), typecode={'age': 'l'})
+    self.assertEqual(columns.keys(), ['age', 'name'])
+    self.assertEqual(columns['age'], array.array('l', [24, 42]))
+    self.assertEqual(columns['name'], ('Elmer', 'Bob'))
+    self.assertEqual(self.result.Columns().keys(), ['name', 'age', 'score'])
+
+  def testEmptyColumns(self):
+    """Columns of a ResultSet without rows are empty"""
+    empty = sqlresult.ResultSet(result=(), fields=(('name',), ('age',)))
+    self.assertEqual(empty.Column('age'), ())
+    self.assertEqual(empty['name'], ())
+    self.assertEqual(empty.Column('age', 'l'), array.array('l'))
+    self.assertEqual(empty.Columns().items(), [('name', ()), ('age', ())])
+    self.assertRaises(sqlresult.FieldError, empty.Column, 'score')
+
+  def testNumpyColumn(self):
+    """NumPy arrays are returned if NumPy is available"""
+    try:
+      import numpy
+    except ImportError:
+      self.assertRaises(sqlresult.NotSupportedError,
+                        self.result.Column, 'age', numpy=True)
+    else:
+      self.assertTrue(isinstance(
+          self.result.Column('age', numpy=True), numpy.ndarray))
+
+
+class ResultSetIndexes(unittest.TestCase):
+  """Indexes, groupings and joins on field values."""
+  def setUp(self):
+    """Set up a persistent test environment."""
+    self.people = sqlresult.ResultSet(
+        result=((1, 'Elmer', 10), (2, 'Bob', 20), (3, 'Alice', 10),
+                (4, 'Eve', None)),
+        fields=(('id',), ('name',), ('team',)))
+    self.teams = sqlresult.ResultSet(
+        result=((10, 'Core'), (20, 'Web'), (30, 'Empty')),
+        fields=(('team',), ('title',)))
+
+  def testIndexBy(self):
+    """IndexBy maps field values to rows, and is cached"""
+    index = self.people.IndexBy('id')
+    self.assertEqual(index[2]['name'], 'Bob')
+    self.assertTrue(self.people.IndexBy('id') is index)
+
+  def testIndexByDuplicates(self):
+    """IndexBy maps a duplicate value to the first row that has it"""
+    self.assertEqual(self.people.IndexBy('team')[10]['name'], 'Elmer')
+
+  def testIndexByCompositeKey(self):
+    """IndexBy on a tuple of fields keys on tuples of values"""
+    index = self.people.IndexBy(('team', 'name'))
+    self.assertEqual(index[10, 'Alice']['id'], 3)
+
+  def testGroupBy(self):
+    """GroupBy maps field values to lists of rows, in order"""
+    groups = self.people.GroupBy('team')
+    self.assertEqual(groups.keys(), [10, 20, None])
+    self.assertEqual([row['id'] for row in groups[10]], [1, 3])
+
+  def testIndexesClearedOnChanges(self):
+    """Popping a row invalidates the cached indexes"""
+    self.people.IndexBy('id')
+    self.people.PopRow(0)
+    self.assertFalse(1 in self.people.IndexBy('id'))
+
+  def testBadField(self):
+    """Indexing on a field that doesn't exist raises FieldError"""
+    self.assertRaises(sqlresult.FieldError, self.people.IndexBy, 'age')
+    self.assertRaises(sqlresult.FieldError, self.people.GroupBy, ('id', 'age'))
+
+  def testJoin(self):
+    """Join combines rows with matching field values, skipping NULLs"""
+    joined = self.people.Join(self.teams, 'team')
+    self.assertEqual(joined.fieldnames, ('id', 'name', 'team', 'team', 'title'))
+    self.assertEqual([(row['name'], row['title']) for row in joined],
+                     [('Elmer', 'Core'), ('Bob', 'Web'), ('Alice', 'Core')])
+
+  def testOuterJoin(self):
+    """An outer join keeps unmatched rows, with NULLs for the other fields"""
+    joined = self.people.Join(self.teams, 'team', outer=True)
+    self.assertEqual(len(joined), 4)
+    self.assertEqual(joined[3].values(), [4, 'Eve', None, None, None])
+
+  def testEmptyIndexes(self):
+    """Indexes and groupings of a ResultSet without rows are empty"""
+    empty = sqlresult.ResultSet(result=(), fields=self.teams.fields)
+    self.assertEqual(empty.IndexBy('team'), {})
+    self.assertEqual(empty.GroupBy(('team', 'title')), {})
+    self.assertRaises(sqlresult.FieldError, empty.IndexBy, 'name')
+
+  def testJoinEmptyRight(self):
+    """Joining with an empty ResultSet gives no rows, or only padded ones"""
+    empty = sqlresult.ResultSet(result=(), fields=self.teams.fields)
+    joined = self.people.Join(empty, 'team')
+    self.assertEqual(len(joined), 0)
+    self.assertEqual(joined.fieldnames, ('id', 'name', 'team', 'team', 'title'))
+    outer = self.people.Join(empty, 'team', outer=True)
+    self.assertEqual(len(outer), 4)
+    self.assertEqual(outer[0].values(), [1, 'Elmer', 10, None, None])
+
+  def testJoinEmptyLeft(self):
+    """Joining an empty ResultSet gives an empty ResultSet"""
+    empty = sqlresult.ResultSet(result=(), fields=self.people.fields)
+    for outer in (False, True):
+      joined = empty.Join(self.teams, 'team', outer=outer)
+      self.assertEqual(len(joined), 0)
+      self.assertEqual(joined.fieldnames, ('id', 'name', 'team', 'team',
+                                           'title'))
+
+  def testJoinOnDifferentFields(self):
+    """Join can match on differently named fields"""
+    joined = self.teams.Join(self.people, 'team', other_on='team')
+    self.assertEqual(joined['name'], ('Elmer', 'Alice', 'Bob'))
+    joined = self.people.Join(self.people, 'id', other_on='team')
+    self.assertEqual(len(joined), 0)
+
+
 if __name__ == '__main__':
   unittest.main(testRunner=unittest.TextTestRunner(verbosity=2))
@@ -0,0 +1,181 @@
+#!/usr/bin/python2.5
+"""Deadline watchdog shared by all connections in the process.
+
+A single daemon thread keeps a heap of deadlines and runs the callback for
+each one that expires before it is cancelled. This is cheap enough to arm for
+every transaction: arming and cancelling a watch are a heap push and a flag,
+no thread is started per watch.
+
+Classes:
+  Watchdog: Runs callbacks for deadlines that expire, on a single thread.
+  WatchHandle: Handle for a single deadline, returned by Watchdog.Watch().
+
+Functions:
+  Watch: Arms a watch on the process-wide watchdog.
+"""
+__author__ = 'Elmer de Looff <elmer@underdark.nl>'
+__version__ = '0.1'
+
+# Standard modules
+import atexit
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+class WatchHandle(object):
+  """Handle for a single deadline. Cancel it to prevent the callback running."""
+  __slots__ = 'deadline', 'callback', 'args', 'kwargs', '_watchdog'
+
+  def __init__(self, watchdog, deadline, callback, args, kwargs):
+    self.deadline = deadline
+    self.callback = callback
+    self.args = args
+    self.kwargs = kwargs
+    self._watchdog = watchdog
+
+  def __repr__(self):
+    state = 'cancelled' if self.cancelled else 'armed'
+    return '<%s %s, deadline %.3f>' % (
+        self.__class__.__name__, state, self.deadline)
+
+  def Cancel(self):
+    """Cancels the watch. Cancelling an expired or cancelled watch is a no-op.
+
+    The watch stays in the watchdog's heap until its deadline comes up (or the
+    heap is compacted), but it drops its callback and arguments right away.
+
+    Returns:
+      bool: Whether the callback was prevented from running. This is False if
+      the watch was already cancelled, or has been taken to fire.
+    """
+    # Accessing a protected member of a friendly class.
+    # pylint: disable=W0212
+    return self._watchdog._Cancel(self)
+
+  @property
+  def cancelled(self):
+    """Returns whether the watch was cancelled (or has already fired)."""
+    return self.callback is None
+
+
+class Watchdog(object):
+  """Runs callbacks for expired deadlines, all on one lazily started thread."""
+  # The heap is rebuilt when it holds more than this many cancelled watches,
+  # and they make up more than half of it.
+  COMPACT_THRESHOLD = 1024
+
+  def __init__(self, name='sqltalk-watchdog'):
+    self.name = name
+    self.logger = logging.getLogger('sqltalk.watchdog')
+    self._heap = []
+    self._cancelled = 0
+    self._sequence = itertools.count()
+    self._condition = threading.Condition(threading.Lock())
+    self._thread = None
+    self._stopped = False
+    atexit.register(self.Stop)
+
+  def __len__(self):
+    """Returns the number of watches in the heap, including cancelled ones."""
+    return len(self._heap)
+
+  def Watch(self, delay, callback, *args, **kwargs):
+    """Arranges for `callback` to be called after `delay` seconds.
+
+    The callback runs on the watchdog thread, with the given extra arguments.
+    It should be quick, every other expired watch waits for it to complete.
+
+    Returns:
+      WatchHandle: handle with a Cancel() method to disarm the watch.
+    """
+    watch = WatchHandle(self, time.time() + delay, callback, args, kwargs)
+    with self._condition:
+      heapq.heappush(self._heap, (watch.deadline, next(self._sequence), watch))
+      if self._stopped:
+        pass
+      elif self._thread is None or not self._thread.is_alive():
+        # Not started yet, or we're in a forked child that lacks the thread.
+        self._thread = threading.Thread(target=self._Run, name=self.name)
+        self._thread.daemon = True
+        self._thread.start()
+      elif self._heap[0][2] is watch:
+        self._condition.notify()
+    return watch
+
+  def Stop(self):
+    """Stops the watchdog thread. Watches that have not expired never fire.
+
+    This is called on interpreter exit, so the thread doesn't run into a half
+    torn down interpreter.
+    """
+    with self._condition:
+      self._stopped = True
+      self._condition.notify()
+      thread = self._thread
+    if thread is not None and thread is not threading.current_thread():
+      thread.join(1)
+
+  def _Cancel(self, watch):
+    """Cancels a watch, compacting the heap if it has many cancelled ones.
+
+    The watchdog thread clears the callback of a watch under the same lock
+    when it takes the watch to fire, so only watches still in the heap are
+    cancelled and counted here.
+    """
+    with self._condition:
+      if watch.callback is None:
+        return False
+      watch.callback = watch.args = watch.kwargs = None
+      self._cancelled += 1
+      if (self._cancelled > self.COMPACT_THRESHOLD and
+          self._cancelled * 2 > len(self._heap)):
+        self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+        heapq.heapify(self._heap)
+        self._cancelled = 0
+      return True
+
+  def _Next(self):
+    """Blocks until a watch expires, then removes it and takes its callback.
+
+    Returns:
+      tuple: the callback and its arguments and keyword arguments, or None
+      when the watchdog has been stopped.
+    """
+    with self._condition:
+      while not self._stopped:
+        while self._heap and self._heap[0][2].cancelled:
+          heapq.heappop(self._heap)
+          self._cancelled -= 1
+        if not self._heap:
+          self._condition.wait()
+          continue
+        remaining = self._heap[0][0] - time.time()
+        if remaining <= 0:
+          watch = heapq.heappop(self._heap)[2]
+          call = watch.callback, watch.args, watch.kwargs
+          watch.callback = watch.args = watch.kwargs = None
+          return call
+        self._condition.wait(remaining)
+
+  def _Run(self):
+    """Main loop of the watchdog thread."""
+    while True:
+      call = self._Next()
+      if call is None:
+        return
+      callback, args, kwargs = call
+      try:
+        callback(*args, **kwargs)
+      except Exception:
+        self.logger.exception('Watchdog callback %r raised.', callback)
+
+
+WATCHDOG = Watchdog()
+
+
+def Watch(delay, callback, *args, **kwargs):
+  """Arms a watch on the process-wide watchdog. See Watchdog.Watch()."""
+  return WATCHDOG.Watch(delay, callback, *args, **kwargs)
@@ -0,0 +1,109 @@
+#!/usr/bin/python2.5
+"""Testsuite for the deadline watchdog."""
+__author__ = 'Elmer de Looff <elmer@underdark.nl>'
+__version__ = '0.1'
+
+# Standard modules
+import threading
+import time
+import unittest
+
+# Unittest target
+import watchdog
+
+
+class WatchdogTest(unittest.TestCase):
+  """Watches fire once their delay expires, unless cancelled."""
+  def setUp(self):
+    """Sets up a private watchdog and a record of fired callbacks."""
+    self.watchdog = watchdog.Watchdog()
+    self.fired = []
+    self.done = threading.Event()
+
+  def tearDown(self):
+    """Stops the private watchdog thread."""
+    self.watchdog.Stop()
+
+  def Record(self, name, last=False):
+    """Callback that records its name and signals the last expected one."""
+    self.fired.append(name)
+    if last:
+      self.done.set()
+
+  def testWatchFires(self):
+    """A watch runs its callback with the given arguments"""
+    self.watchdog.Watch(0.01, self.Record, 'first', last=True)
+    self.assertTrue(self.done.wait(2))
+    self.assertEqual(self.fired, ['first'])
+
+  def testWatchesFireInDeadlineOrder(self):
+    """Watches fire in order of their deadline, not of arming"""
+    self.watchdog.Watch(0.1, self.Record, 'late', last=True)
+    self.watchdog.Watch(0.01, self.Record, 'early')
+    self.assertTrue(self.done.wait(2))
+    self.assertEqual(self.fired, ['early', 'late'])
+
+  def testCancelledWatchDoesNotFire(self):
+    """A cancelled watch never runs its callback"""
+    self.watchdog.Watch(0.01, self.Record, 'cancelled').Cancel()
+    self.watchdog.Watch(0.05, self.Record, 'kept', last=True)
+    self.assertTrue(self.done.wait(2))
+    self.assertEqual(self.fired, ['kept'])
+
+  def testCancelIsIdempotent(self):
+    """Cancelling a watch twice, or after it fired, is harmless"""
+    watch = self.watchdog.Watch(0.01, self.Record, 'fired', last=True)
+    self.assertTrue(self.done.wait(2))
+    watch.Cancel()
+    watch.Cancel()
+    self.assertTrue(watch.cancelled)
+
+  def testCancelReportsPrevention(self):
+    """Cancel returns whether it prevented the callback from running"""
+    watch = self.watchdog.Watch(60, self.Record, 'never')
+    self.assertTrue(watch.Cancel())
+    self.assertFalse(watch.Cancel())
+    fired = self.watchdog.Watch(0.01, self.Record, 'fired', last=True)
+    self.assertTrue(self.done.wait(2))
+    self.assertFalse(fired.Cancel())
+
+  def testCancelAfterFiringNotCounted(self):
+    """Watches that were taken off the heap don't count as cancelled"""
+    watch = self.watchdog.Watch(0.01, self.Record, 'fired', last=True)
+    self.assertTrue(self.done.wait(2))
+    watch.Cancel()
+    self.assertEqual(self.watchdog._cancelled, 0)
+
+  def testCancelExpiredWatchWhileBusy(self):
+    """An expired watch that is cancelled before it is taken never fires"""
+    release = threading.Event()
+    self.watchdog.Watch(0.01, release.wait, 2)
+    waiting = self.watchdog.Watch(0.02, self.Record, 'cancelled')
+    time.sleep(0.05)  # The first callback blocks, the second has expired.
+    self.assertTrue(waiting.Cancel())
+    self.watchdog.Watch(0, self.Record, 'after', last=True)
+    release.set()
+    self.assertTrue(self.done.wait(2))
+    self.assertEqual(self.fired, ['after'])
+
+  def testFailingCallbackKeepsWatchdogRunning(self):
+    """An exception in one callback doesn't stop later watches firing"""
+    self.watchdog.logger.disabled = True
+    try:
+      self.watchdog.Watch(0.01, lambda: 1 / 0)
+      self.watchdog.Watch(0.05, self.Record, 'after', last=True)
+      self.assertTrue(self.done.wait(2))
+    finally:
+      self.watchdog.logger.disabled = False
+    self.assertEqual(self.fired, ['after'])
+
+  def testCancelledWatchesAreCompacted(self):
+    """Cancelled watches don't accumulate in the heap"""
+    self.watchdog.COMPACT_THRESHOLD = 10
+    for _count in range(100):
+      self.watchdog.Watch(60, self.Record, 'never').Cancel()
+    self.assertTrue(len(self.watchdog) <= 2 * self.watchdog.COMPACT_THRESHOLD)
+
+
+if __name__ == '__main__':
+  unittest.main(testRunner=unittest.TextTestRunner(verbosity=2))
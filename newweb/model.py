@@ -627,7 +627,7 @@ class Record(BaseRecord):
         the table for this record.
     """
     relation_field = relation_field or self.TableName()
-    with self.connection as cursor:
+    with self._WriteTransaction(self.connection) as cursor:
       safe_key = self.connection.EscapeValues(self.key)
       cursor.Delete(table=child_class.TableName(),
                     conditions='`%s`=%s' % (relation_field, safe_key))
@@ -635,18 +635,51 @@ class Record(BaseRecord):
   @classmethod
   def _PrimaryKeyCondition(cls, connection, value):
     """Returns the MySQL primary key condition to be used."""
+    fields, values = cls._PrimaryKeyValues(value)
+    return ' AND '.join('`%s` = %s' % (field, value) for field, value
+                        in zip(fields, connection.EscapeValues(values)))
+
+  @staticmethod
+  def _WriteTransaction(connection):
+    """Returns a transaction to write in, which also reads from the primary.
+
+    Connections that send reads to replicas (sqltalk.routing) would otherwise
+    do so for the reads that a write depends on, such as finding the next
+    record key. Replicas may lag behind, so their Primary() is used instead.
+    """
+    primary = getattr(connection, 'Primary', None)
+    if primary is None:
+      return connection
+    return primary()
+
+  @classmethod
+  def _PrimaryKeyBinding(cls, cursor, value):
+    """Returns the primary key condition with placeholders, and its arguments.
+
+    Because the condition text only depends on the class, every lookup by
+    primary key for a class reuses the same parameterized statement.
+    """
+    fields, values = cls._PrimaryKeyValues(value)
+    return (' AND '.join('`%s` = %s' % (field, cursor.PLACEHOLDER)
+                         for field in fields), values)
+
+  @classmethod
+  def _PrimaryKeyValues(cls, value):
+    """Returns the primary key fields, and the values for them, as sequences.
+
+    Raises:
+      TypeError: A single value was given for a compound key.
+      ValueError: The number of values doesn't match the compound key.
+    """
     if isinstance(cls._PRIMARY_KEY, tuple):
       if not isinstance(value, tuple):
         raise TypeError(
             'Compound keys should be loaded using a tuple of key values.')
       if len(value) != len(cls._PRIMARY_KEY):
-        raise ValueError('Not enough values (%d) for compound key.', len(value))
-      values = map(cls._ValueOrPrimary, value)
-      return ' AND '.join('`%s` = %s' % (field, value) for field, value
-                   in zip(cls._PRIMARY_KEY, connection.EscapeValues(values)))
-    else:
-      return '`%s` = %s' % (cls._PRIMARY_KEY,
-                            connection.EscapeValues(cls._ValueOrPrimary(value)))
+        raise ValueError('Wrong number of values (%d) for compound key.' %
+                         len(value))
+      return cls._PRIMARY_KEY, map(cls._ValueOrPrimary, value)
+    return (cls._PRIMARY_KEY,), [cls._ValueOrPrimary(value)]
 
   def _RecordCreate(self, cursor):
     """Inserts the record's current values in the database as a new record.
@@ -682,9 +715,9 @@ class Record(BaseRecord):
         primary = tuple(self._record[key] for key in self._PRIMARY_KEY)
       else:
         primary = self._record[self._PRIMARY_KEY]
-      cursor.Update(
-          table=self.TableName(), values=self._Changes(),
-          conditions=self._PrimaryKeyCondition(self.connection, primary))
+      conditions, args = self._PrimaryKeyBinding(cursor, primary)
+      cursor.Update(table=self.TableName(), values=self._Changes(),
+                    conditions=conditions, args=args)
     except KeyError:
       raise Error('Cannot update record without pre-existing primary key.')
     except cursor.OperationalError, err_obj:
@@ -721,7 +754,7 @@ class Record(BaseRecord):
   @classmethod
   def Create(cls, connection, record):
     record = cls(connection, record, run_init_hook=False)
-    with connection as cursor:
+    with cls._WriteTransaction(connection) as cursor:
       # Accessing protected members of a foreign class.
       # pylint: disable=W0212
       record._PreCreate(cursor)
@@ -731,16 +764,16 @@ class Record(BaseRecord):
 
   @classmethod
   def DeletePrimary(cls, connection, pkey_value):
-    with connection as cursor:
-      cursor.Delete(table=cls.TableName(),
-                    conditions=cls._PrimaryKeyCondition(connection, pkey_value))
+    with cls._WriteTransaction(connection) as cursor:
+      conditions, args = cls._PrimaryKeyBinding(cursor, pkey_value)
+      cursor.Delete(table=cls.TableName(), conditions=conditions, args=args)
 
   @classmethod
   def FromPrimary(cls, connection, pkey_value):
     with connection as cursor:
+      conditions, args = cls._PrimaryKeyBinding(cursor, pkey_value)
       record = cursor.Select(
-          table=cls.TableName(),
-          conditions=cls._PrimaryKeyCondition(connection, pkey_value))
+          table=cls.TableName(), conditions=conditions, args=args)
     if not record:
       raise NotExistError('There is no %r for primary key %r' % (
           cls.__name__, pkey_value))
@@ -798,7 +831,7 @@ class Record(BaseRecord):
         saved. N.B. each record is saved using a separate transaction, meaning
         that a failure to save this object will *not* roll back child saves.
     """
-    with self.connection as cursor:
+    with self._WriteTransaction(self.connection) as cursor:
       if save_foreign:
         self._SaveForeign(cursor)
       self._SaveSelf(cursor)
@@ -806,6 +839,115 @@ class Record(BaseRecord):
   # pylint: enable=W0221
 
 
+class SearchableRecord(Record):
+  """Record with a full-text search index on some of its fields.
+
+  The fields named in `_SEARCH_FIELDS` are indexed in an SQLite FTS5 table
+  named after the record's table, with a `_search` suffix. Index rows use the
+  record's primary key as their rowid, so this should be a single integer
+  field. Creating, saving and deleting records keeps the index in sync, in the
+  same transaction. Records that are removed otherwise (e.g. by deleting child
+  records) leave their index rows behind, which are ignored by `Search()` and
+  cleared by `CreateSearchIndex()`.
+  """
+  _SEARCH_FIELDS = ()
+  _SEARCH_TOKENIZER = 'unicode61'
+
+  @classmethod
+  def CreateSearchIndex(cls, connection):
+    """Creates the search index if it doesn't exist, and (re)fills it.
+
+    Arguments:
+      @ connection: object
+        Database connection to use, this should be an SQLite connection.
+    """
+    if isinstance(cls._PRIMARY_KEY, tuple):
+      raise TypeError('Searchable records cannot have a compound key.')
+    fields = ', '.join('`%s`' % field for field in cls._SEARCH_FIELDS)
+    with connection as cursor:
+      cursor.Execute(
+          'CREATE VIRTUAL TABLE IF NOT EXISTS `%s` USING fts5(%s, tokenize=%s)'
+          % (cls.SearchTableName(), fields,
+             connection.EscapeValues(cls._SEARCH_TOKENIZER)))
+      cursor.Execute('DELETE FROM `%s`' % cls.SearchTableName())
+      cursor.Execute(
+          'INSERT INTO `%s` (`rowid`, %s) SELECT `%s`, %s FROM `%s`' % (
+              cls.SearchTableName(), fields, cls._PRIMARY_KEY, fields,
+              cls.TableName()))
+
+  @classmethod
+  def DeletePrimary(cls, connection, pkey_value):
+    with cls._WriteTransaction(connection) as cursor:
+      cls._SearchIndexDelete(cursor, pkey_value)
+      conditions, args = cls._PrimaryKeyBinding(cursor, pkey_value)
+      cursor.Delete(table=cls.TableName(), conditions=conditions, args=args)
+
+  @classmethod
+  def Search(cls, connection, query, limit=None):
+    """Yields the records matching the full-text query, best matches first.
+
+    Arguments:
+      @ connection: object
+        Database connection to use.
+      @ query: str
+        Full-text query, in FTS5 query syntax. Plain words must all occur.
+      % limit: int ~~ None
+        Specifies a maximum number of records to be yielded.
+
+    Yields:
+      Record: Database record abstraction class.
+    """
+    statement = ('SELECT `record`.* FROM `%s` '
+                 'JOIN `%s` AS `record` ON `record`.`%s` = `%s`.`rowid` '
+                 'WHERE `%s` MATCH ? ORDER BY `%s`.`rank`' % (
+        cls.SearchTableName(), cls.TableName(), cls._PRIMARY_KEY,
+        cls.SearchTableName(), cls.SearchTableName(), cls.SearchTableName()))
+    args = [query]
+    if limit is not None:
+      statement += ' LIMIT ?'
+      args.append(int(limit))
+    with connection as cursor:
+      records = cursor.Execute(statement, args)
+    for record in records:
+      yield cls(connection, record)
+
+  @classmethod
+  def SearchTableName(cls):
+    """Returns the name of the full-text search table for the Record class."""
+    return cls.TableName() + '_search'
+
+  def _RecordCreate(self, cursor):
+    """Inserts the record in the database, and its fields in the search index.
+    """
+    super(SearchableRecord, self)._RecordCreate(cursor)
+    self._SearchIndexInsert(cursor)
+
+  def _RecordUpdate(self, cursor):
+    """Updates the database record, and its index row if that has changed."""
+    changes = self._Changes()
+    super(SearchableRecord, self)._RecordUpdate(cursor)
+    if self._PRIMARY_KEY in changes or any(
+        field in changes for field in self._SEARCH_FIELDS):
+      self._SearchIndexDelete(cursor, self._record[self._PRIMARY_KEY])
+      self._SearchIndexInsert(cursor)
+
+  @classmethod
+  def _SearchIndexDelete(cls, cursor, pkey_value):
+    """Removes the index row for the given primary key value."""
+    cursor.Execute('DELETE FROM `%s` WHERE `rowid` = %s' % (
+        cls.SearchTableName(), cursor.PLACEHOLDER),
+        [cls._ValueOrPrimary(pkey_value)])
+
+  def _SearchIndexInsert(self, cursor):
+    """Adds the record's current values of the searched fields to the index."""
+    record = self._DataRecord()
+    cursor.Execute('INSERT INTO `%s` (`rowid`, %s) VALUES (%s)' % (
+        self.SearchTableName(),
+        ', '.join('`%s`' % field for field in self._SEARCH_FIELDS),
+        ', '.join([cursor.PLACEHOLDER] * (len(self._SEARCH_FIELDS) + 1))),
+        [self.key] + [record.get(field) for field in self._SEARCH_FIELDS])
+
+
 class VersionedRecord(Record):
   """Basic class for database table/record abstraction."""
   _LOAD_METHOD = 'FromIdentifier'
@@ -174,6 +174,18 @@ class BasePageMaker(object):
   def _PostInit(self):
     """Method that gets called for derived classes of BasePageMaker."""
 
+  def _PostRequest(self):
+    """Method that gets called after the response has been produced.
+
+    This is called once for every request, after the last chunk of the body
+    has been produced. That includes requests where the handler raised an
+    exception, responses that are streamed and responses the client aborted.
+
+    Mixins that hold resources for the duration of a request (such as database
+    connections, which are checked out on first use) release them here.
+    Overriding methods should call their superclass' _PostRequest.
+    """
+
   @classmethod
   def __SetupPaths(cls):
     """This sets up the correct paths for the PageMaker subclasses.
@@ -211,10 +223,14 @@ class BasePageMaker(object):
     If the config file specificied a [templates] section and a `path` is
     assigned in there, this path will be used.
     Otherwise, the `TEMPLATE_DIR` will be used to load templates from.
+    A `cache_dir` in the [templates] section makes the parser keep parsed
+    templates in that directory, to load them from there on later runs.
     """
     if '__parser' not in self.persistent:
+      options = self.options.get('templates', {})
       self.persistent.Set('__parser', templateparser.Parser(
-          self.options.get('templates', {}).get('path', self.TEMPLATE_DIR)))
+          options.get('path', self.TEMPLATE_DIR),
+          cache_dir=options.get('cache_dir')))
     return self.persistent.Get('__parser')
 
   def InternalServerError(self, exc_type, exc_value, traceback):
@@ -374,32 +390,136 @@ class MongoMixin(object):
 
 
 class MysqlMixin(object):
-  """Adds MySQL support to PageMaker."""
+  """Adds MySQL support to PageMaker.
+
+  Connections are taken from a pool that is shared by all requests in the
+  process. Each request gets its own connection, which is returned to the pool
+  when the request finishes. The pool is configured from the [mysql] section
+  using the `pool_size`, `pool_overflow`, `pool_timeout` and `pool_max_idle`
+  options; refer to sqltalk.mysql.pool for their meaning. The `ping_interval`
+  option sets how long a connection may sit idle before its liveness is
+  checked; refer to sqltalk.mysql.connection.
+
+  Setting `query_cache_ttl` enables the query cache, for use through
+  `cursor.Cached()`. Its results are kept in the PageMaker's persistent
+  storage, up to `query_cache_size` of them (1000 by default); refer to
+  sqltalk.querycache.
+
+  Read replicas are used when `replicas` lists their hosts, separated by
+  commas. They share the user, password and database of the primary, and each
+  has its own pool. The request's connection is then a RoutingConnection that
+  sends reads to a replica and writes to the primary; refer to
+  sqltalk.routing. Replicas are chosen according to `replica_balance`
+  ('round-robin' or 'least-load'), and setting `sticky_primary` sends all reads
+  after the request's first write to the primary.
+  """
+  MYSQL_POOL_OPTIONS = {'pool_size': int, 'pool_overflow': int,
+                        'pool_timeout': float, 'pool_max_idle': float,
+                        'ping_interval': float}
+  _mysql_connection = None
+
   @property
   def connection(self):
-    """Returns a MySQL database connection."""
+    """Returns the MySQL database connection for the current request."""
+    if self._mysql_connection is None:
+      if self.options['mysql'].get('replicas'):
+        from underdark.libs.sqltalk import routing
+        sticky = str(self.options['mysql'].get('sticky_primary', ''))
+        self._mysql_connection = routing.RoutingConnection(
+            self.mysql_router,
+            sticky=sticky.lower() in ('1', 'on', 'true', 'yes'))
+      else:
+        self._mysql_connection = self.mysql_pool.Acquire()
+    return self._mysql_connection
+
+  @property
+  def mysql_pool(self):
+    """Returns the process-wide pool of MySQL database connections."""
     if '__mysql' not in self.persistent:
-      from underdark.libs.sqltalk import mysql
       mysql_config = self.options['mysql']
-      self.persistent.Set('__mysql', mysql.Connect(
-          host=mysql_config.get('host', 'localhost'),
-          user=mysql_config.get('user'),
-          passwd=mysql_config.get('password'),
-          db=mysql_config.get('database'),
-          charset=mysql_config.get('charset', 'utf8'),
-          debug=DebuggerMixin in self.__class__.__mro__))
+      self.persistent.SetDefault('__mysql', self._MysqlPool(
+          mysql_config.get('host', 'localhost')))
     return self.persistent.Get('__mysql')
 
+  @property
+  def mysql_router(self):
+    """Returns the process-wide router over the primary and its replicas."""
+    if '__mysql_router' not in self.persistent:
+      from underdark.libs.sqltalk import routing
+      mysql_config = self.options['mysql']
+      replicas = [self._MysqlPool(host.strip())
+                  for host in mysql_config['replicas'].split(',')
+                  if host.strip()]
+      self.persistent.SetDefault('__mysql_router', routing.Router(
+          self.mysql_pool, replicas,
+          balance=mysql_config.get('replica_balance', 'round-robin')))
+    return self.persistent.Get('__mysql_router')
+
+  def _MysqlPool(self, host):
+    """Returns a new pool of connections to the given MySQL host.
+
+    All pools share the process-wide query cache, if that is enabled.
+    """
+    from underdark.libs.sqltalk import mysql
+    mysql_config = self.options['mysql']
+    pool_options = dict(
+        (option, convert(mysql_config[option]))
+        for option, convert in self.MYSQL_POOL_OPTIONS.iteritems()
+        if option in mysql_config)
+    if 'query_cache_ttl' in mysql_config:
+      if '__mysql_cache' not in self.persistent:
+        from underdark.libs.sqltalk import querycache
+        self.persistent.SetDefault('__mysql_cache', querycache.QueryCache(
+            ttl=float(mysql_config['query_cache_ttl']),
+            maxsize=int(mysql_config.get('query_cache_size', 1000)),
+            storage=self.persistent, prefix='__mysql_query_cache'))
+      pool_options['query_cache'] = self.persistent.Get('__mysql_cache')
+    return mysql.ConnectPool(
+        host=host,
+        user=mysql_config.get('user'),
+        passwd=mysql_config.get('password'),
+        db=mysql_config.get('database'),
+        charset=mysql_config.get('charset', 'utf8'),
+        debug=DebuggerMixin in self.__class__.__mro__,
+        **pool_options)
+
+  def _PostRequest(self):
+    """Returns the request's MySQL connection(s) to their pool."""
+    if self._mysql_connection is not None:
+      connection, self._mysql_connection = self._mysql_connection, None
+      if self.options['mysql'].get('replicas'):
+        connection.Release()
+      else:
+        self.mysql_pool.Release(connection)
+    super(MysqlMixin, self)._PostRequest()
+
 
 class SqliteMixin(object):
-  """Adds SQLite support to PageMaker."""
+  """Adds SQLite support to PageMaker.
+
+  The database is shared by all requests in the process through a connection
+  manager, which switches it to WAL mode. Reads run concurrently, each thread
+  on its own read-only connection, while transactions that write are
+  serialized on a single writer; refer to sqltalk.sqlite.manager.
+
+  For reference data that rarely changes, setting `snapshot_interval` answers
+  reads from in-memory copies of the database instead. These are checked for
+  changes, and refreshed, every so many seconds; refer to
+  sqltalk.sqlite.snapshot.
+  """
   @property
   def connection(self):
-    """Returns an SQLite database connection."""
+    """Returns the process-wide SQLite connection manager."""
     if '__sqlite' not in self.persistent:
       from underdark.libs.sqltalk import sqlite
-      self.persistent.Set('__sqlite', sqlite.Connect(
-          self.options['sqlite']['database']))
+      sqlite_config = self.options['sqlite']
+      if 'snapshot_interval' in sqlite_config:
+        manager = sqlite.ConnectSnapshot(
+            sqlite_config['database'],
+            interval=float(sqlite_config['snapshot_interval']))
+      else:
+        manager = sqlite.ConnectManager(sqlite_config['database'])
+      self.persistent.SetDefault('__sqlite', manager)
     return self.persistent.Get('__sqlite')
 
 
@@ -410,7 +530,12 @@ class SmorgasbordMixin(object):
   can be used for regular relation database and MongoDB access. The caller will
   be given the relation database connection, unless Smorgasbord is aware of
   the caller's needs for another database connection.
+
+  The Smorgasbord is created per request. Its connections are loaded from the
+  PageMaker on first use, and released along with the PageMaker's own.
   """
+  _bord = None
+
   class Connections(dict):
     """Connection autoloading class for Smorgasbord."""
     def __init__(self, pagemaker):
@@ -439,11 +564,16 @@ class SmorgasbordMixin(object):
   @property
   def bord(self):
     """Returns a Smorgasbord of autoloading database connections."""
-    if '__bord' not in self.persistent:
+    if self._bord is None:
       from .. import model
-      self.persistent.Set('__bord', model.Smorgasbord(
-          connections=SmorgasbordMixin.Connections(self)))
-    return self.persistent.Get('__bord')
+      self._bord = model.Smorgasbord(
+          connections=SmorgasbordMixin.Connections(self))
+    return self._bord
+
+  def _PostRequest(self):
+    """Drops the Smorgasbord, so released connections cannot be reused."""
+    self._bord = None
+    super(SmorgasbordMixin, self)._PostRequest()
 
 
 # ##############################################################################
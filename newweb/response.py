@@ -2,6 +2,7 @@
 """newWeb response classes."""
 
 # Standard modules
+import collections
 import httplib
 from xml.sax import saxutils
 
@@ -22,7 +23,8 @@ class Response(object):
     Arguments:
       @ content: str
         The content to return to the client. This can be either plain text, html
-        or the contents of a file (images for example).
+        or the contents of a file (images for example). This may also be an
+        iterator, whose chunks are then streamed to the client as they come.
       % content_type: str ~~ CONTENT_TYPE ('text/html' by default)
         The content type of the response. This should NOT be set in headers.
       % httpcode: int ~~ 200
@@ -59,9 +61,27 @@ class Response(object):
   def text(self, content):
     if isinstance(content, unicode):
       self.content = content.encode(self.charset)
+    elif isinstance(content, collections.Iterator):
+      self.content = content
     else:
       self.content = str(content)
 
+  @property
+  def streaming(self):
+    """Returns whether the content is an iterator rather than a string."""
+    return not isinstance(self.content, str)
+
+  def __iter__(self):
+    """Yields the response body, encoding unicode chunks of streamed content."""
+    if not self.streaming:
+      yield self.content
+      return
+    for chunk in self.content:
+      if isinstance(chunk, unicode):
+        yield chunk.encode(self.charset)
+      else:
+        yield str(chunk)
+
   # Retrieve a header list
   @property
   def headerlist(self):
@@ -0,0 +1,114 @@
+#!/usr/bin/python
+"""Precompiles and validates all templates in a template directory.
+
+Every template is parsed and compiled, which reports templates with syntax
+errors. With a cache directory, the parsed templates are stored in there, for
+Parsers that use the same cache directory to load them from:
+
+  python -m newweb.scripts.templates [--cache-dir DIR] TEMPLATE_DIR
+
+The report lists the time taken to parse and compile each template, and the
+script exits with a non-zero status if any template failed.
+"""
+
+import os
+import sys
+import time
+from optparse import OptionParser
+
+# Application specific modules
+from newweb import templateparser
+from newweb.scripts import tables
+
+
+def FindTemplates(template_dir, extensions=(), exclude=()):
+  """Yields the names of the templates in the directory, relative to it.
+
+  Hidden files and directories are skipped, as are the excluded directories.
+  """
+  exclude = set(map(os.path.abspath, exclude))
+  for path, dirs, files in os.walk(template_dir):
+    dirs[:] = sorted(name for name in dirs if not name.startswith('.') and
+                     os.path.abspath(os.path.join(path, name)) not in exclude)
+    for name in sorted(files):
+      if name.startswith('.'):
+        continue
+      if extensions and not name.endswith(tuple(extensions)):
+        continue
+      yield os.path.relpath(os.path.join(path, name), template_dir)
+
+
+def Precompile(template_dir, cache_dir=None, extensions=()):
+  """Parses and compiles every template, storing them in the cache if given.
+
+  Returns:
+    list of tuple: name, parse and compile time in ms, and the error (or None)
+    for each of the templates.
+  """
+  parser = templateparser.Parser(template_dir)
+  cache = templateparser.TemplateCache(cache_dir) if cache_dir else None
+  results = []
+  exclude = [cache_dir] if cache_dir else []
+  for name in FindTemplates(template_dir, extensions, exclude=exclude):
+    parse_time = compile_time = 0
+    try:
+      start = time.time()
+      parser.AddTemplate(name)
+      template = parser[name]
+      parse_time = (time.time() - start) * 1000
+      start = time.time()
+      template.Compile()
+      template.Compile(stream=True)
+      compile_time = (time.time() - start) * 1000
+    except templateparser.Error, error:
+      results.append((name, parse_time, compile_time, error))
+      continue
+    if cache is not None:
+      cache.Store(template)
+    results.append((name, parse_time, compile_time, None))
+  return results
+
+
+def Report(results):
+  """Returns a table of the precompiled templates, and a summary line."""
+  names, parsing, compiling, statuses = [], [], [], []
+  for name, parse_time, compile_time, error in results:
+    names.append(name)
+    parsing.append('%.2f' % parse_time)
+    compiling.append('%.2f' % compile_time)
+    statuses.append('%s: %s' % (type(error).__name__, error) if error else 'OK')
+  errors = sum(1 for result in results if result[3])
+  summary = '%d templates, %d errors, %.2f ms' % (
+      len(results), errors, sum(result[1] + result[2] for result in results))
+  if not results:
+    return summary
+  return '%s\n%s' % (tables.Table(
+      tables.Column('Template', names),
+      tables.Column('Parse (ms)', parsing, align=tables.ALIGN.RIGHT),
+      tables.Column('Compile (ms)', compiling, align=tables.ALIGN.RIGHT),
+      tables.Column('Status', statuses)), summary)
+
+
+def main():
+  """Precompiles the template directory given on the command line."""
+  parser = OptionParser(usage='%prog [options] TEMPLATE_DIR')
+  parser.add_option('-c', '--cache-dir', dest='cache_dir',
+                    help='store the parsed templates in this directory')
+  parser.add_option('-e', '--extension', dest='extensions', action='append',
+                    default=[], help='only precompile files with this '
+                    'extension (can be given multiple times)')
+  options, args = parser.parse_args()
+  if len(args) != 1:
+    parser.error('expected a single template directory')
+  if not os.path.isdir(args[0]):
+    sys.exit('Error: %r is not a directory' % args[0])
+  try:
+    results = Precompile(args[0], options.cache_dir, options.extensions)
+  except (IOError, OSError), err_obj:
+    sys.exit('I/O Error: %s' % err_obj)
+  print Report(results)
+  if any(result[3] for result in results):
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main()
@@ -3,6 +3,8 @@
 
 Classes:
   Parser: Parses a template by replacing tags with their values.
+  TemplateCache: Keeps parsed templates on disk, keyed on their file.
+  TemplateCompiler: Generates a Python function that renders a Template.
 
 Error classes:
   Error: Base class for all errors generated by this module
@@ -11,8 +13,16 @@ Error classes:
 """
 
 # Standard modules
+import ast
+import cPickle
+import errno
+import hashlib
+import imp
+import marshal
 import os
 import re
+import tempfile
+import types
 import urllib
 from xml.sax import saxutils
 
@@ -45,57 +55,6 @@ class TemplateReadError(Error, IOError):
   """Template file could not be read or found."""
 
 
-class LazyTagValueRetrieval(object):
-  """Provides a means for lazy tag value retrieval.
-
-  This is necessary for instance for TemplateConditional.Expression, where
-  lazy retrieval of tag values means that shortcircuit conditional expressions
-  become possible.
-  """
-  def __init__(self, values):
-    self._values = values
-    self._tags = {}
-
-  # ############################################################################
-  # Methods for delayed tag value retrieval
-  #
-  def __getitem__(self, key):
-    return self._tags[key].GetValue(self._values)
-
-  def __setitem__(self, key, value):
-    self._tags[key] = value
-
-  # ############################################################################
-  # Methods for minimum dictionary likeness
-  #
-  def __iter__(self):
-    return iter(self._tags)
-
-  def iteritems(self):
-    """Returns an iterator for the items of the LazyTagValueRetrieval dict."""
-    return ((key, self[key]) for key in self)
-
-  def iterkeys(self):
-    """Returns an iterator for the keys of the LazyTagValueRetrieval dict."""
-    return iter(self)
-
-  def itervalues(self):
-    """Returns an iterator for the values of the LazyTagValueRetrieval dict."""
-    return (self[key] for key in self)
-
-  def items(self):
-    """Returns a list with the items of the LazyTagValueRetrieval dict."""
-    return list(self.iteritems())
-
-  def keys(self):
-    """Returns a list with the keys of the LazyTagValueRetrieval dict."""
-    return list(self)
-
-  def values(self):
-    """Returns a list with the values of the LazyTagValueRetrieval dict."""
-    return list(self.itervalues())
-
-
 class Parser(dict):
   """A template parser that loads and caches templates and parses them by name.
 
@@ -118,7 +77,7 @@ class Parser(dict):
   providing the `RegisterFunction` method to add or replace functions in this
   module constant.
   """
-  def __init__(self, path='.', templates=()):
+  def __init__(self, path='.', templates=(), cache_dir=None):
     """Initializes a Parser instance.
 
     This sets up the template directory and preloads any templates given.
@@ -128,9 +87,13 @@ class Parser(dict):
         Search path for loading templates using AddTemplate().
       % templates: iter of str ~~ None
         Names of templates to preload.
+      % cache_dir: str ~~ None
+        Directory for a TemplateCache. Template files are then loaded from the
+        cache where possible, instead of being parsed again.
     """
     super(Parser, self).__init__()
     self.template_dir = path
+    self.cache = TemplateCache(cache_dir) if cache_dir else None
     for template in templates:
       self.AddTemplate(template)
 
@@ -160,7 +123,9 @@ class Parser(dict):
 
     The `template` argument should be a path/filename. This will be resolved
     against the configured template directory. The file is parsed and placed in
-    the cache using the `template` filename, or the provided `name`.
+    the cache using the `template` filename, or the provided `name`. If the
+    parser has a TemplateCache, the parsed template is taken from there if its
+    file has not changed, or stored there after parsing.
 
     Arguments:
       @ location: str
@@ -174,7 +139,10 @@ class Parser(dict):
     """
     try:
       template_path = os.path.join(self.template_dir, location)
-      self[name or location] = FileTemplate(template_path, parser=self)
+      if self.cache is None:
+        self[name or location] = FileTemplate(template_path, parser=self)
+      else:
+        self[name or location] = self.cache.Load(template_path, parser=self)
     except IOError:
       raise TemplateReadError('Could not load template %r' % template_path)
 
@@ -195,6 +163,24 @@ class Parser(dict):
     """
     return self[template].Parse(**replacements)
 
+  def Stream(self, template, **replacements):
+    """Returns an iterator over the parsed template, yielding it in chunks.
+
+    The template is parsed while the iterator is consumed, so the iterator can
+    be given to a Response, to send the start of the page before the rest is
+    parsed. Errors in parsing the template only occur during iteration.
+
+    Arguments:
+      @ template: str
+        Template name, or the relative path to find it on.
+      @ **replacements: dict
+        Dictionary of replacement objects. Tags are looked up in here.
+
+    Returns:
+      iterator: str chunks of the template, with relevant tags replaced.
+    """
+    return self[template].Iterate(**replacements)
+
   def ParseString(self, template, **replacements):
     """Returns the given `template` with its tags replaced by **replacements.
 
@@ -215,6 +201,9 @@ class Parser(dict):
   def RegisterFunction(name, function):
     """Registers a templating `function`, allowing use in templates by `name`.
 
+    Tags that already resolved their functions will resolve them again, so
+    that the newly registered function takes effect everywhere.
+
     Arguments:
       @ name: str
         The name of the template function. This can be used behind a pipe ( | )
@@ -222,6 +211,7 @@ class Parser(dict):
         The function that should be used. Ideally this returns a string.
     """
     TAG_FUNCTIONS[name] = function
+    TemplateTag.functions_version += 1
 
   TemplateReadError = TemplateReadError
 
@@ -230,7 +220,13 @@ class SafeString(str):
 
 
 class Template(list):
-  """Contained for template parts, allowing for rich content construction."""
+  """Contained for template parts, allowing for rich content construction.
+
+  Templates are compiled to a Python function when they are first parsed, which
+  is what renders them from then on. Setting `COMPILE` to False makes them be
+  parsed by interpreting their parts instead.
+  """
+  COMPILE = True
   FUNCTION = re.compile(r'\s*\{\{\s*(.*?)\s*\}\}')
   # For a full tag syntax exlanation, refer to the TAG regex in TemplateTag.
   TAG = re.compile("""
@@ -255,6 +251,7 @@ class Template(list):
     super(Template, self).__init__()
     self.parser = parser
     self.scopes = [self]
+    self._renderers = {}
     self.AddString(raw_template)
 
   def __eq__(self, other):
@@ -265,6 +262,12 @@ class Template(list):
     """
     return isinstance(other, Template) and str(other) == str(self)
 
+  def __getstate__(self):
+    """Returns the state for pickling, without the compiled render functions."""
+    state = self.__dict__.copy()
+    state['_renderers'] = {}
+    return state
+
   def __mod__(self, kwds):
     """Syntactic sugar that enables percent-sign template parsing.
 
@@ -300,6 +303,7 @@ class Template(list):
     Raises:
       TemplateSyntaxError: Unbalanced number of scopes in added template.
     """
+    self._renderers = {}
     scope_depth = len(self.scopes)
     nodes = self.FUNCTION.split(raw_template)
     for index, node in enumerate(nodes):
@@ -313,13 +317,51 @@ class Template(list):
         raise TemplateSyntaxError('Closed %d scopes too many' % abs(scope_diff))
       raise TemplateSyntaxError('Template left %d open scopes.' % scope_diff)
 
+  def Compile(self, stream=False):
+    """Returns the function that renders the template, compiling it if needed.
+
+    The function takes a dictionary of replacements, and returns a list of
+    strings that together make up the parsed template. For `stream`, it is a
+    generator that yields the parsed template in chunks instead.
+    """
+    try:
+      return self._renderers[stream]
+    except KeyError:
+      renderer = TemplateCompiler(stream=stream).Compile(self)
+      self._renderers[stream] = renderer
+      return renderer
+
+  def Iterate(self, **kwds):
+    """Returns an iterator that yields the parsed template in chunks.
+
+    Inlined templates start a new chunk, as do loops that have produced a fair
+    amount of output. Without compiling, each of the template's members is
+    yielded as it is parsed, and each iteration of its loops.
+    """
+    if self.COMPILE:
+      return self.Compile(stream=True)(kwds)
+    return self._IterateParts(kwds)
+
   def Parse(self, **kwds):
     """Returns the parsed template as SafeString.
 
-    The template is parsed by parsing each of its members and combining that.
+    The template is parsed by its compiled function, or if compiling is
+    disabled, by parsing each of its members and combining that.
     """
+    if self.COMPILE:
+      return SafeString(''.join(self.Compile()(kwds)))
     return SafeString(''.join(tag.Parse(**kwds) for tag in self))
 
+  def _IterateParts(self, kwds):
+    """Yields the parsed members of the template, streaming inlined templates
+    and loops."""
+    for part in self:
+      if isinstance(part, (Template, TemplateLoop)):
+        for chunk in part.Iterate(**kwds):
+          yield chunk
+      else:
+        yield part.Parse(**kwds)
+
   @classmethod
   def TagSplit(cls, template):
     """Yields the TemplateTag and TemplateText nodes from a template string."""
@@ -394,6 +436,7 @@ class Template(list):
   #
   def _AddToOpenScope(self, item):
     """Adds a template part to the current open scope."""
+    self._renderers = {}
     self.scopes[-1].append(item)
 
   def _CloseScope(self, scope_cls):
@@ -438,6 +481,7 @@ class FileTemplate(Template):
     try:
       self._file_name = os.path.abspath(template_path)
       self._file_mtime = os.path.getmtime(self._file_name)
+      self._file_size = os.path.getsize(self._file_name)
       raw_template = file(self._file_name).read()
       super(FileTemplate, self).__init__(raw_template, parser=parser)
     except (IOError, OSError):
@@ -451,6 +495,14 @@ class FileTemplate(Template):
     self.ReloadIfModified()
     return super(FileTemplate, self).Parse(**kwds)
 
+  def Iterate(self, **kwds):
+    """Returns an iterator that yields the parsed template in chunks.
+
+    The template is reloaded first if it was modified on disk.
+    """
+    self.ReloadIfModified()
+    return super(FileTemplate, self).Iterate(**kwds)
+
   def ReloadIfModified(self):
     """Reloads the template file if it was modified on disk.
 
@@ -464,24 +516,185 @@ class FileTemplate(Template):
     try:
       mtime = os.path.getmtime(self._file_name)
       if mtime > self._file_mtime:
+        size = os.path.getsize(self._file_name)
         template = file(self._file_name).read()
         del self[:]
         self.scopes = [self]
         self.AddString(template)
         self._file_mtime = mtime
+        self._file_size = size
     except (IOError, OSError):
       # File cannot be stat'd or read. No longer exists or we lack permissions.
       # We shouldn't error in this case, but carry on with the template we have.
       pass
 
 
+class TemplateCache(object):
+  """Keeps parsed templates on disk, so they can be loaded without parsing.
+
+  Every template file has its own entry in the cache directory, named after a
+  hash of its absolute path. An entry holds the modification time and size of
+  the file when it was parsed, and is only used while the file still has those.
+  The parsed FileTemplate is pickled with its parts, which includes any inlined
+  templates. Conditions are stored as marshalled code, so entries are only used
+  by the Python version that wrote them. Render functions are left out, these
+  are compiled again when the template is first parsed.
+
+  A template's reference to its parser is not stored, templates loaded from the
+  cache refer to the parser that loads them instead.
+  """
+  EXTENSION = '.tmplcache'
+  VERSION = 1
+
+  def __init__(self, directory):
+    """Initializes a TemplateCache, creating its directory if needed.
+
+    Arguments:
+      @ directory: str
+        The directory to keep the cached templates in.
+    """
+    self.directory = os.path.abspath(directory)
+    try:
+      os.makedirs(self.directory)
+    except OSError, error:
+      if error.errno != errno.EEXIST:
+        raise
+
+  def EntryPath(self, template_path):
+    """Returns the filename of the cache entry for the given template file."""
+    digest = hashlib.sha1(os.path.abspath(template_path)).hexdigest()
+    return os.path.join(self.directory, digest + self.EXTENSION)
+
+  @staticmethod
+  def FileKey(template_path):
+    """Returns the (path, mtime, size) key of the template file as it is now.
+
+    Raises:
+      OSError: The template file cannot be stat'd.
+    """
+    template_path = os.path.abspath(template_path)
+    stat = os.stat(template_path)
+    return template_path, stat.st_mtime, stat.st_size
+
+  def Get(self, template_path, parser=None):
+    """Returns the cached template for the file, or None if it's not current.
+
+    Entries that cannot be read or unpickled are treated as missing.
+
+    Arguments:
+      @ template_path: str
+        The filename of the template.
+      % parser: Parser ~~ None
+        The parser that the loaded template should refer to.
+    """
+    try:
+      key = self.FileKey(template_path)
+      with file(self.EntryPath(template_path), 'rb') as entry:
+        unpickler = cPickle.Unpickler(entry)
+        unpickler.persistent_load = lambda _pid: parser
+        if unpickler.load() != (self.VERSION, imp.get_magic(), key):
+          return None
+        return unpickler.load()
+    except Exception:
+      return None
+
+  def Load(self, template_path, parser=None):
+    """Returns the template for the file, from the cache if it's current.
+
+    Otherwise the file is parsed into a FileTemplate, which is then stored.
+
+    Arguments:
+      @ template_path: str
+        The filename of the template.
+      % parser: Parser ~~ None
+        The parser for the template, used for {{ inline }}.
+
+    Raises:
+      TemplateReadError: The template file could not be read.
+    """
+    template = self.Get(template_path, parser=parser)
+    if template is None:
+      template = FileTemplate(template_path, parser=parser)
+      self.Store(template)
+    return template
+
+  def Store(self, template):
+    """Writes the FileTemplate to the cache, replacing any existing entry.
+
+    The entry is written to a temporary file first, and then renamed, so that
+    other processes never read a partial entry. Failing to write an entry is
+    not an error, the template is simply not cached.
+
+    Returns:
+      bool: Whether the template was stored.
+    """
+    # Accessing protected members of a friendly class.
+    # pylint: disable=W0212
+    key = template._file_name, template._file_mtime, template._file_size
+    # pylint: enable=W0212
+    try:
+      handle, temp_path = tempfile.mkstemp(
+          dir=self.directory, suffix=self.EXTENSION + '.tmp')
+    except (IOError, OSError):
+      return False
+    try:
+      with os.fdopen(handle, 'wb') as entry:
+        pickler = cPickle.Pickler(entry, cPickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = self._PersistentId
+        pickler.dump((self.VERSION, imp.get_magic(), key))
+        pickler.dump(template)
+      os.rename(temp_path, self.EntryPath(key[0]))
+      return True
+    except (IOError, OSError, cPickle.PicklingError, TypeError):
+      os.unlink(temp_path)
+      return False
+
+  @staticmethod
+  def _PersistentId(obj):
+    """Returns an ID for parsers, which are left out of the pickled template."""
+    if isinstance(obj, Parser):
+      return 'parser'
+    return None
+
+
 class TemplateConditional(object):
-  """A template construct to control flow based on the value of a tag."""
+  """A template construct to control flow based on the value of a tag.
+
+  The expression of each branch is compiled to a function when the branch is
+  added. These are kept in `conditions`, in the order of `branches`, and take
+  the dictionary of replacements as their only argument.
+  """
+  CONDITION = """def __tmpl_condition(__tmpl_values%s):
+  try:
+    return (%s)
+  except NameError, error:
+    raise TemplateNameError(str(error).capitalize() + '. Try it as tagname?')
+"""
+
   def __init__(self, expr):
     self.branches = []
+    self.conditions = []
     self.default = None
     self.NewBranch(expr)
 
+  def __getstate__(self):
+    """Returns the state for pickling, with the conditions' code marshalled.
+
+    Functions cannot be pickled, but by keeping their code the conditions need
+    not be compiled again when they are unpickled.
+    """
+    state = self.__dict__.copy()
+    state['conditions'] = marshal.dumps(
+        [condition.func_code for condition in self.conditions])
+    return state
+
+  def __setstate__(self, state):
+    """Restores the pickled state, and the conditions from their code."""
+    codes = marshal.loads(state.pop('conditions'))
+    self.__dict__.update(state)
+    self.conditions = [self.CompileCondition(expr, code=code)
+                       for (expr, _branch), code in zip(self.branches, codes)]
+
   def __repr__(self):
     repr_branches = []
     for expr, branch in self.branches:
@@ -533,43 +746,73 @@ class TemplateConditional(object):
     self.default = []
 
   @staticmethod
-  def Expression(expr, **kwds):
-    """Returns the eval()'ed result of a tag expression."""
+  def CompileCondition(expr, code=None):
+    """Returns a function that evaluates the tag expression for replacements.
+
+    Each tag in the expression becomes a call to its GetValue method, which is
+    bound to the function as a default argument. Tags are only looked up when
+    the expression gets to them, so `and` and `or` still short-circuit.
+
+    Given the `code` of an earlier condition for the same expression, the
+    function is made from that, rather than compiled again.
+
+    Raises:
+      TemplateSyntaxError: The expression is not a valid Python expression.
+    """
     nodes = []
-    local_vars = LazyTagValueRetrieval(kwds)
+    accessors = {}
     for num, node in enumerate(expr):
       if isinstance(node, TemplateTag):
         node_name = '__tmpl_var_%d' % num
-        local_vars[node_name] = node
-        nodes.append(node_name)
+        accessors[node_name] = node.GetValue
+        nodes.append('%s(__tmpl_values)' % node_name)
       else:
         nodes.append(node)
+    if code is not None:
+      return types.FunctionType(code, globals(), code.co_name, tuple(
+          accessors[name] for name in code.co_varnames[1:code.co_argcount]))
+    expression = ''.join(nodes)
     try:
-      #XXX(Elmer): This uses eval, it's so much easier than lexing and parsing
-      return eval(''.join(nodes), None, local_vars)
-    except NameError, error:
-      raise TemplateNameError(str(error).capitalize() + '. Try it as tagname?')
+      compile(expression, '<template expression>', 'eval')
+    except SyntaxError:
+      raise TemplateSyntaxError(
+          'Invalid expression: %r' % ''.join(map(str, expr)))
+    # Only the template's own expression text ends up in the executed source,
+    # and it was checked to be an expression above. Tag values are looked up
+    # through the accessors bound as default arguments, so replacement values
+    # are never part of the source and cannot inject code.
+    exec TemplateConditional.CONDITION % (
+        ''.join(', %s=%s' % (name, name) for name in accessors),
+        expression) in globals(), accessors
+    return accessors['__tmpl_condition']
+
+  @classmethod
+  def Expression(cls, expr, **kwds):
+    """Returns the result of a tag expression for the given replacements."""
+    return cls.CompileCondition(expr)(kwds)
 
   def NewBranch(self, expr):
     """Begins a new branch based on the given expression."""
-    self.branches.append((tuple(Template.TagSplit(expr)), []))
+    expr = tuple(Template.TagSplit(expr))
+    self.conditions.append(self.CompileCondition(expr))
+    self.branches.append((expr, []))
 
   def Parse(self, **kwds):
     """Returns the TemplateConditional parsed as string.
 
     One by one, the `if` clause and optional `elif` clauses are evaluated.
-    Their strings are parsed (template tags replaced, though functions are NOT
-    processed) and the resulting expression evaluated. Strings passed into the
+    Their compiled conditions look up the tag values (functions are NOT
+    processed) and evaluate the expression. Strings passed into the
     templateparser will be strings for evaluation (not literal code), so this
     is safe with regards to users executing code in the templateparser scope.
 
-    Whenever a boolean True value is returned from eval, the corresponding
+    Whenever a condition returns a boolean True value, the corresponding
     branch is parsed and returned. When none of the `if` or `elif` clauses
     is True, the `else` branch is parsed and returned (where available, if no
     `else` branch exists '' is returned.
     """
-    for expr, branch in self.branches:
-      if self.Expression(expr, **kwds):
+    for condition, (_expr, branch) in zip(self.conditions, self.branches):
+      if condition(kwds):
         return ''.join(part.Parse(**kwds) for part in branch)
     if self.default:
       return ''.join(part.Parse(**kwds) for part in self.default)
@@ -579,18 +822,27 @@ class TemplateConditional(object):
 class TemplateConditionalPresence(TemplateConditional):
   """A template construct to safely check for the presence of tags."""
   @staticmethod
-  def Expression(tags, **kwds):
-    """Checks the presence of all tags named on the branch."""
-    try:
-      for tag in tags:
-        tag.GetValue(kwds)
-      return True
-    except (TemplateKeyError, TemplateNameError):
-      return False
+  def CompileCondition(tags, code=None):
+    """Returns a function that checks the presence of all tags on the branch.
+
+    This function is a closure, so there is no use for the `code` of an
+    earlier one; it is always made anew.
+    """
+    accessors = [tag.GetValue for tag in tags]
+    def _Present(values):
+      try:
+        for accessor in accessors:
+          accessor(values)
+        return True
+      except (TemplateKeyError, TemplateNameError):
+        return False
+    return _Present
 
   def NewBranch(self, tags):
     """Begins a new branch based on the given tags."""
-    self.branches.append((map(TemplateTag.FromString, tags.split()), []))
+    tags = map(TemplateTag.FromString, tags.split())
+    self.conditions.append(self.CompileCondition(tags))
+    self.branches.append((tags, []))
 
 
 class TemplateLoop(list):
@@ -633,22 +885,32 @@ class TemplateLoop(list):
     iterable, all members of the TemplateLoop body will be parsed, with the
     item from the iterable added to the replacements dict as alias(es).
     """
-    output = []
+    return ''.join(self.Iterate(**kwds))
+
+  def Iterate(self, **kwds):
+    """Yields the parsed loop body for each item of the loop tag's iterable."""
     replacements = kwds.copy()
     for item in self.tag.Iterator(**kwds):
       if self.aliascount == 1:
         replacements[self.aliases[0]] = item
       else:
-        try:
-          if self.aliascount != len(item):
-            raise TemplateValueError('Cannot unpack %d values into %d tags' % (
-                len(item), self.aliascount))
-        except TypeError:
-          raise TemplateValueError(
-              'Cannot unpack %s into %d tags' % (type(item), self.aliascount))
-        replacements.update(zip(self.aliases, item))
-      output.append(''.join(tag.Parse(**replacements) for tag in self))
-    return ''.join(output)
+        replacements.update(self.Unpack(item))
+      yield ''.join(tag.Parse(**replacements) for tag in self)
+
+  def Unpack(self, item):
+    """Returns (alias, value) pairs for a loop item that is unpacked.
+
+    Raises:
+      TemplateValueError: The item has the wrong number of values to unpack.
+    """
+    try:
+      if self.aliascount != len(item):
+        raise TemplateValueError('Cannot unpack %d values into %d tags' % (
+            len(item), self.aliascount))
+    except TypeError:
+      raise TemplateValueError(
+          'Cannot unpack %s into %d tags' % (type(item), self.aliascount))
+    return zip(self.aliases, item)
 
 
 class TemplateTag(object):
@@ -656,7 +918,12 @@ class TemplateTag(object):
 
   Their final value is determined during parsing. For more explanation on this,
   refer to the documentation for Parse().
+
+  The arguments of closure functions are parsed once, when the tag is made.
+  The functions themselves are resolved on first use, and again whenever
+  `functions_version` has changed, which Parser.RegisterFunction() does.
   """
+  functions_version = 0
   PFX_INDEX = ':'
   PFX_FUNCT = '|'
   TAG = re.compile("""
@@ -685,6 +952,15 @@ class TemplateTag(object):
     self.name = name
     self.indices = indices
     self.functions = functions
+    self.closures = tuple(map(self._ParseFunction, functions))
+    self._chain = ()
+    self._chain_version = None
+
+  def __getstate__(self):
+    """Returns the state for pickling, without the resolved functions."""
+    state = self.__dict__.copy()
+    state.update(_chain=(), _chain_version=None)
+    return state
 
   def __repr__(self):
     return '%s(%r)' % (type(self).__name__, str(self))
@@ -740,17 +1016,59 @@ class TemplateTag(object):
       raise TemplateNameError('No replacement with name %r' % self.name)
 
   @classmethod
-  def ApplyFunction(cls, func, value):
+  def _ParseFunction(cls, func):
+    """Returns the name of a tag function, and the arguments of its closure.
+
+    The arguments are None if the function is not a closure. They are parsed
+    as Python literals, separated by commas; named arguments are not allowed.
+
+    Raises:
+      TemplateSyntaxError: The arguments are not a valid sequence of literals.
+    """
     closure = cls.FUNC_CLOSURE.match(func)
+    if not closure:
+      return func, None
+    func, args = closure.groups()
+    if not args.strip():
+      return func, ()
     try:
-      if not closure:
-        return TAG_FUNCTIONS[func](value)
-      func, args = closure.groups()
-      #XXX(Elmer): This uses eval, it's so much easier than lexing and parsing
-      args = eval(args + ',') if args.strip() else ()
-      return TAG_FUNCTIONS[func](*args)(value)
-    except SyntaxError:
+      return func, ast.literal_eval(args.strip() + ',')
+    except (SyntaxError, ValueError):
       raise TemplateSyntaxError('Invalid argument syntax: %r' % args)
+
+  @staticmethod
+  def _ResolveFunction(func, args):
+    """Returns the registered function, or the closure it makes for `args`."""
+    if args is None:
+      return TAG_FUNCTIONS[func]
+    return TAG_FUNCTIONS[func](*args)
+
+  @classmethod
+  def ApplyFunction(cls, func, value):
+    """Returns the value after applying a single tag function to it."""
+    try:
+      return cls._ResolveFunction(*cls._ParseFunction(func))(value)
+    except TypeError, err_obj:
+      raise TemplateTypeError(err_obj)
+    except KeyError, err_obj:
+      raise TemplateNameError(
+          'Unknown template tag function %r' % err_obj.args[0])
+
+  def ApplyFunctions(self, value):
+    """Returns the value after applying the tag's functions in turn.
+
+    Raises:
+      TemplateNameError: One of the functions is not registered.
+      TemplateTypeError: A function was given the wrong (number of) arguments.
+    """
+    try:
+      if self._chain_version != TemplateTag.functions_version:
+        self._chain = tuple(
+            self._ResolveFunction(func, args) for func, args in self.closures)
+        self._chain_version = TemplateTag.functions_version
+      for function in self._chain:
+        value = function(value)
+      return value
     except TypeError, err_obj:
       raise TemplateTypeError(err_obj)
     except KeyError, err_obj:
@@ -773,8 +1091,8 @@ class TemplateTag(object):
     They will only be acted upon by functions as specified in the tag.
 
     All tag functions are derived from the module constant TAG_FUNCTIONS, and
-    are looked up when requested. This means that if a function is changed after
-    the template has been created, the new function will be used instead.
+    are looked up when first needed. If a function is changed through the
+    Parser's RegisterFunction() after that, the new function is used instead.
     """
     try:
       value = self.GetValue(kwds)
@@ -783,8 +1101,7 @@ class TemplateTag(object):
       return str(self)
     # Process functions, or apply default if value is not SafeString
     if self.functions:
-      for func in self.functions:
-        value = self.ApplyFunction(func, value)
+      value = self.ApplyFunctions(value)
     else:
       if not isinstance(value, SafeString):
         value = TAG_FUNCTIONS['default'](value)
@@ -804,9 +1121,7 @@ class TemplateTag(object):
     except TemplateKeyError:
       # On any failure to get the given index, return an empty iterator
       return ()
-    for func in self.functions:
-      value = TAG_FUNCTIONS[func](value)
-    return iter(value)
+    return iter(self.ApplyFunctions(value))
 
 
   @staticmethod
@@ -825,14 +1140,14 @@ class TemplateTag(object):
     Returns:
       obj: the object existing on `needle` in `haystack`.
       """
+    if needle.isdigit():
+      return TemplateTag._GetNumericIndex(haystack, needle, int(needle))
+    return TemplateTag._GetNamedIndex(haystack, needle)
+
+  @staticmethod
+  def _GetNamedIndex(haystack, needle):
+    """Returns the `needle` from the `haystack` by key or attribute name."""
     try:
-      if needle.isdigit():
-        try:
-          # `needle` is a number; likely an index or a numeric dict-key.
-          return haystack[int(needle)]
-        except KeyError:
-          # `haystack` should be a dict; numeric attributes are invalid syntax.
-          return haystack[needle]
       try:
         # `needle` is a string; either a dict-key, or an attribute name.
         return haystack[needle]
@@ -843,6 +1158,19 @@ class TemplateTag(object):
     except (AttributeError, LookupError):
       raise TemplateKeyError('Item has no index, key or attribute %r.' % needle)
 
+  @staticmethod
+  def _GetNumericIndex(haystack, needle, number):
+    """Returns the `needle` from the `haystack` by index or numeric key."""
+    try:
+      try:
+        # `needle` is a number; likely an index or a numeric dict-key.
+        return haystack[number]
+      except KeyError:
+        # `haystack` should be a dict; numeric attributes are invalid syntax.
+        return haystack[needle]
+    except (AttributeError, LookupError):
+      raise TemplateKeyError('Item has no index, key or attribute %r.' % needle)
+
 
 class TemplateText(str):
   """A raw piece of template text, upon which no replacements will be done."""
@@ -860,6 +1188,154 @@ class TemplateText(str):
     return str(self)
 
 
+class TemplateCompiler(object):
+  """Generates and compiles a Python function that renders a Template.
+
+  The function takes the dictionary of replacements and returns a list of
+  strings, giving exactly the output of parsing the template part by part.
+  Adjacent texts are merged, tag indices are resolved to the lookup they need,
+  and loops become native `for` loops that test the precompiled conditions of
+  conditionals directly. Tag functions and inlined templates are left to the
+  parts themselves, as is rendering any part that the compiler has no code for.
+
+  A streaming function is a generator instead, which yields the output so far
+  before each inlined template (which is then streamed in turn), after each
+  loop iteration that brings the output to `CHUNK_PARTS` strings, and at the
+  end of the template.
+  """
+  CHUNK_PARTS = 1000
+
+  def __init__(self, stream=False):
+    self.stream = stream
+    self.lines = []
+    self.namespace = {}
+    self.scopes = 0
+
+  def Compile(self, template):
+    """Returns the render function for the given template."""
+    self.lines = ['def _Render(_scope_0):',
+                  '  _output = []',
+                  '  _append = _output.append']
+    self.namespace = {
+        # Accessing protected members of a friendly class.
+        # pylint: disable=W0212
+        '_GetNamedIndex': TemplateTag._GetNamedIndex,
+        '_GetNumericIndex': TemplateTag._GetNumericIndex,
+        # pylint: enable=W0212
+        'SafeString': SafeString,
+        'TAG_FUNCTIONS': TAG_FUNCTIONS,
+        'TemplateKeyError': TemplateKeyError}
+    self._Block(template, '_scope_0', 1)
+    if self.stream:
+      self._Flush(1)
+    else:
+      self.lines.append('  return _output')
+    exec compile(self.Source(), '<template>', 'exec') in self.namespace
+    return self.namespace['_Render']
+
+  def Source(self):
+    """Returns the source code of the last compiled render function."""
+    return '\n'.join(self.lines) + '\n'
+
+  def _Block(self, parts, scope, depth):
+    """Adds the code that renders the template parts, using the given scope."""
+    start = len(self.lines)
+    texts = []
+    for part in parts:
+      if isinstance(part, TemplateText):
+        texts.append(str(part))
+        continue
+      if texts:
+        self._Emit(depth, '_append(%r)' % ''.join(texts))
+        texts = []
+      if isinstance(part, TemplateTag):
+        self._Tag(part, scope, depth)
+      elif isinstance(part, TemplateConditional):
+        self._Conditional(part, scope, depth)
+      elif isinstance(part, TemplateLoop):
+        self._Loop(part, scope, depth)
+      elif self.stream and isinstance(part, Template):
+        self._Flush(depth)
+        self._Emit(depth, 'for _chunk in %s.Iterate(**%s):' % (
+            self._Part(part), scope))
+        self._Emit(depth + 1, 'yield _chunk')
+      else:
+        self._Emit(depth, '_append(%s.Parse(**%s))' % (self._Part(part), scope))
+    if texts:
+      self._Emit(depth, '_append(%r)' % ''.join(texts))
+    if len(self.lines) == start:
+      self._Emit(depth, 'pass')
+
+  def _Conditional(self, conditional, scope, depth):
+    """Adds an if/elif/else statement for the branches of a conditional."""
+    for number, (_expr, branch) in enumerate(conditional.branches):
+      self._Emit(depth, '%s %s(%s):' % (
+          'elif' if number else 'if',
+          self._Part(conditional.conditions[number]), scope))
+      self._Block(branch, scope, depth + 1)
+    if conditional.default:
+      self._Emit(depth, 'else:')
+      self._Block(conditional.default, scope, depth + 1)
+
+  def _Emit(self, depth, line):
+    """Adds a line of code at the given indentation depth."""
+    self.lines.append('  ' * depth + line)
+
+  def _Flush(self, depth, size=0):
+    """Adds code that yields the output so far, if it is more than `size`."""
+    self._Emit(depth, 'if len(_output) > %d:' % size)
+    self._Emit(depth + 1, "yield ''.join(_output)")
+    self._Emit(depth + 1, 'del _output[:]')
+
+  def _Loop(self, loop, scope, depth):
+    """Adds a for loop, whose body renders with the loop aliases in scope."""
+    name = self._Part(loop)
+    self.scopes += 1
+    loop_scope = '_scope_%d' % self.scopes
+    item = '_item_%d' % self.scopes
+    self._Emit(depth, '%s = %s.copy()' % (loop_scope, scope))
+    self._Emit(depth, 'for %s in %s.tag.Iterator(**%s):' % (item, name, scope))
+    if loop.aliascount == 1:
+      self._Emit(depth + 1, '%s[%r] = %s' % (loop_scope, loop.aliases[0], item))
+    else:
+      self._Emit(depth + 1, '%s.update(%s.Unpack(%s))' % (
+          loop_scope, name, item))
+    self._Block(loop, loop_scope, depth + 1)
+    if self.stream:
+      self._Flush(depth + 1, self.CHUNK_PARTS - 1)
+
+  def _Part(self, part):
+    """Returns the name under which the part is available to the function."""
+    name = '_part_%d' % len(self.namespace)
+    self.namespace[name] = part
+    return name
+
+  def _Tag(self, tag, scope, depth):
+    """Adds the lookup of the tag's value, and the functions applied to it.
+
+    Tags that cannot be resolved are rendered as they are written.
+    """
+    self._Emit(depth, 'try:')
+    self._Emit(depth + 1, '_value = %s[%r]' % (scope, tag.name))
+    for index in tag.indices:
+      if index.isdigit():
+        self._Emit(depth + 1, '_value = _GetNumericIndex(_value, %r, %d)' % (
+            index, int(index)))
+      else:
+        self._Emit(depth + 1, '_value = _GetNamedIndex(_value, %r)' % index)
+    self._Emit(depth, 'except (KeyError, TemplateKeyError):')
+    self._Emit(depth + 1, '_append(%r)' % str(tag))
+    self._Emit(depth, 'else:')
+    if tag.functions:
+      self._Emit(depth + 1, '_value = %s.ApplyFunctions(_value)' % (
+          self._Part(tag)))
+    else:
+      self._Emit(depth + 1, 'if not isinstance(_value, SafeString):')
+      self._Emit(depth + 2, "_value = TAG_FUNCTIONS['default'](_value)")
+    self._Emit(depth + 1, "_append(_value.encode('utf8') "
+                          "if isinstance(_value, unicode) else str(_value))")
+
+
 def HtmlEscape(text):
   """Escapes the 5 characters deemed by XML to be unsafe if left unescaped.
 
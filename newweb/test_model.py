@@ -5,12 +5,17 @@
 # pylint: disable=R0904
 
 # Standard modules
+import os
+import shutil
+import tempfile
 import unittest
 
 # Custom modules
 import newweb
 # Importing newWeb makes the SQLTalk library available as a side-effect
 from underdark.libs.sqltalk import mysql
+from underdark.libs.sqltalk import routing
+from underdark.libs.sqltalk import sqlite
 
 # Unittest target
 from . import model
@@ -49,6 +54,11 @@ class Compounded(model.Record):
   _PRIMARY_KEY = 'first', 'second'
 
 
+class Article(model.SearchableRecord):
+  """Article class with full-text search on its title and body."""
+  _SEARCH_FIELDS = 'title', 'body'
+
+
 # ##############################################################################
 # Start of tests
 #
@@ -86,6 +96,18 @@ class BaseRecordTests(unittest.TestCase):
     self.assertNotEqual(record_one, record_three)
     self.assertNotEqual(record_one, record_four)
 
+  def testPrimaryKeyValues(self):
+    """[BaseRecord] Compound key values are checked against the key fields"""
+    self.assertEqual(Compounded._PrimaryKeyValues((1, 2)),
+                     (('first', 'second'), [1, 2]))
+    self.assertRaises(TypeError, Compounded._PrimaryKeyValues, 1)
+    try:
+      Compounded._PrimaryKeyValues((1, 2, 3))
+      self.fail('ValueError not raised for three key values.')
+    except ValueError, error:
+      self.assertEqual(str(error),
+                       'Wrong number of values (3) for compound key.')
+
 
 class RecordTests(unittest.TestCase):
   """Online tests of methods and behavior of the Record class."""
@@ -429,6 +451,135 @@ class CompoundKeyRecordTests(unittest.TestCase):
         self.connection, {'first': 2, 'second': 1, 'message': 'Break stuff'})
 
 
+class SearchableRecordTests(unittest.TestCase):
+  """Tests of the full-text search index of SearchableRecord, on SQLite."""
+  def setUp(self):
+    """Sets up an article table and its search index."""
+    self.directory = tempfile.mkdtemp()
+    self.connection = sqlite.Connect(os.path.join(self.directory, 'test.db'))
+    with self.connection as cursor:
+      cursor.Execute("""CREATE TABLE `article` (
+                            `ID` INTEGER PRIMARY KEY,
+                            `title` TEXT NOT NULL,
+                            `body` TEXT NOT NULL,
+                            `views` INTEGER NOT NULL DEFAULT 0)""")
+      cursor.Insert('article', {'title': 'Existing', 'body': 'Indexed later'})
+    Article.CreateSearchIndex(self.connection)
+
+  def tearDown(self):
+    """Removes the database after testing."""
+    self.connection.close()
+    shutil.rmtree(self.directory)
+
+  def Titles(self, query, **kwds):
+    """Returns the titles of the articles found for the query."""
+    return [article['title'] for article
+            in Article.Search(self.connection, query, **kwds)]
+
+  def testCreateSearchIndex(self):
+    """[Search] Creating the index adds the existing records to it"""
+    self.assertEqual(self.Titles('indexed'), ['Existing'])
+    Article.CreateSearchIndex(self.connection)
+    self.assertEqual(self.Titles('indexed'), ['Existing'])
+
+  def testCreate(self):
+    """[Search] Created records can be found"""
+    article = Article.Create(self.connection, {
+        'title': 'Full-text search', 'body': 'Finding words in text'})
+    found = list(Article.Search(self.connection, 'words'))
+    self.assertEqual([record.key for record in found], [article.key])
+    self.assertEqual(type(found[0]), Article)
+
+  def testRanking(self):
+    """[Search] Records are returned best match first, up to the limit"""
+    Article.Create(self.connection, {
+        'title': 'Gardening', 'body': 'Tomatoes need sun and some water'})
+    Article.Create(self.connection, {
+        'title': 'Tomatoes', 'body': 'Tomatoes, tomatoes and more tomatoes'})
+    self.assertEqual(self.Titles('tomatoes'), ['Tomatoes', 'Gardening'])
+    self.assertEqual(self.Titles('tomatoes', limit=1), ['Tomatoes'])
+    self.assertEqual(self.Titles('tomatoes AND sun'), ['Gardening'])
+
+  def testSave(self):
+    """[Search] Saving changes to searched fields updates the index"""
+    article = Article.Create(self.connection, {
+        'title': 'Draft', 'body': 'Lorem ipsum'})
+    article['body'] = 'Dolor sit amet'
+    article.Save()
+    self.assertEqual(self.Titles('lorem'), [])
+    self.assertEqual(self.Titles('dolor'), ['Draft'])
+    article['views'] = 10
+    article.Save()
+    self.assertEqual(self.Titles('dolor'), ['Draft'])
+
+  def testDelete(self):
+    """[Search] Deleted records are removed from the index"""
+    article = Article.Create(self.connection, {
+        'title': 'Ephemeral', 'body': 'Soon gone'})
+    article.Delete()
+    Article.DeletePrimary(self.connection, 1)
+    self.assertEqual(self.Titles('gone OR indexed'), [])
+    with self.connection as cursor:
+      self.assertFalse(cursor.Select(Article.SearchTableName()))
+
+  def testCompoundKey(self):
+    """[Search] Records with a compound key cannot be searchable"""
+    class CompoundArticle(Article):
+      """Searchable record with a compound key."""
+      _PRIMARY_KEY = 'ID', 'title'
+    self.assertRaises(
+        TypeError, CompoundArticle.CreateSearchIndex, self.connection)
+
+
+class RoutedRecordTests(unittest.TestCase):
+  """Tests of records on a routing connection, with SQLite as stand-in."""
+  def setUp(self):
+    """Sets up a primary and a replica that lags behind it entirely."""
+    self.directory = tempfile.mkdtemp()
+    self.databases = []
+    for name in ('primary', 'replica'):
+      database = sqlite.Connect(os.path.join(self.directory, name + '.db'))
+      with database as cursor:
+        cursor.Execute("""CREATE TABLE `versionedAuthor` (
+                              `ID` INTEGER PRIMARY KEY,
+                              `versionedAuthorID` INTEGER NOT NULL,
+                              `name` TEXT NOT NULL)""")
+      self.databases.append(database)
+    self.connection = routing.RoutingConnection(
+        routing.Router(self.databases[0], self.databases[1:]))
+
+  def tearDown(self):
+    """Removes the databases after testing."""
+    self.connection.Release()
+    for database in self.databases:
+      database.close()
+    shutil.rmtree(self.directory)
+
+  def Names(self, database):
+    """Returns the author names stored in the given database."""
+    with database as cursor:
+      return [row[0] for row in cursor.Select(
+          'versionedAuthor', fields='name', order=['ID'])]
+
+  def testCreateReadsPrimary(self):
+    """[Routed] Creating records finds the next record key on the primary"""
+    first = VersionedAuthor.Create(self.connection, {'name': 'J. Grisham'})
+    second = VersionedAuthor.Create(self.connection, {'name': 'Z. Gray'})
+    self.assertEqual((first.identifier, second.identifier), (1, 2))
+    self.assertEqual(self.Names(self.databases[0]), ['J. Grisham', 'Z. Gray'])
+    self.assertEqual(self.Names(self.databases[1]), [])
+
+  def testSaveAndDelete(self):
+    """[Routed] Saving and deleting records goes to the primary"""
+    author = VersionedAuthor.Create(self.connection, {'name': 'Z. Gray'})
+    author['name'] = 'Z. Grey'
+    author.Save()
+    self.assertEqual(author.identifier, 1)
+    self.assertEqual(self.Names(self.databases[0]), ['Z. Gray', 'Z. Grey'])
+    author.Delete()
+    self.assertEqual(self.Names(self.databases[0]), ['Z. Gray'])
+    self.assertEqual(self.Names(self.databases[1]), [])
+
 
 def DatabaseConnection():
   """Returns an SQLTalk database connection to 'newweb_model_test'."""
@@ -23,5 +23,26 @@ class RedirectTest(unittest.TestCase):
     self.assertIn('&lt;script&gt;', redirect.text)
 
 
+class StreamingResponseTest(unittest.TestCase):
+  """Tests for responses that have an iterator for content."""
+
+  def testPlainContentIsSingleChunk(self):
+    """Regular string content is produced as a single chunk."""
+    resp = response.Response('Hello world')
+    self.assertFalse(resp.streaming)
+    self.assertEqual(list(resp), ['Hello world'])
+
+  def testIteratorContentIsStreamed(self):
+    """Iterator content is kept as-is and produced chunk by chunk."""
+    resp = response.Response(iter(['Hello', ' ', 'world']))
+    self.assertTrue(resp.streaming)
+    self.assertEqual(list(resp), ['Hello', ' ', 'world'])
+
+  def testStreamedUnicodeIsEncoded(self):
+    """Unicode chunks of streamed content are encoded to the charset."""
+    resp = response.Response(chunk for chunk in [u'caf\xe9', 12])
+    self.assertEqual(list(resp), ['caf\xc3\xa9', '12'])
+
+
 if __name__ == '__main__':
   unittest.main(testRunner=unittest.TextTestRunner(verbosity=2))
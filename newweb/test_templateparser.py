@@ -7,6 +7,8 @@
 # Standard modules
 import os
 import re
+import shutil
+import tempfile
 import time
 import unittest
 
@@ -355,6 +357,14 @@ class TemplateTagFunctions(unittest.TestCase):
     template = '[numbers|len]'
     self.assertEqual(self.parse(template, numbers=range(12)), "12")
 
+  def testReregisterFunction(self):
+    """[TagFunctions] Registering a function again replaces it in templates"""
+    template = templateparser.Template('[word|shout]')
+    self.parser.RegisterFunction('shout', str.upper)
+    self.assertEqual(template.Parse(word='hey'), 'HEY')
+    self.parser.RegisterFunction('shout', lambda word: word + '!')
+    self.assertEqual(template.Parse(word='hey'), 'hey!')
+
 class TemplateTagFunctionClosures(unittest.TestCase):
   """Tests the functions that are performed on replaced tags."""
   @staticmethod
@@ -391,6 +401,12 @@ class TemplateTagFunctionClosures(unittest.TestCase):
     result = self.parse(template, tag=self.tag)
     self.assertEqual(result, self.tag[:20])
 
+  def testWhitespaceAroundArguments(self):
+    """[TagClosures] Arguments may have whitespace around them"""
+    template = '[tag|limit( 5 )]'
+    result = self.parse(template, tag=self.tag)
+    self.assertEqual(result, self.tag[:5])
+
   def testComplexClosureWithoutArguments(self):
     """[TagClosures] Complex tag closure-functions without arguments succeed"""
     template = '[tag|strlimit()]'
@@ -431,6 +447,29 @@ class TemplateTagFunctionClosures(unittest.TestCase):
     self.assertRaises(templateparser.TemplateSyntaxError,
                       self.parse, template, tag=self.tag)
 
+  def testLiteralArguments(self):
+    """[TagClosures] Arguments must be literals, they are not evaluated"""
+    template = '[tag|limit(length)]'
+    self.assertRaises(templateparser.TemplateSyntaxError,
+                      self.parse, template, tag=self.tag)
+
+  def testArgumentsParsedOnce(self):
+    """[TagClosures] Arguments are parsed, and closures made, only once"""
+    tag = templateparser.TemplateTag.FromString(
+        '[tag|strlimit(20, "..")|limit]')
+    self.assertEqual(tag.closures, (('strlimit', (20, '..')), ('limit', None)))
+    closures_made = []
+    def CountingLimit(length):
+      """Returns a Limit closure after adding it to a counter list."""
+      closures_made.append(length)
+      return self.Limit(length)
+
+    self.parser.RegisterFunction('countlimit', CountingLimit)
+    template = templateparser.Template('[tag|countlimit(5)]')
+    for _parse in range(3):
+      self.assertEqual(template.Parse(tag=self.tag), self.tag[:5])
+    self.assertEqual(closures_made, [5])
+
 
 class TemplateUnicodeSupport(unittest.TestCase):
   """TemplateParser handles Unicode gracefully."""
@@ -613,6 +652,22 @@ class TemplateConditionals(unittest.TestCase):
     template = '{{ if [var:present] or [var:absent] }}~ {{ endif }}'
     self.assertEqual(self.parse(template, var={'present': 1}), '~')
 
+  def testCompiledConditions(self):
+    """{{ if }} Each branch has its expression compiled to a condition"""
+    template = templateparser.Template(
+        '{{ if [a] }}a{{ elif [b:0] > 1 }}b{{ endif }}')
+    conditional = template[0]
+    self.assertEqual(len(conditional.conditions), 2)
+    self.assertFalse(conditional.conditions[0]({'a': 0}))
+    self.assertTrue(conditional.conditions[1]({'b': [2]}))
+
+  def testSyntaxErrorExpression(self):
+    """{{ if }} Invalid expressions raise TemplateSyntaxError upon loading"""
+    template = '{{ if [var] == }} foo {{ endif }}'
+    self.assertRaises(templateparser.TemplateSyntaxError, self.parse, template)
+    template = '{{ if [var]); import os; ([var] }} foo {{ endif }}'
+    self.assertRaises(templateparser.TemplateSyntaxError, self.parse, template)
+
 
 class TemplateLoops(unittest.TestCase):
   """TemplateParser properly handles for-loops."""
@@ -866,5 +921,229 @@ class TemplateReloading(unittest.TestCase):
     self.assertEqual(self.parser[self.simple].Parse(), self.simple_raw)
 
 
+class TemplateCaching(unittest.TestCase):
+  """Tests for loading parsed templates from a TemplateCache."""
+  def setUp(self):
+    """Creates a template directory and a cache directory."""
+    self.template_dir = tempfile.mkdtemp()
+    self.cache_dir = os.path.join(self.template_dir, 'cache')
+    self.page = 'page.utp'
+    self.WriteTemplate(self.page,
+        '<h1>[title|upper]</h1>{{ inline item.utp }}'
+        '{{ for row in [rows] }}{{ if [row] > 1 }}[row]{{ elif [row] }}one'
+        '{{ else }}none{{ endif }}{{ ifpresent [extra] }}+{{ endif }}'
+        '{{ endfor }}')
+    self.WriteTemplate('item.utp', '<p>[title]</p>')
+    self.replacements = {'title': 'cached', 'rows': range(4), 'extra': True}
+    templateparser.Parser.RegisterFunction('upper', str.upper)
+
+  def tearDown(self):
+    shutil.rmtree(self.template_dir)
+    del templateparser.TAG_FUNCTIONS['upper']
+
+  def CachingParser(self):
+    """Returns a new Parser for the template directory, using the cache."""
+    return templateparser.Parser(self.template_dir, cache_dir=self.cache_dir)
+
+  def WriteTemplate(self, name, content, mtime=None):
+    """Writes a template file, optionally setting its modification time."""
+    path = os.path.join(self.template_dir, name)
+    with file(path, 'w') as template:
+      template.write(content)
+    if mtime is not None:
+      os.utime(path, (mtime, mtime))
+
+  def testEntryStored(self):
+    """[Caching] Loading a template stores it in the cache directory"""
+    self.CachingParser().AddTemplate(self.page)
+    entry = self.CachingParser().cache.EntryPath(
+        os.path.join(self.template_dir, self.page))
+    self.assertTrue(os.path.exists(entry))
+
+  def testLoadFromCache(self):
+    """[Caching] A cached template is loaded without parsing the file"""
+    self.CachingParser().AddTemplate(self.page)
+    cache = templateparser.TemplateCache(self.cache_dir)
+    path = os.path.join(self.template_dir, self.page)
+    self.assertTrue(cache.Get(path) is not None)
+
+  def testCachedTemplateOutput(self):
+    """[Caching] Templates from the cache parse the same as fresh ones"""
+    expected = templateparser.Parser(self.template_dir).Parse(
+        self.page, **self.replacements)
+    self.CachingParser().Parse(self.page, **self.replacements)
+    parser = self.CachingParser()
+    self.assertEqual(parser.Parse(self.page, **self.replacements), expected)
+    self.assertEqual(''.join(parser.Stream(self.page, **self.replacements)),
+                     expected)
+
+  def testCachedTemplateParser(self):
+    """[Caching] Cached templates refer to the parser that loaded them"""
+    self.CachingParser().AddTemplate(self.page)
+    parser = self.CachingParser()
+    self.assertTrue(parser[self.page].parser is parser)
+
+  def testModifiedTemplate(self):
+    """[Caching] A template is parsed again after its file changed"""
+    self.CachingParser().AddTemplate(self.page)
+    self.WriteTemplate(self.page, 'changed [title]')
+    self.assertEqual(self.CachingParser().Parse(self.page, title='size'),
+                     'changed size')
+
+  def testModifiedTemplateSameSize(self):
+    """[Caching] A template of the same size is parsed again after changing"""
+    self.WriteTemplate('same.utp', 'before', mtime=1000000000)
+    self.CachingParser().AddTemplate('same.utp')
+    self.WriteTemplate('same.utp', 'after!', mtime=1000000100)
+    self.assertEqual(self.CachingParser().Parse('same.utp'), 'after!')
+
+  def testCorruptEntry(self):
+    """[Caching] Unreadable cache entries are replaced by parsing the file"""
+    parser = self.CachingParser()
+    entry = parser.cache.EntryPath(os.path.join(self.template_dir, 'item.utp'))
+    with file(entry, 'w') as cached:
+      cached.write('not a pickle')
+    self.assertEqual(parser.Parse('item.utp', title='ok'), '<p>ok</p>')
+    self.assertTrue(parser.cache.Get(
+        os.path.join(self.template_dir, 'item.utp')) is not None)
+
+  def testMissingTemplate(self):
+    """[Caching] Missing templates raise TemplateReadError"""
+    self.assertRaises(templateparser.TemplateReadError,
+                      self.CachingParser().AddTemplate, 'missing.utp')
+
+
+class TemplateStreaming(unittest.TestCase):
+  """Tests for parsing templates into a stream of chunks."""
+  def setUp(self):
+    """Sets up a testbed."""
+    self.parser = templateparser.Parser()
+    self.tmpl = templateparser.Template
+    self.parser['head'] = self.tmpl('<head><title>[title]</title></head>')
+    self.page = self.tmpl(
+        '<html>{{ inline head }}<body>{{ for row in [rows] }}'
+        '{{ if [row] % 2 }}<p>[row]</p>{{ else }}<br>{{ endif }}{{ endfor }}'
+        '</body></html>', parser=self.parser)
+
+  def testIterateEqualsParse(self):
+    """[Streaming] The chunks of a template add up to the parsed template"""
+    for rows in ([], range(5), range(1000)):
+      chunks = list(self.page.Iterate(title='Numbers', rows=rows))
+      self.assertEqual(''.join(chunks), self.page.Parse(title='Numbers',
+                                                        rows=rows))
+
+  def testLazyParsing(self):
+    """[Streaming] The template is parsed as the chunks are consumed"""
+    consumed = []
+    def Rows():
+      """Yields a few rows, recording that the loop got to them."""
+      for row in range(3):
+        consumed.append(row)
+        yield row
+
+    stream = self.page.Iterate(title='Lazy', rows=Rows())
+    self.assertTrue(next(stream).startswith('<html>'))
+    self.assertEqual(consumed, [])
+    self.assertTrue('<p>1</p>' in ''.join(stream))
+    self.assertEqual(consumed, [0, 1, 2])
+
+  def testStreamFromParser(self):
+    """[Streaming] The Parser streams templates by name"""
+    stream = self.parser.Stream('head', title='Streamed')
+    self.assertEqual(''.join(stream), '<head><title>Streamed</title></head>')
+
+  def testLargeLoopsChunked(self):
+    """[Streaming] Output of large loops is streamed in multiple chunks"""
+    chunks = list(self.page.Iterate(title='Large', rows=range(10000)))
+    self.assertTrue(len(chunks) > 10)
+
+
+class TemplateCompiling(unittest.TestCase):
+  """Tests of the function that templates are compiled into."""
+  def setUp(self):
+    """Sets up a testbed."""
+    self.parser = templateparser.Parser()
+    self.tmpl = templateparser.Template
+
+  def testMergedText(self):
+    """[Compiled] Adjacent text parts are written out as one string"""
+    template = self.tmpl('Hello ')
+    template.AddString('world')
+    compiler = templateparser.TemplateCompiler()
+    compiler.Compile(template)
+    self.assertEqual(compiler.Source().count('_append('), 1)
+    self.assertTrue("_append('Hello world')" in compiler.Source())
+
+  def testNativeLoops(self):
+    """[Compiled] Loops are compiled to for loops without parsing the body"""
+    template = self.tmpl('{{ for num in [numbers] }}[num]{{ endfor }}')
+    compiler = templateparser.TemplateCompiler()
+    compiler.Compile(template)
+    self.assertTrue('for _item_1 in ' in compiler.Source())
+    self.assertFalse('.Parse(' in compiler.Source())
+
+  def testCompiledOnce(self):
+    """[Compiled] The compiled function is kept until the template changes"""
+    template = self.tmpl('Hello [name]')
+    renderer = template.Compile()
+    template.Parse(name='world')
+    self.assertTrue(template.Compile() is renderer)
+    template.AddString(', how are you?')
+    self.assertFalse(template.Compile() is renderer)
+    self.assertEqual(template.Parse(name='Bob'), 'Hello Bob, how are you?')
+
+  def testEqualToInterpreter(self):
+    """[Compiled] Compiled and interpreted templates give the same output"""
+    self.parser['item'] = self.tmpl('<li>[item:0|html]: [item:1]</li>')
+    template = self.tmpl(
+        '<h1>[title]</h1>{{ if [items] }}<ul>{{ for item in [items] }}'
+        '{{ inline item }}{{ endfor }}</ul>{{ else }}none{{ endif }}[x:y]',
+        parser=self.parser)
+    for items in ([], [('a&b', 1), ('c', u'\xb5')]):
+      compiled = template.Parse(title='<Items>', items=items)
+      try:
+        templateparser.Template.COMPILE = False
+        interpreted = template.Parse(title='<Items>', items=items)
+      finally:
+        templateparser.Template.COMPILE = True
+      self.assertEqual(compiled, interpreted)
+
+
+# ##############################################################################
+# The test cases above, using the template interpreter rather than compiling
+#
+def InterpretedTestCase(test_case):
+  """Returns a subclass of the test case that disables template compiling."""
+  class Interpreted(test_case):
+    """Runs the tests with Template.COMPILE disabled."""
+    def run(self, result=None):
+      templateparser.Template.COMPILE = False
+      try:
+        return super(Interpreted, self).run(result)
+      finally:
+        templateparser.Template.COMPILE = True
+
+  Interpreted.__name__ = 'Interpreted' + test_case.__name__
+  return Interpreted
+
+
+InterpretedParser = InterpretedTestCase(Parser)
+InterpretedTemplateTagBasic = InterpretedTestCase(TemplateTagBasic)
+InterpretedTemplateTagIndexed = InterpretedTestCase(TemplateTagIndexed)
+InterpretedTemplateTagFunctions = InterpretedTestCase(TemplateTagFunctions)
+InterpretedTemplateTagFunctionClosures = InterpretedTestCase(
+    TemplateTagFunctionClosures)
+InterpretedTemplateUnicodeSupport = InterpretedTestCase(TemplateUnicodeSupport)
+InterpretedTemplateInlining = InterpretedTestCase(TemplateInlining)
+InterpretedTemplateConditionals = InterpretedTestCase(TemplateConditionals)
+InterpretedTemplateLoops = InterpretedTestCase(TemplateLoops)
+InterpretedTemplateTagPresenceCheck = InterpretedTestCase(
+    TemplateTagPresenceCheck)
+InterpretedTemplateNestedScopes = InterpretedTestCase(TemplateNestedScopes)
+InterpretedTemplateReloading = InterpretedTestCase(TemplateReloading)
+InterpretedTemplateCaching = InterpretedTestCase(TemplateCaching)
+InterpretedTemplateStreaming = InterpretedTestCase(TemplateStreaming)
+
+
 if __name__ == '__main__':
   unittest.main(testRunner=unittest.TextTestRunner(verbosity=2))